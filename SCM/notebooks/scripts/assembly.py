@@ -0,0 +1,362 @@
+# out-of-core assembly of the combined dataset, one month at a time, and the processing of the combined
+# dataset shared by it and the merge cells of 01-get_data_nuc.ipynb
+
+import os
+import glob
+import pandas as pd
+
+from scripts.features import ramp, working_day
+from scripts.profiling import traced
+from scripts.resolution import BASE_FREQ, align, time_index
+
+# columns of the data used for causal inference (data_selected_<zone>_<years>.csv)
+SELECTED_COLUMNS = [
+    "price_da",
+    "price_da_DE_LU",
+    "price_da_IT_NORD",
+    "nuclear_avail",
+    "carbon_price",
+    "gas_price",
+    "solar_da",
+    "load_da",
+    "wind_da",
+    "rl_BE",
+    "rl_DE_LU",
+    "rl_ES",
+    "rl_IT_NORD",
+    "temp_mean",
+    "river_temp",
+    "river_flow_mean",
+    "rl_FR_ramp",
+    "run_off_gen",
+    "agg_net_export",
+    "day_of_year",
+    "hour",
+    "isworkingday",
+]
+
+
+def month_partitions(start, end):
+    """
+    Split a time span into consecutive monthly partitions.
+
+    Parameters:
+    start (pd.Timestamp): The first timestamp of the time span.
+    end (pd.Timestamp): The last timestamp of the time span (included).
+
+    Returns:
+    list: A list of (partition_start, partition_end) tuples. The first and last partition are clipped to start and end.
+    """
+    month_starts = pd.date_range(start.normalize().replace(day=1), end, freq="MS")
+    partitions = []
+    for month_start in month_starts:
+        month_end = month_start + pd.DateOffset(months=1) - pd.Timedelta(1, unit="ns")
+        partitions.append((max(month_start, start), min(month_end, end)))
+    return partitions
+
+
+def partition_name(timestamp):
+    """
+    Name of the monthly partition file a timestamp belongs to.
+
+    Parameters:
+    timestamp (pd.Timestamp): A timestamp inside the partition.
+
+    Returns:
+    str: The file name, e.g. "2018-01.csv".
+    """
+    return f"{timestamp.year:04d}-{timestamp.month:02d}.csv"
+
+
+@traced()
+def partition_csv(path, out_dir, prepare=None, chunksize=100_000, **read_kwargs):
+    """
+    Stream a timestamp indexed CSV file in chunks and split it into one CSV file per month.
+    Only one chunk is held in memory at a time. Existing partition files in out_dir are replaced.
+
+    Parameters:
+    path (str): The path to the CSV file.
+    out_dir (str): The directory the monthly partition files are written to.
+    prepare (callable, optional): Function applied to every chunk. It has to return a DataFrame with a
+        UTC DatetimeIndex. Defaults to parsing the column "timestamp" and setting it as index.
+    chunksize (int, optional): Number of rows read at once. Defaults to 100000.
+    **read_kwargs: Additional keyword arguments passed to pandas.read_csv (e.g. header=[0, 1]).
+
+    Returns:
+    list: The sorted paths of the written partition files.
+    """
+    if prepare is None:
+        prepare = _prepare_timestamp_index
+    os.makedirs(out_dir, exist_ok=True)
+    for old_file in glob.glob(os.path.join(out_dir, "*.csv")):
+        os.remove(old_file)
+
+    written = set()
+    for chunk in pd.read_csv(path, chunksize=chunksize, **read_kwargs):
+        chunk = prepare(chunk)
+        for _, df_month in chunk.groupby([chunk.index.year, chunk.index.month]):
+            file = os.path.join(out_dir, partition_name(df_month.index[0]))
+            df_month.to_csv(file, mode="a", header=file not in written)
+            written.add(file)
+    return sorted(written)
+
+
+def _prepare_timestamp_index(df):
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+    return df.set_index("timestamp")
+
+
+def partition_columns(part_dir):
+    """
+    The columns of a directory of monthly partition files, in the order they first appear. Only the
+    headers of the files are read.
+
+    Parameters:
+    part_dir (str): The directory created by partition_csv.
+
+    Returns:
+    list: The column names (without the timestamp).
+    """
+    columns = {}
+    for file in sorted(glob.glob(os.path.join(part_dir, "*.csv"))):
+        columns.update(dict.fromkeys(pd.read_csv(file, index_col=0, nrows=0).columns))
+    return list(columns)
+
+
+@traced()
+def read_partition(part_dir, start, end, columns=None):
+    """
+    Read the rows between start and end from a directory of monthly partition files.
+    Only the files of the months overlapping [start, end] are read.
+
+    Parameters:
+    part_dir (str): The directory created by partition_csv.
+    start (pd.Timestamp): The first timestamp to read.
+    end (pd.Timestamp): The last timestamp to read (included).
+    columns (list, optional): Columns to keep. Defaults to all columns.
+
+    Returns:
+    pandas.DataFrame: The rows between start and end with a UTC DatetimeIndex.
+    """
+    frames = []
+    for month_start, _ in month_partitions(start, end):
+        file = os.path.join(part_dir, partition_name(month_start))
+        if not os.path.exists(file):
+            continue
+        df = pd.read_csv(file, index_col=0)
+        df.index = pd.to_datetime(df.index, utc=True)
+        df.index.name = "timestamp"
+        if columns is not None:
+            df = df.loc[:, [col for col in columns if col in df.columns]]
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz="utc", name="timestamp"))
+    df = pd.concat(frames)
+    return df.loc[start:end]
+
+
+@traced()
+def assemble_partitioned(
+    sources,
+    start,
+    end,
+    out_path,
+    freq=BASE_FREQ,
+    transform=None,
+    lookback=None,
+    max_period="1h",
+):
+    """
+    Assemble the combined dataset month by month and append every month to one output CSV file.
+    For each month only the slices of the inputs belonging to that month are read, aligned to an
+    index with the given frequency (see resolution.align, e.g. hourly inputs are spread over the
+    quarter hours and quarter-hourly inputs are averaged per hour), joined, optionally transformed
+    and written. Peak memory therefore depends on the length of a month and not on the length of
+    the whole time span.
+
+    Parameters:
+    sources (dict): Maps a source name to either a directory created by partition_csv or a
+        callable (start, end) -> pandas.DataFrame returning the slice of that source.
+        Sources are joined in the given order.
+    start (pd.Timestamp): The first timestamp of the dataset.
+    end (pd.Timestamp): The last timestamp of the dataset (included).
+    out_path (str): The path of the output CSV file. An existing file is replaced.
+    freq (str, optional): The frequency of the index the sources are aligned to, e.g. "h" or "15min".
+        Defaults to BASE_FREQ.
+    transform (callable, optional): Function applied to the joined frame of every month, e.g. to add
+        ramps and calendar features. It receives the month prepended by the lookback rows of the
+        previous month and must return a DataFrame with the same index.
+    lookback (pd.Timedelta, optional): History the transform needs from the previous month,
+        e.g. 1h for ramps or 7d for rolling means. Defaults to no history.
+    max_period (str, optional): The longest time a row of a source holds for when it is aligned, i.e. the
+        coarsest native resolution of the sources. Longer gaps stay missing. Defaults to "1h".
+
+    Returns:
+    list: The column names of the written dataset.
+
+    Raises:
+    ValueError: If a month has columns the first month does not have (e.g. a callable source that only
+        returns columns for some months). The columns of a partitioned source are taken from the headers
+        of all its partition files, months without data have them as missing values.
+    """
+    if os.path.exists(out_path):
+        os.remove(out_path)
+
+    # fixed up front, a source starting after the first month must not be dropped
+    source_columns = {
+        name: partition_columns(source)
+        for name, source in sources.items()
+        if not callable(source)
+    }
+    columns = None
+    carry = None
+    for month_start, month_end in month_partitions(start, end):
+        df_month = pd.DataFrame(index=time_index(month_start, month_end, freq))
+        for name, source in sources.items():
+            if callable(source):
+                df_source = source(month_start, month_end)
+            else:
+                df_source = read_partition(source, month_start, month_end).reindex(
+                    columns=source_columns[name]
+                )
+            df_month = df_month.join(
+                align(
+                    df_source,
+                    freq,
+                    start=month_start,
+                    end=month_end,
+                    max_period=max_period,
+                )
+            )
+
+        if transform is not None:
+            if carry is not None:
+                df_month = pd.concat([carry, df_month])
+            if lookback is not None:
+                carry = df_month.loc[df_month.index[-1] - lookback :].copy()
+            df_month = transform(df_month).loc[month_start:month_end]
+
+        if columns is None:
+            columns = list(df_month.columns)
+        new_columns = [column for column in df_month.columns if column not in columns]
+        if new_columns:
+            raise ValueError(
+                f"{month_start:%Y-%m} has columns that are not in the first month: {new_columns}"
+            )
+        df_month = df_month.reindex(columns=columns)
+        df_month.to_csv(out_path, mode="a", header=not os.path.exists(out_path))
+    return columns
+
+
+def calc_ramps(df, freq=BASE_FREQ):
+    """
+    Add the ramps (ramp(t) = f(t) - f(t - one time step), see features.ramp) of the generation, the
+    day-ahead forecasts and the residual loads, named after the columns.
+
+    Parameters:
+    df (pandas.DataFrame): The combined data.
+    freq (str, optional): The resolution of the data. Defaults to BASE_FREQ.
+
+    Returns:
+    pandas.DataFrame: The data with the ramps.
+    """
+    for column in df.columns:
+        if "gen" in column:
+            df[column.replace("gen", "ramp")] = ramp(df[column], freq)
+        elif "da" in column and column != "price_da":
+            df[column + "_ramp"] = ramp(df[column], freq)
+        elif ("rl_" in column) & ("cutoff" not in column):
+            df[column + "_ramp"] = ramp(df[column], freq)
+    return df
+
+
+def assign_quarters(x):
+    # quarter of the year of a month, 0 to 3
+    return (x - 1) // 3
+
+
+def assign_season(x):
+    # season of a month: 0 spring, 1 summer, 2 autumn, 3 winter
+    return (x - 3) % 12 // 3
+
+
+def assign_quarter_of_day(x):
+    # quarter of the day of an hour, 0 to 3
+    return x // 6
+
+
+def finalize_combined(df, holidays, country_code, freq=BASE_FREQ):
+    """
+    Processing of the joined inputs of the combined dataset: ramps, the 7 day mean temperature, clean up
+    of the columns, aggregated wind, the price difference to IT_NORD and the calendar features. Used by the
+    merge cells of 01-get_data_nuc.ipynb on the whole time span and by the out-of-core assembly on every
+    month (with 7 days of lookback, see assemble_partitioned), so both give the same dataset.
+
+    Parameters:
+    df (pandas.DataFrame): The joined inputs on a regular UTC time index.
+    holidays (pandas.DatetimeIndex): The public holidays.
+    country_code (str): The bidding zone, e.g. "FR".
+    freq (str, optional): The resolution of the data. Defaults to BASE_FREQ.
+
+    Returns:
+    pandas.DataFrame: The combined dataset.
+    """
+    df = calc_ramps(df, freq)
+
+    # add 7 day temp average
+    df["temp_mean_7d_avg"] = df["temp_mean"].rolling("7d").mean()
+
+    # clean up data:
+    # offshore wind only after 2022 https://en.wikipedia.org/wiki/Wind_power_in_France
+    if country_code == "FR":
+        df["wind_off_da"] = df["wind_off_da"].fillna(0)
+
+    # drop consumption columns
+    df = df.drop(columns=[column for column in df.columns if "cons" in column])
+    df = df.rename(columns={"ramperation_da": "gen_da_ramp"})
+
+    # aggregate da wind
+    df["wind_da"] = df["wind_on_da"] + df["wind_off_da"]
+
+    # add price_da - price_da_IT_NORD
+    df["price_da_diff_IT_NORD_FR"] = df["price_da_IT_NORD"] - df["price_da"]
+
+    # add calender features
+    df["year"] = df.index.year
+    df["day_of_year"] = df.index.dayofyear
+    df["month"] = df.index.month
+    df["day"] = df.index.weekday
+    df["hour"] = df.index.hour
+    df["isday"] = (df["hour"] >= 8) & (df["hour"] < 20)
+    df["quarter_day"] = assign_quarter_of_day(df["hour"])
+    df["season"] = assign_season(df["month"])
+    df["quarter"] = assign_quarters(df["month"])
+    # no weekend and no public holiday (the whole day), see scripts/features.py
+    df["isworkingday"] = working_day(df.index, holidays)
+    return df
+
+
+@traced()
+def select_columns(path, out_path, columns=SELECTED_COLUMNS, chunksize=100_000):
+    """
+    Write some columns of a combined dataset csv file to another file (e.g. data_selected from data_full),
+    reading only these columns in chunks of rows.
+
+    Parameters:
+    path (str): The path of the combined dataset (csv file with a timestamp column).
+    out_path (str): The path of the output CSV file. An existing file is replaced.
+    columns (list, optional): The columns. Defaults to SELECTED_COLUMNS.
+    chunksize (int, optional): Number of rows read at once. Defaults to 100000.
+
+    Returns:
+    str: The path of the output file.
+    """
+    tmp = f"{out_path}.tmp-{os.getpid()}"
+    header = True
+    for chunk in pd.read_csv(
+        path, usecols=["timestamp"] + list(columns), index_col="timestamp", chunksize=chunksize
+    ):
+        chunk[columns].to_csv(tmp, mode="w" if header else "a", header=header)
+        header = False
+    os.replace(tmp, out_path)
+    return out_path
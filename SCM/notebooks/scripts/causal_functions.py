@@ -1,12 +1,87 @@
 import os
+import copy
+import hashlib
+import numpy as np
+import pandas as pd
 from dowhy import gcm
 from dowhy.graph import is_root_node, get_ordered_predecessors
 from dowhy.gcm.falsify import falsify_graph
+from dowhy.gcm.fitting_sampling import fit_causal_model_of_target
+from dowhy.gcm.causal_models import PARENTS_DURING_FIT
 
 from scripts.utils import save_file
+from scripts.ci_tests import falsify_graph_tests, evaluation_config
+from scripts.causal_graphs import parse_lag
+from scripts.lags import LaggedFrame, lagged_frame
+from scripts.mechanism_evaluation import evaluate_mechanisms
+from scripts.profiling import trace, traced
 
 
-def create_causal_model(graph, data):
+class MechanismCache:
+    """
+    Cache of fitted causal mechanisms shared by the graphs of a family (e.g. GRAPH18 and GRAPH22,
+    which only differ in the target). A mechanism is keyed by the node, its sorted parents, the
+    mechanism type, a fingerprint of the data of the node and its parents and a fingerprint of the
+    rows (index) used for fitting, so a mechanism is only reused if it would be fitted on exactly
+    the same data.
+    """
+
+    def __init__(self):
+        self.mechanisms = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(values):
+        """
+        Fingerprint of an array or index (sha1 of its bytes).
+
+        Parameters:
+        values (numpy.ndarray or pandas.Index): The values.
+
+        Returns:
+        str: The fingerprint.
+        """
+        if isinstance(values, pd.Index):
+            # e.g. timestamps with time zone are objects
+            values = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        values = np.ascontiguousarray(np.asarray(values))
+        digest = hashlib.sha1(values.tobytes())
+        digest.update(str(values.dtype).encode())
+        return digest.hexdigest()
+
+    def key(self, node, parents, mechanism_type, data, row_mask):
+        """
+        Key of the mechanism of a node.
+
+        Parameters:
+        node (str): The node.
+        parents (list): The parents of the node.
+        mechanism_type (str): The type of the mechanism, e.g. "AdditiveNoiseModel(linear)".
+        data (pandas.DataFrame): The data the mechanism is fitted on.
+        row_mask (str): Fingerprint of the rows of the data.
+
+        Returns:
+        tuple: The key.
+        """
+        columns = [node] + sorted(parents)
+        data_fingerprint = self.fingerprint(data.loc[:, columns].to_numpy())
+        return (node, tuple(sorted(parents)), mechanism_type, data_fingerprint, row_mask)
+
+    def get(self, key):
+        mechanism = self.mechanisms.get(key)
+        if mechanism is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.deepcopy(mechanism)
+
+    def put(self, key, mechanism):
+        self.mechanisms[key] = copy.deepcopy(mechanism)
+
+
+@traced(rows_arg="data")
+def create_causal_model(graph, data, mechanism_cache=None, freq=None):
     """
     This function initializes a Structural Causal Model (SCM) based on the provided
     causal graph and fits it to the given data. Root nodes in the graph are assigned
@@ -16,11 +91,21 @@ def create_causal_model(graph, data):
     Parameters:
     graph (networkx.DiGraph):  A directed acyclic graph representing the causal structure.
     data (pandas.DataFrame): A DataFrame containing the normalized data to fit the model.
+    mechanism_cache (MechanismCache, optional): If given, mechanisms already fitted on the same data
+        (e.g. for another graph of the family) are reused and new mechanisms are added to the cache.
+    freq (str, optional): Frequency of the time steps of lagged nodes (see causal_graphs.add_lags).
+        If the data has no columns for them, they are built from the variables (see lags.lagged_frame)
+        and rows with missing values are dropped. This copies a column per lag, unlike the grouped
+        fit (get_grouped_linear_coefficients). Defaults to the resolution of the data.
 
     Returns:
     gcm.StructuralCausalModel: The fitted Structural Causal Model.
     """
-    causal_model = gcm.StructuralCausalModel(graph)
+    if any(node not in data.columns for node in graph.nodes):
+        data = lagged_frame(data, list(graph.nodes), freq).dropna()
+    # the mechanisms are stored in the graph, a copy keeps models fitted on the same graph
+    # (e.g. one per window) independent
+    causal_model = gcm.StructuralCausalModel(graph.copy())
 
     for n in causal_model.graph.nodes:
         if is_root_node(causal_model.graph, n):
@@ -29,11 +114,33 @@ def create_causal_model(graph, data):
             causal_model.set_causal_mechanism(
                 n, gcm.AdditiveNoiseModel(gcm.ml.create_linear_regressor())
             )
-    print(gcm.fit(causal_model, data))
+    if mechanism_cache is None:
+        print(gcm.fit(causal_model, data))
+        return causal_model
+
+    row_mask = MechanismCache.fingerprint(data.index)
+    for n in causal_model.graph.nodes:
+        parents = get_ordered_predecessors(causal_model.graph, n)
+        if is_root_node(causal_model.graph, n):
+            mechanism_type = "EmpiricalDistribution"
+        else:
+            mechanism_type = "AdditiveNoiseModel(linear)"
+        key = mechanism_cache.key(n, parents, mechanism_type, data, row_mask)
+        mechanism = mechanism_cache.get(key)
+        if mechanism is None:
+            fit_causal_model_of_target(causal_model, n, data)
+            mechanism_cache.put(key, causal_model.causal_mechanism(n))
+        else:
+            causal_model.set_causal_mechanism(n, mechanism)
+            # as in fit_causal_model_of_target
+            causal_model.graph.nodes[n][PARENTS_DURING_FIT] = parents
+    print(
+        f"mechanisms reused: {mechanism_cache.hits}, fitted: {mechanism_cache.misses}"
+    )
     return causal_model
 
 
-def get_linear_coefficients(causal_model, data_original):
+def get_linear_coefficients(causal_model, data_original=None, standardizer=None):
     """
     Get the structural coefficients of a linear Structural Causal Model (SCM).
     This function extracts the structural coefficients (including intercepts) from a fitted
@@ -41,35 +148,41 @@ def get_linear_coefficients(causal_model, data_original):
 
     Parameters:
     causal_model (gcm.StructuralCausalModel): The fitted causal model from which the structural coefficients are extracted.
-    data_original (pandas.DataFrame): The original (non-normalized) dataset used to fit the causal model.
+    data_original (pandas.DataFrame, optional): The original (non-normalized) dataset used to fit the causal model.
+        Only used if no standardizer is given.
+    standardizer (scripts.utils.Standardizer, optional): The means and standard deviations used to normalize the data.
 
     Returns:
     dict: A dictionary where keys are the nodes of the causal graph, and values are dictionaries
         containing the structural coefficients for each parent node and the intercept.
         The coefficients are adjusted to match the scale of the original data.
     """
+    if standardizer is None:
+        mean, std = data_original.mean(), data_original.std()
+    else:
+        mean, std = standardizer.mean, standardizer.std
+    # a lagged node (e.g. gas_price[t-24]) has the moments of its variable if they are not given
+    mean = _with_lagged(mean, causal_model.graph.nodes)
+    std = _with_lagged(std, causal_model.graph.nodes)
     coefficients = {}
     for node in causal_model.graph.nodes:
         if is_root_node(causal_model.graph, node):
             continue
         # coefficients
-        coef_ = causal_model.causal_mechanism(node).prediction_model.sklearn_model.coef_
+        # float64 copy, the model may be fitted on float32 data (see Standardizer)
+        coef_ = causal_model.causal_mechanism(
+            node
+        ).prediction_model.sklearn_model.coef_.astype(float)
         ordered_parents = get_ordered_predecessors(causal_model.graph, node)
         intercept_ = causal_model.causal_mechanism(
             node
-        ).prediction_model.sklearn_model.intercept_
+        ).prediction_model.sklearn_model.intercept_.astype(float)
         # denormalize intercept
-        intercept_ = intercept_ * data_original[node].std() + data_original[node].mean()
+        intercept_ = intercept_ * std[node] + mean[node]
         for i in range(len(ordered_parents)):
             # denormalize coefficients
-            coef_[i] = (
-                coef_[i]
-                * data_original[node].std()
-                / data_original[ordered_parents[i]].std()
-            )
-            intercept_ = (
-                intercept_ - coef_[i] * data_original[ordered_parents[i]].mean()
-            )
+            coef_[i] = coef_[i] * std[node] / std[ordered_parents[i]]
+            intercept_ = intercept_ - coef_[i] * mean[ordered_parents[i]]
             labeled_coef = {
                 ordered_parents[i]: coef_[i] for i in range(len(ordered_parents))
             }
@@ -80,13 +193,251 @@ def get_linear_coefficients(causal_model, data_original):
     return coefficients
 
 
+def _with_lagged(moments, nodes):
+    missing = [node for node in nodes if node not in moments.index]
+    if not missing:
+        return moments
+    lagged = pd.Series([moments[parse_lag(node)[0]] for node in missing], index=missing)
+    return pd.concat([moments, lagged])
+
+
+def _group_keys(data, by, index):
+    # group keys as arrays aligned with index (the rows of the LaggedFrame) and their names
+    if by is None:
+        by = []
+    elif isinstance(by, (str, pd.Series, pd.Index, np.ndarray)):
+        by = [by]
+    arrays, names = [], []
+    for i, key in enumerate(by):
+        if isinstance(key, str):
+            values, name = data[key], key
+        else:
+            values = pd.Series(np.asarray(key), index=data.index)
+            name = getattr(key, "name", None) or f"group_{i}"
+        if not values.index.equals(index):
+            values = values.reindex(index)
+        arrays.append(values.to_numpy())
+        names.append(name)
+    return arrays, names
+
+
+def get_grouped_linear_coefficients(
+    graph_dict, data, by=None, chunk_size=8192, freq=None
+):
+    """
+    Fit the linear SCM of a graph separately for every group of the data (e.g. every hour of the day,
+    working days and holidays, before and after ENERGY_CRISIS or load bins) in one grouped pass.
+    The sufficient statistics (Gram matrices of all nodes with an intercept) of all groups are
+    accumulated over chunks of rows, the rows of a chunk are sorted by group (bincount gives the
+    boundaries) and every group adds the product of its block. The normal equations of every node
+    are then solved for all groups at once with a batched solve. The coefficients are the same as
+    those of create_causal_model and get_linear_coefficients on the rows of each group.
+    Parents that are constant within a group (e.g. isworkingday if grouped by it) are not identified,
+    their coefficients are NaN. Groups with fewer rows than coefficients get NaN coefficients.
+    The graph may have lagged nodes (see causal_graphs.add_lags), their columns are zero-copy views
+    of the data (see lags.LaggedFrame), only the rows of a chunk are copied.
+
+    Parameters:
+    graph_dict (dict): The causal graph dictionary (see causal_graphs).
+    data (pandas.DataFrame): The original (non-normalized) data.
+    by (str, array-like or list, optional): Grouping keys, column names of data or arrays aligned with data,
+        e.g. ["isworkingday", data.index.hour] or data.index >= ENERGY_CRISIS. Defaults to None (one group).
+    chunk_size (int, optional): Number of rows per chunk of the accumulation. Defaults to 8192.
+    freq (str, optional): Frequency of the time steps of the lags. Defaults to the resolution of the
+        data (see resolution.infer_freq).
+
+    Returns:
+    pandas.DataFrame: The coefficients ("coefficient") and the rows of the group ("rows") indexed by the
+        grouping keys, the child and the parent (including "intercept") in the original scale.
+    """
+    causal_graph = graph_dict["graph"]
+    nodes = list(graph_dict["nodes"])
+    frame = LaggedFrame(data, nodes, freq=freq)
+    keys, names = _group_keys(data, by, frame.index)
+    valid = frame.valid(chunk_size)
+    for key in keys:
+        valid &= pd.notna(key)
+    positions = np.flatnonzero(valid)
+    # codes of the combinations of the keys that occur, without building tuples per row
+    codes, levels = np.zeros(len(positions), dtype=np.intp), [()]
+    if keys:
+        factorized = [pd.factorize(key[positions], sort=True) for key in keys]
+        shape = [len(uniques) for _, uniques in factorized]
+        combined = np.ravel_multi_index([key_codes for key_codes, _ in factorized], shape)
+        present, codes = np.unique(combined, return_inverse=True)
+        levels = list(
+            zip(
+                *[
+                    uniques[key_codes]
+                    for (_, uniques), key_codes in zip(
+                        factorized, np.unravel_index(present, shape)
+                    )
+                ]
+            )
+        )
+    n_groups = len(levels)
+
+    # normalize for the conditioning of the normal equations, Z = [1, normalized nodes]
+    mean, std = frame.moments()
+    std = np.where(std > 0, std, 1)
+    size = len(nodes) + 1
+    gram = np.zeros((n_groups, size, size))
+    for start in range(0, len(positions), chunk_size):
+        chunk_codes = codes[start : start + chunk_size]
+        order = np.argsort(chunk_codes, kind="stable")
+        Z = np.empty((len(order), size))
+        Z[:, 0] = 1
+        Z[:, 1:] = frame.take(positions[start : start + chunk_size][order])
+        Z[:, 1:] -= mean
+        Z[:, 1:] /= std
+        bounds = np.concatenate(
+            [[0], np.cumsum(np.bincount(chunk_codes, minlength=n_groups))]
+        )
+        for g in np.flatnonzero(np.diff(bounds)):
+            block = Z[bounds[g] : bounds[g + 1]]
+            gram[g] += block.T @ block
+    rows = gram[:, 0, 0]
+    # variance of every node within every group
+    group_mean = gram[:, 0, :] / np.maximum(rows, 1)[:, None]
+    variance = (
+        np.diagonal(gram, axis1=1, axis2=2) / np.maximum(rows, 1)[:, None] - group_mean**2
+    )
+
+    position = {node: i + 1 for i, node in enumerate(nodes)}
+    frames = []
+    for node in nodes:
+        if is_root_node(causal_graph, node):
+            continue
+        parents = get_ordered_predecessors(causal_graph, node)
+        idx = np.array([0] + [position[p] for p in parents])
+        A = gram[:, idx[:, None], idx[None, :]]
+        b = gram[:, idx, position[node]]
+        # constant parents are removed from the system (identity row, zero right hand side)
+        constant = np.zeros((n_groups, len(idx)), dtype=bool)
+        constant[:, 1:] = variance[:, idx[1:]] <= 1e-12
+        A[constant] = 0
+        A = A.transpose(0, 2, 1)
+        A[constant] = 0
+        A[:, np.arange(len(idx)), np.arange(len(idx))] += constant
+        b[constant] = 0
+        too_small = rows < len(idx)
+        A[too_small] = np.eye(len(idx))
+        theta = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        theta[constant | too_small[:, None]] = np.nan
+
+        # denormalize as in get_linear_coefficients
+        parent_mean = mean[idx[1:] - 1]
+        coef_ = theta[:, 1:] * std[position[node] - 1] / std[idx[1:] - 1]
+        intercept_ = (
+            theta[:, 0] * std[position[node] - 1]
+            + mean[position[node] - 1]
+            - np.nansum(coef_ * parent_mean, axis=1)
+        )
+        intercept_[too_small] = np.nan
+        coefficients = np.column_stack([coef_, intercept_])
+        frames.append(
+            pd.DataFrame(
+                {
+                    "coefficient": coefficients.ravel(),
+                    "rows": np.repeat(rows.astype(int), len(idx)),
+                },
+                index=pd.MultiIndex.from_tuples(
+                    [
+                        (*level, node, parent)
+                        for level in levels
+                        for parent in parents + ["intercept"]
+                    ],
+                    names=names + ["child", "parent"],
+                ),
+            )
+        )
+    coefficients = pd.concat(frames)
+    if names:
+        coefficients = coefficients.sort_index(
+            level=list(range(len(names))), sort_remaining=False
+        )
+    return coefficients
+
+
+def linear_edge_credit(causal_model, target, fg, bg, standardizer=None):
+    """
+    Exact Shapley flow edge credits of a linear Structural Causal Model (see create_causal_model)
+    for all foreground samples at once.
+    In a linear SCM the credit of an edge i -> j is the sum over all paths from the sources through
+    the edge to the target of the products of the coefficients times the foreground-background
+    difference of the source. It factorizes into the total difference of i (the flow arriving at i),
+    the coefficient of the edge and the total effect of j on the target. The noise of a non-root
+    node j is a source with the edge "j noise" -> j. As the credits are linear in the background,
+    several background samples are combined by their mean.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted linear causal model.
+    target (str): The node to explain, e.g. "price_da".
+    fg (pandas.DataFrame): The foreground samples (samples to explain).
+    bg (pandas.DataFrame): The background samples.
+    standardizer (scripts.utils.Standardizer, optional): If given, fg and bg are original data, which
+        are normalized with the standardizer, and the credits are returned in the unit of the target.
+        Otherwise fg and bg are normalized data.
+
+    Returns:
+    pandas.DataFrame: The edge credits with one row per edge (index: source, target) and one column
+        per foreground sample, the layout of shap_flow_util.EdgeCreditIndex.
+    """
+    graph = causal_model.graph
+    nodes = list(graph.nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    fg_values, bg_values = fg.loc[:, nodes], bg.loc[:, nodes]
+    if standardizer is not None:
+        fg_values, bg_values = standardizer.transform(fg_values), standardizer.transform(bg_values)
+    # flow arriving at every node: foreground - mean background, (samples, nodes)
+    delta = fg_values.to_numpy(dtype=float) - bg_values.to_numpy(dtype=float).mean(axis=0)
+
+    # B[i, j]: coefficient of parent i in the mechanism of j
+    B = np.zeros((len(nodes), len(nodes)))
+    non_root = [node for node in nodes if not is_root_node(graph, node)]
+    for node in non_root:
+        coef_ = causal_model.causal_mechanism(
+            node
+        ).prediction_model.sklearn_model.coef_.astype(float)
+        for parent, c in zip(get_ordered_predecessors(graph, node), np.ravel(coef_)):
+            B[position[parent], position[node]] = c
+    # total effect of every node on the target: sum over all paths of the products of the coefficients
+    e_target = np.zeros(len(nodes))
+    e_target[position[target]] = 1
+    total_effect = np.linalg.solve(np.eye(len(nodes)) - B, e_target)
+    # noise of every node: the part of its difference not explained by its parents
+    noise = delta - delta @ B
+
+    edges = list(graph.edges)
+    sources = np.array([position[a] for a, _ in edges], dtype=int)
+    targets = np.array([position[b] for _, b in edges], dtype=int)
+    credits = delta[:, sources].T * (B[sources, targets] * total_effect[targets])[:, None]
+    noise_rows = np.array([position[node] for node in non_root], dtype=int)
+    noise_credits = noise[:, noise_rows].T * total_effect[noise_rows][:, None]
+    edges = edges + [(f"{node} noise", node) for node in non_root]
+    credits = np.vstack([credits, noise_credits])
+    if standardizer is not None:
+        credits = credits * standardizer.std[target]
+    return pd.DataFrame(
+        credits,
+        index=pd.MultiIndex.from_tuples(edges, names=["source", "target"]),
+        columns=fg.index,
+    )
+
+
 def create_eval_scm(
     graph_dict,
     df_data,
-    df_data_original,
+    df_data_original=None,
     with_coefficients=False,
     with_evaluation=False,
     with_falsification=False,
+    standardizer=None,
+    mechanism_cache=None,
+    ci_test="kernel",
+    evaluation_budget=None,
+    processes=None,
+    freq=None,
 ):
     """
     This function constructs a causal model based on the provided graph structure and data,
@@ -94,22 +445,44 @@ def create_eval_scm(
 
     Parameters:
     graph_dict (dict): A dictionary containing the causal graph structure, including nodes, edges, and a name.
-    df_data (pandas.DataFrame): The normalized data used to fit the causal model.
-    df_data_original (pandas.DataFrame): The original (non-normalized) data used for coefficient calculations.
+    df_data (pandas.DataFrame): The normalized data used to fit the causal model. If a standardizer is given,
+        the original data, which is normalized with the standardizer after selecting the nodes of the graph.
+    df_data_original (pandas.DataFrame, optional): The original (non-normalized) data used for coefficient calculations.
+        Only needed with with_coefficients and no standardizer.
     with_coefficients (bool, optional): If True, calculates and saves the structural coefficients. Default is False.
     with_evaluation (bool, optional): If True, evaluates the causal model and saves the results. Default is False.
     with_falsification (bool, optional): If True, performs falsification tests on the causal model. Default is False.
+    standardizer (scripts.utils.Standardizer, optional): Means and standard deviations of the original data. Default is None.
+    mechanism_cache (MechanismCache, optional): Cache of fitted mechanisms shared by several graphs. Default is None.
+    ci_test (str, optional): The (conditional) independence tests of the evaluation and falsification, "kernel" (exact
+        kernel tests of dowhy on subsamples) or "rcot" (approximate tests with linear cost using all rows, see
+        scripts.ci_tests). Default is "kernel".
+    evaluation_budget (dict, optional): If given, the evaluation only evaluates the causal mechanisms on a process pool
+        with the given rows per metric (see scripts.mechanism_evaluation) and saves a compact table instead of the result
+        of gcm.evaluate_causal_model. An empty dict uses the default budget. Default is None.
+    processes (int, optional): Number of worker processes of the budgeted evaluation. Default is the number of CPUs.
+    freq (str, optional): Frequency of the time steps of lagged nodes (see causal_graphs.add_lags). The data only needs
+        the variables, the lagged columns are built from them (see lags.lagged_frame), a copy per lag. Default is the
+        resolution of the data.
 
     Returns:
-    None
+    gcm.StructuralCausalModel: The fitted causal model.
     """
     selected_graph = graph_dict
     nodes = selected_graph["nodes"]
     causal_graph = selected_graph["graph"]
     name = selected_graph["name"]
 
-    df_data = df_data.loc[:, nodes].dropna()
-    df_data_original = df_data_original.loc[:, nodes].dropna()
+    # the variables are normalized before the lagged columns are built, a lag has the moments of its variable
+    variables = list(dict.fromkeys(parse_lag(node)[0] for node in nodes))
+    if standardizer is not None:
+        df_data = standardizer.transform(df_data.loc[:, variables])
+    elif with_coefficients:
+        # the coefficients are denormalized with the moments of the original data
+        if df_data_original is None:
+            raise ValueError("df_data_original or standardizer is required")
+        df_data_original = lagged_frame(df_data_original, nodes, freq).dropna()
+    df_data = lagged_frame(df_data, nodes, freq).dropna()
     years = f"{df_data.index[0].year}-{df_data.index[-1].year}"
     dir = f"../models/{name}/"
     try:
@@ -117,21 +490,40 @@ def create_eval_scm(
     except OSError as error:
         print(error)
 
-    print("creating causal model")
-    causal_model = create_causal_model(graph=causal_graph, data=df_data)
+    causal_model = create_causal_model(
+        graph=causal_graph, data=df_data, mechanism_cache=mechanism_cache
+    )
     # structural coefficients
     if with_coefficients:
-        print("get coefficients")
-        coefficients = get_linear_coefficients(
-            causal_model=causal_model, data_original=df_data_original
-        )
+        with trace("get_linear_coefficients", rows=len(df_data), graph=name):
+            coefficients = get_linear_coefficients(
+                causal_model=causal_model,
+                data_original=df_data_original,
+                standardizer=standardizer,
+            )
         dir_new = dir + "coefficients/"
         save_file(coefficients, dir=dir_new, filename=f"{name}_{years}_coefficients")
 
     # main overview evaluation.
-    if with_evaluation:
-        print("evaluate")
-        evaluate_causal_model = gcm.evaluate_causal_model(causal_model, df_data)
+    if with_evaluation and evaluation_budget is not None:
+        with trace("evaluate_mechanisms", rows=len(df_data), graph=name):
+            mechanism_performances = evaluate_mechanisms(
+                {years: (causal_model, df_data)},
+                budget=evaluation_budget,
+                processes=processes,
+                ci_test=ci_test,
+            )
+        print(mechanism_performances)
+        dir_new = dir + "evaluation/"
+        os.makedirs(dir_new, exist_ok=True)
+        mechanism_performances.to_csv(
+            dir_new + f"{name}_{years}_mechanisms.csv", index=False
+        )
+    elif with_evaluation:
+        with trace("evaluate_causal_model", rows=len(df_data), graph=name):
+            evaluate_causal_model = gcm.evaluate_causal_model(
+                causal_model, df_data, config=evaluation_config(ci_test)
+            )
         print(evaluate_causal_model)
         dir_new = dir + "evaluation/"
         save_file(
@@ -140,18 +532,21 @@ def create_eval_scm(
 
     # more precise falsification than that of the evaluation function, but takes longer
     # it employs a larger max_num_samples_run in the kernel_based function used to perform CI-tests
+    # (with ci_test="rcot" all rows are used at linear cost)
     if with_falsification:
-        print("falsification")
-        falsification_result = falsify_graph(
-            causal_graph=causal_graph,
-            data=df_data,
-            plot_histogram=True,
-            suggestions=False,
-            n_permutations=50,
-            allow_data_subset=False,
-            significance_level=0.05,
-        )
+        with trace("falsify_graph", rows=len(df_data), graph=name, ci_test=ci_test):
+            falsification_result = falsify_graph(
+                causal_graph=causal_graph,
+                data=df_data,
+                plot_histogram=True,
+                suggestions=False,
+                n_permutations=50,
+                allow_data_subset=False,
+                significance_level=0.05,
+                **falsify_graph_tests(ci_test),
+            )
         dir_new = dir + "falsification/"
         save_file(
             falsification_result, dir=dir_new, filename=f"{name}_{years}_falsification"
         )
+    return causal_model
@@ -1,5 +1,8 @@
+import re
 import networkx as nx
 
+from scripts.countries import EUROPEAN_BZN
+
 """
 This script defines several causal graph models using NetworkX directed graphs (DiGraph).
 Each model represents a specific causal structure with nodes and edges, where:
@@ -36,6 +39,11 @@ Models:
     - Excludes: `oil_price`, `rl_CH`, `rl_GB`.
 Note:
 - Models `GRAPH18` and `GRAPH22` are the only ones used in the final analysis.
+- `create_graph` builds models 18 and 22 for any bidding zone, the residual load nodes of the
+  neighbours are generated from the neighbour map (`get_neighbours`).
+- `add_lags` adds lagged nodes to a graph, e.g. `gas_price[t-24]` (the gas price 24 rows (hours)
+  before) or the range `river_temp[t-1..t-72]` (72 nodes `river_temp[t-1]`, ..., `river_temp[t-72]`).
+  Lags are rows of the base resolution, with quarter-hourly data a day is `resolution.rows("1D", "15min")` (96) rows.
 - The script uses NetworkX to create and manipulate directed graphs.
 """
 
@@ -44,176 +52,234 @@ Note:
 # model 18 is for price_da as target, model 22 is for agg_net_export as target
 
 
-# model 18: price_da as target. no oil_price, rl_CH, rl_GB
-nodes = [
-    "price_da",
-    "carbon_price",
-    "gas_price",
-    "na",
-    "run_off_gen",
-    "solar_da",
-    "load_da",
-    "wind_da",
-    "rl_FR_ramp",
-    "rl_BE",
-    "rl_DE_LU",
-    "rl_ES",
-    "rl_IT_NORD",
-    "river_flow_mean",
-    "temp_mean",
-    "river_temp",
-    "hour_sin",
-    "hour_cos",
-    "day_of_year_sin",
-    "day_of_year_cos",
-    "isworkingday",
-]
+def get_neighbours(country_code, neighbour_map=None):
+    """
+    Get the neighbouring bidding zones of a bidding zone whose residual load is used in the graphs.
+    Only zones in EUROPEAN_BZN are used (e.g. "CH", "GB" and "IT_NORD_FR" of FR are dropped) and
+    "DE_AT_LU" is dropped if "DE_LU" is a neighbour, because both are merged into rl_DE_LU
+    (see adjust_de_bzn_split in 01-get_data_nuc.ipynb).
+
+    Parameters:
+    country_code (str): The bidding zone, e.g. "FR".
+    neighbour_map (dict, optional): Maps a bidding zone to its neighbours. Defaults to entsoe.mappings.NEIGHBOURS.
+
+    Returns:
+    list: The neighbouring bidding zones.
+    """
+    if neighbour_map is None:
+        from entsoe.mappings import NEIGHBOURS as neighbour_map
+
+    neighbours = [cc for cc in neighbour_map[country_code] if cc in EUROPEAN_BZN]
+    if "DE_LU" in neighbours:
+        neighbours = [cc for cc in neighbours if cc != "DE_AT_LU"]
+    return neighbours
+
+
+def create_graph(name, target, country_code="FR", neighbours=None):
+    """
+    Create the causal graph of the final analysis (model 18/22) for a bidding zone.
+    The residual load nodes of the neighbours (rl_<neighbour>) and the residual load ramp of the
+    zone (rl_<country_code>_ramp) are generated from the neighbours.
+
+    Parameters:
+    name (str): The name of the graph.
+    target (str): The target node, e.g. "price_da" or "agg_net_export".
+    country_code (str, optional): The bidding zone. Defaults to "FR".
+    neighbours (list, optional): The neighbouring bidding zones. Defaults to get_neighbours(country_code).
+
+    Returns:
+    dict: The graph with keys name, nodes, edges and graph.
+    """
+    if neighbours is None:
+        neighbours = get_neighbours(country_code)
+    ramp = f"rl_{country_code}_ramp"
+    rl_neighbours = [f"rl_{cc}" for cc in neighbours]
+
+    nodes = (
+        [
+            target,
+            "carbon_price",
+            "gas_price",
+            "na",
+            "run_off_gen",
+            "solar_da",
+            "load_da",
+            "wind_da",
+            ramp,
+        ]
+        + rl_neighbours
+        + [
+            "river_flow_mean",
+            "temp_mean",
+            "river_temp",
+            "hour_sin",
+            "hour_cos",
+            "day_of_year_sin",
+            "day_of_year_cos",
+            "isworkingday",
+        ]
+    )
+
+    confounders = [
+        "isworkingday",
+        "hour_sin",
+        "hour_cos",
+        "day_of_year_sin",
+        "day_of_year_cos",
+    ]
+    prices = [
+        "carbon_price",
+        "gas_price",
+    ]
+    river = [
+        "river_temp",
+        "river_flow_mean",
+    ]
+    renew = ["solar_da", "wind_da"]
+    load = ["load_da", ramp] + rl_neighbours
+    na_hydro = ["na", "run_off_gen"]
+
+    confounders_prices = [
+        (a, "gas_price") for a in ["isworkingday", "day_of_year_sin", "day_of_year_cos"]
+    ]
+    confounders_mid_layer = [
+        (a, b)
+        for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
+        for b in renew
+    ] + [(a, b) for a in confounders for b in load + na_hydro]
+    confounders_temp = [
+        (a, b)
+        for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
+        for b in ["temp_mean"] + river
+    ] + [("temp_mean", b) for b in river]
+    temp_mid_layer = [("temp_mean", b) for b in load + renew] + [
+        (a, b) for a in river for b in na_hydro
+    ]
+    mid_layer_target = [(a, b) for a in load + renew + na_hydro for b in [target]]
+    prices_target = [(a, b) for a in prices for b in [target]]
+    edges = (
+        confounders_prices
+        + confounders_temp
+        + confounders_mid_layer
+        + temp_mid_layer
+        + mid_layer_target
+        + prices_target
+    )
+    # remove edges
+    edges = [
+        e for e in edges if e not in [("isworkingday", "gas_price"), ("temp_mean", ramp)]
+    ]
+
+    return {
+        "name": name,
+        "nodes": nodes,
+        "edges": edges,
+        "graph": nx.DiGraph(edges),
+    }
+
+
+def restrict_graph(graph_dict, columns):
+    """
+    Remove the nodes of a graph that are not available in the data of a bidding zone,
+    e.g. na or the river nodes for zones without nuclear power plants.
+
+    Parameters:
+    graph_dict (dict): The graph with keys name, nodes, edges and graph.
+    columns (list): The available columns.
+
+    Returns:
+    dict: The restricted graph.
+    """
+    nodes = [n for n in graph_dict["nodes"] if n in columns]
+    edges = [e for e in graph_dict["edges"] if e[0] in nodes and e[1] in nodes]
+    return {
+        "name": graph_dict["name"],
+        "nodes": nodes,
+        "edges": edges,
+        "graph": nx.DiGraph(edges),
+    }
+
+
+# lagged node: <variable>[t-<lag>] or the range <variable>[t-<first>..t-<last>]
+LAG_PATTERN = re.compile(r"^(?P<variable>.+)\[t-(?P<first>\d+)(?:\.\.t-(?P<last>\d+))?\]$")
+
+
+def parse_lag(node):
+    """
+    Split a (lagged) node into its variable and lag, e.g. "gas_price[t-24]" into ("gas_price", 24).
+
+    Parameters:
+    node (str): The node.
+
+    Returns:
+    tuple: The variable and the lag in rows (0 for contemporaneous nodes).
+    """
+    match = LAG_PATTERN.match(node)
+    if match is None or match["last"] is not None:
+        return node, 0
+    return match["variable"], int(match["first"])
+
+
+def expand_lags(spec):
+    """
+    The nodes of a lag specification, e.g. "river_temp[t-1..t-3]" gives
+    ["river_temp[t-1]", "river_temp[t-2]", "river_temp[t-3]"]. Other nodes are returned unchanged.
+
+    Parameters:
+    spec (str): The node or range of lagged nodes.
+
+    Returns:
+    list: The nodes.
+    """
+    match = LAG_PATTERN.match(spec)
+    if match is None or match["last"] is None:
+        return [spec]
+    first, last = int(match["first"]), int(match["last"])
+    step = 1 if last >= first else -1
+    return [f"{match['variable']}[t-{lag}]" for lag in range(first, last + step, step)]
+
+
+def add_lags(graph_dict, lagged_parents, name=None):
+    """
+    Add lagged nodes as parents to a graph. The lagged nodes are root nodes, the past is given.
+
+    Parameters:
+    graph_dict (dict): The graph with keys name, nodes, edges and graph.
+    lagged_parents (dict): Maps a node to its lagged parents, e.g.
+        {"price_da": ["gas_price[t-24]"], "na": ["river_temp[t-1..t-72]"]}.
+    name (str, optional): The name of the new graph. Defaults to the name of the graph.
+
+    Returns:
+    dict: The graph with the lagged nodes.
+    """
+    nodes = list(graph_dict["nodes"])
+    edges = list(graph_dict["edges"])
+    for child, specs in lagged_parents.items():
+        for spec in specs:
+            for node in expand_lags(spec):
+                if node not in nodes:
+                    nodes.append(node)
+                edges.append((node, child))
+    return {
+        "name": graph_dict["name"] if name is None else name,
+        "nodes": nodes,
+        "edges": edges,
+        "graph": nx.DiGraph(edges),
+    }
 
-confounders = [
-    "isworkingday",
-    "hour_sin",
-    "hour_cos",
-    "day_of_year_sin",
-    "day_of_year_cos",
-]
-prices = [
-    "carbon_price",
-    "gas_price",
-]
-river = [
-    "river_temp",
-    "river_flow_mean",
-]
-renew = ["solar_da", "wind_da"]
-load = ["load_da", "rl_FR_ramp", "rl_BE", "rl_DE_LU", "rl_ES", "rl_IT_NORD"]
-na_hydro = ["na", "run_off_gen"]
 
-confounders_prices = [
-    (a, "gas_price") for a in ["isworkingday", "day_of_year_sin", "day_of_year_cos"]
-]
-confounders_mid_layer = [
-    (a, b)
-    for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
-    for b in renew
-] + [(a, b) for a in confounders for b in load + na_hydro]
-confounders_temp = [
-    (a, b)
-    for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
-    for b in ["temp_mean"] + river
-] + [("temp_mean", b) for b in river]
-temp_mid_layer = [("temp_mean", b) for b in load + renew] + [
-    (a, b) for a in river for b in na_hydro
-]
-mid_layer_price_da = [(a, b) for a in load + renew + na_hydro for b in ["price_da"]]
-prices_price_da = [(a, b) for a in prices for b in ["price_da"]]
-edges = (
-    confounders_prices
-    + confounders_temp
-    + confounders_mid_layer
-    + temp_mid_layer
-    + mid_layer_price_da
-    + prices_price_da
+# model 18: price_da as target. no oil_price, rl_CH, rl_GB
+GRAPH18 = create_graph(
+    "graph18", "price_da", country_code="FR", neighbours=["BE", "DE_LU", "ES", "IT_NORD"]
 )
-# remove edges
-edges = [
-    e
-    for e in edges
-    if e not in [("isworkingday", "gas_price"), ("temp_mean", "rl_FR_ramp")]
-]
-
-GRAPH18 = {
-    "name": "graph18",
-    "nodes": nodes,
-    "edges": edges,
-    "graph": nx.DiGraph(edges),
-}
-
 
 # model 22: agg_net_export as target.
-nodes = [
+GRAPH22 = create_graph(
+    "graph22",
     "agg_net_export",
-    "carbon_price",
-    "gas_price",
-    "na",
-    "run_off_gen",
-    "solar_da",
-    "load_da",
-    "wind_da",
-    "rl_FR_ramp",
-    "rl_BE",
-    "rl_DE_LU",
-    "rl_ES",
-    "rl_IT_NORD",
-    "river_flow_mean",
-    "temp_mean",
-    "river_temp",
-    "hour_sin",
-    "hour_cos",
-    "day_of_year_sin",
-    "day_of_year_cos",
-    "isworkingday",
-]
-
-confounders = [
-    "isworkingday",
-    "hour_sin",
-    "hour_cos",
-    "day_of_year_sin",
-    "day_of_year_cos",
-]
-prices = [
-    "carbon_price",
-    "gas_price",
-]
-river = [
-    "river_temp",
-    "river_flow_mean",
-]
-renew = ["solar_da", "wind_da"]
-load = ["load_da", "rl_FR_ramp", "rl_BE", "rl_DE_LU", "rl_ES", "rl_IT_NORD"]
-na_hydro = ["na", "run_off_gen"]
-
-confounders_prices = [
-    (a, "gas_price") for a in ["isworkingday", "day_of_year_sin", "day_of_year_cos"]
-]
-confounders_mid_layer = [
-    (a, b)
-    for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
-    for b in renew
-] + [(a, b) for a in confounders for b in load + na_hydro]
-confounders_temp = [
-    (a, b)
-    for a in ["day_of_year_sin", "day_of_year_cos", "hour_sin", "hour_cos"]
-    for b in ["temp_mean"] + river
-] + [("temp_mean", b) for b in river]
-temp_mid_layer = [("temp_mean", b) for b in load + renew] + [
-    (a, b) for a in river for b in na_hydro
-]
-mid_layer_price_da = [
-    (a, b) for a in load + renew + na_hydro for b in ["agg_net_export"]
-]
-prices_price_da = [(a, b) for a in prices for b in ["agg_net_export"]]
-edges = (
-    confounders_prices
-    + confounders_temp
-    + confounders_mid_layer
-    + temp_mid_layer
-    + mid_layer_price_da
-    + prices_price_da
+    country_code="FR",
+    neighbours=["BE", "DE_LU", "ES", "IT_NORD"],
 )
-# remove edges
-edges = [
-    e
-    for e in edges
-    if e not in [("isworkingday", "gas_price"), ("temp_mean", "rl_FR_ramp")]
-]
-
-GRAPH22 = {
-    "name": "graph22",
-    "nodes": nodes,
-    "edges": edges,
-    "graph": nx.DiGraph(edges),
-}
 ### below only old, not used causal graphs ###
 
 # model 24: with price_da_DE_LU<FR as target. no oil_price, rl_CH, rl_GB
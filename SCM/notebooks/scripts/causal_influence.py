@@ -0,0 +1,318 @@
+"""
+Arrow strengths (gcm.arrow_strength) of all edges and intrinsic causal influences
+(gcm.intrinsic_causal_influence) of all upstream nodes of the targets, for many time windows in one
+batch. Every window is a task of a process pool that fits the SCM of the window and computes all
+measures, with the variance as the measure of the change of the target (the default of dowhy).
+
+- Linear mechanisms (see causal_functions.create_causal_model): closed-form variance decompositions.
+  With X_i the parent of an edge X_i -> Y with coefficient b_i, replacing X_i by an independent sample
+  adds b_i^2 Var(X_i) to the variance of Y (arrow strength). Y is a linear combination of the
+  independent noise terms N_j of its ancestors, the intrinsic causal influence of node j is the part
+  of the variance due to N_j: a_j^2 Var(N_j), with a_j the total effect of N_j on Y. The variances
+  follow from the fitted coefficients and the noise (or root) distributions.
+- Other mechanisms: sampling. The samples drawn from the SCM are shared by all edges, and the
+  conditional samples of the target at the parent samples are shared by all its incoming edges.
+  The intrinsic causal influences are estimated with gcm.intrinsic_causal_influence on the SCM of the
+  upstream nodes of every target (upstream_model).
+
+The results are tables indexed like the grouped coefficients (see
+causal_functions.get_grouped_linear_coefficients): (window, child, parent) for the arrow strengths and
+(window, target, node) for the intrinsic causal influences.
+"""
+
+import os
+import multiprocessing
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from dowhy import gcm
+from dowhy.graph import is_root_node, get_ordered_predecessors
+from dowhy.gcm.util.general import set_random_seed
+from sklearn.linear_model import LinearRegression
+
+from scripts.causal_functions import create_causal_model
+from scripts.profiling import trace
+
+
+def is_linear(causal_model):
+    """
+    Whether all mechanisms of a fitted causal model are linear, i.e. empirical distributions of the
+    root nodes and additive noise models with a linear regression.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted causal model.
+
+    Returns:
+    bool: True if the closed-form decompositions can be used.
+    """
+    for node in causal_model.graph.nodes:
+        mechanism = causal_model.causal_mechanism(node)
+        if is_root_node(causal_model.graph, node):
+            if not isinstance(mechanism, gcm.EmpiricalDistribution):
+                return False
+        elif not (
+            isinstance(mechanism, gcm.AdditiveNoiseModel)
+            and isinstance(
+                getattr(mechanism.prediction_model, "sklearn_model", None),
+                LinearRegression,
+            )
+            and isinstance(mechanism.noise_model, gcm.EmpiricalDistribution)
+        ):
+            return False
+    return True
+
+
+def _linear_decomposition(causal_model):
+    # coefficients B[i, j] of parent i in the mechanism of j and the variance of the noise (or root) of j
+    nodes = list(causal_model.graph.nodes)
+    position = {node: i for i, node in enumerate(nodes)}
+    B, noise_variance = np.zeros((len(nodes), len(nodes))), np.zeros(len(nodes))
+    for node in nodes:
+        mechanism = causal_model.causal_mechanism(node)
+        if is_root_node(causal_model.graph, node):
+            noise_variance[position[node]] = np.ravel(mechanism.data).astype(float).var()
+            continue
+        parents = get_ordered_predecessors(causal_model.graph, node)
+        B[[position[p] for p in parents], position[node]] = np.ravel(
+            mechanism.prediction_model.sklearn_model.coef_
+        ).astype(float)
+        noise_variance[position[node]] = (
+            np.ravel(mechanism.noise_model.data).astype(float).var()
+        )
+    # total_effect[t, j]: effect of the noise of j on t, X = (I - B^T)^-1 (intercepts + N)
+    total_effect = np.linalg.inv(np.eye(len(nodes)) - B.T)
+    return nodes, B, noise_variance, total_effect
+
+
+def linear_influences(causal_model, targets=None):
+    """
+    Arrow strengths of all edges and intrinsic causal influences of a linear SCM in closed form, see
+    module docstring. The values are in the normalized scale of the data of the model.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted linear causal model.
+    targets (list, optional): The targets of the intrinsic causal influences. Defaults to all non-root nodes.
+
+    Returns:
+    tuple: The arrow strengths (Series indexed by child and parent) and the intrinsic causal influences
+        (Series indexed by target and node, only the upstream nodes of every target).
+    """
+    graph = causal_model.graph
+    nodes, B, noise_variance, total_effect = _linear_decomposition(causal_model)
+    position = {node: i for i, node in enumerate(nodes)}
+    variance = (total_effect**2) @ noise_variance
+
+    edges = [
+        (child, parent)
+        for child in nodes
+        if not is_root_node(graph, child)
+        for parent in get_ordered_predecessors(graph, child)
+    ]
+    arrow_strength = pd.Series(
+        [B[position[p], position[c]] ** 2 * variance[position[p]] for c, p in edges],
+        index=pd.MultiIndex.from_tuples(edges, names=["child", "parent"]),
+        name="arrow_strength",
+        dtype=float,
+    )
+
+    if targets is None:
+        targets = [node for node in nodes if not is_root_node(graph, node)]
+    influences = total_effect**2 * noise_variance
+    pairs = [
+        (target, node)
+        for target in targets
+        for node in nodes
+        if node == target or node in nx.ancestors(graph, target)
+    ]
+    intrinsic_influence = pd.Series(
+        [influences[position[t], position[n]] for t, n in pairs],
+        index=pd.MultiIndex.from_tuples(pairs, names=["target", "node"]),
+        name="intrinsic_influence",
+        dtype=float,
+    )
+    return arrow_strength, intrinsic_influence
+
+
+def upstream_model(causal_model, target):
+    """
+    The fitted causal model restricted to a target and its upstream nodes, the mechanisms are shared
+    with the full model. gcm.intrinsic_causal_influence only accepts graphs without nodes that are not
+    upstream of the target.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted causal model.
+    target (str): The target.
+
+    Returns:
+    gcm.StructuralCausalModel: The causal model of the upstream nodes of the target.
+    """
+    nodes = nx.ancestors(causal_model.graph, target) | {target}
+    # the parents of an upstream node are upstream nodes, so the mechanisms stay valid
+    sub_model = gcm.StructuralCausalModel(causal_model.graph.subgraph(nodes).copy())
+    for node in nodes:
+        sub_model.set_causal_mechanism(node, causal_model.causal_mechanism(node))
+    return sub_model
+
+
+def sampled_influences(
+    causal_model,
+    targets=None,
+    num_parent_samples=200,
+    num_samples_conditional=500,
+    random_seed=0,
+):
+    """
+    Arrow strengths of all edges and intrinsic causal influences of the targets by sampling, for any
+    mechanisms, see module docstring. The values are in the normalized scale of the data of the model.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted causal model.
+    targets (list, optional): The targets of the intrinsic causal influences. Defaults to all non-root nodes.
+    num_parent_samples (int, optional): Number of parent samples the conditional variances are averaged
+        over. Defaults to 200.
+    num_samples_conditional (int, optional): Number of samples of the target per parent sample. Defaults to 500.
+    random_seed (int, optional): Seed of the samples. Defaults to 0.
+
+    Returns:
+    tuple: The arrow strengths and the intrinsic causal influences, see linear_influences.
+    """
+    set_random_seed(random_seed)
+    graph = causal_model.graph
+    # one set of samples of the SCM for all edges
+    samples = gcm.draw_samples(causal_model, num_samples_conditional * 20)
+    rows = np.random.choice(len(samples), num_parent_samples, replace=False)
+
+    edges, strengths = [], []
+    for child in graph.nodes:
+        if is_root_node(graph, child):
+            continue
+        parents = get_ordered_predecessors(graph, child)
+        mechanism = causal_model.causal_mechanism(child)
+        parent_samples = samples[parents].to_numpy()
+        # every parent sample repeated num_samples_conditional times
+        inputs = np.repeat(parent_samples[rows], num_samples_conditional, axis=0)
+        # conditional samples of the child, shared by all incoming edges
+        original = mechanism.draw_samples(inputs).reshape(
+            num_parent_samples, num_samples_conditional
+        )
+        original_variance = original.var(axis=1)
+        for i, parent in enumerate(parents):
+            removed_inputs = inputs.copy()
+            removed_inputs[:, i] = parent_samples[
+                np.random.randint(len(parent_samples), size=len(inputs)), i
+            ]
+            removed = mechanism.draw_samples(removed_inputs).reshape(
+                num_parent_samples, num_samples_conditional
+            )
+            edges.append((child, parent))
+            strengths.append(np.mean(removed.var(axis=1) - original_variance))
+    arrow_strength = pd.Series(
+        strengths,
+        index=pd.MultiIndex.from_tuples(edges, names=["child", "parent"]),
+        name="arrow_strength",
+        dtype=float,
+    )
+
+    if targets is None:
+        targets = [node for node in graph.nodes if not is_root_node(graph, node)]
+    pairs, influences = [], []
+    for target in targets:
+        icc = gcm.intrinsic_causal_influence(
+            upstream_model(causal_model, target), target, prediction_model="exact"
+        )
+        for node, value in icc.items():
+            pairs.append((target, node))
+            influences.append(value)
+    intrinsic_influence = pd.Series(
+        influences,
+        index=pd.MultiIndex.from_tuples(pairs, names=["target", "node"]),
+        name="intrinsic_influence",
+        dtype=float,
+    )
+    return arrow_strength, intrinsic_influence
+
+
+def _window_influences(task):
+    # fit the SCM of one window and compute all measures
+    window, graph, data, targets, method, kwargs = task
+    with trace("causal_influences", rows=len(data), window=window, method=method):
+        causal_model = create_causal_model(graph, data)
+        if method == "auto":
+            method = "linear" if is_linear(causal_model) else "sampling"
+        if method == "linear":
+            arrow_strength, intrinsic_influence = linear_influences(causal_model, targets)
+        elif method == "sampling":
+            arrow_strength, intrinsic_influence = sampled_influences(
+                causal_model, targets, **kwargs
+            )
+        else:
+            raise ValueError(f"unknown method {method}")
+    return window, arrow_strength, intrinsic_influence
+
+
+def causal_influences(
+    graph_dict,
+    windows,
+    targets=None,
+    method="auto",
+    standardizer=None,
+    processes=None,
+    **kwargs,
+):
+    """
+    Arrow strengths of all edges and intrinsic causal influences of the SCMs fitted on many time windows
+    (e.g. every year) in one batch, every window is a task of a process pool, see module docstring.
+
+    Parameters:
+    graph_dict (dict): The causal graph dictionary.
+    windows (dict): Maps the label of a window (e.g. "2018") to its normalized data with the nodes of the
+        graph as columns.
+    targets (list, optional): The targets of the intrinsic causal influences, e.g. ["price_da"]. Defaults to
+        all non-root nodes.
+    method (str, optional): "linear" (closed form), "sampling" or "auto" (linear if all mechanisms are
+        linear). Defaults to "auto".
+    standardizer (scripts.utils.Standardizer, optional): The standardizer of the data. If given, the measures
+        are returned in the squared unit of the child (target), otherwise in the normalized scale.
+    processes (int, optional): Number of worker processes, 1 computes in this process. Defaults to the number of CPUs.
+    **kwargs: Arguments of sampled_influences.
+
+    Returns:
+    tuple: The arrow strengths (DataFrame with the column "arrow_strength" indexed by window, child and
+        parent) and the intrinsic causal influences (DataFrame with the column "intrinsic_influence"
+        indexed by window, target and node).
+    """
+    tasks = [
+        (
+            window,
+            graph_dict["graph"],
+            data.loc[:, graph_dict["nodes"]].dropna(),
+            targets,
+            method,
+            kwargs,
+        )
+        for window, data in windows.items()
+    ]
+    processes = min(processes or os.cpu_count(), len(tasks))
+    if processes == 1:
+        results = [_window_influences(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_window_influences, tasks)
+
+    arrow_strength = pd.concat(
+        {window: strength for window, strength, _ in results}, names=["window"]
+    ).to_frame()
+    intrinsic_influence = pd.concat(
+        {window: influence for window, _, influence in results}, names=["window"]
+    ).to_frame()
+    if standardizer is not None:
+        variance = standardizer.std.astype(float) ** 2
+        arrow_strength["arrow_strength"] *= variance.loc[
+            arrow_strength.index.get_level_values("child")
+        ].to_numpy()
+        intrinsic_influence["intrinsic_influence"] *= variance.loc[
+            intrinsic_influence.index.get_level_values("target")
+        ].to_numpy()
+    return arrow_strength, intrinsic_influence
@@ -47,6 +47,24 @@ def plot_coefficients(df, col, ax, color):
     )
 
 
+def plot_coefficient_bars(df, col, color, ylabel, ax):
+    """
+    Plot a bar chart of structural coefficients with a y-label, used for batch rendering (see scripts/rendering.py).
+
+    Parameters:
+    df (pandas.DataFrame): DataFrame containing the coefficients.
+    col (str): The column name in the DataFrame to plot as the height of the bars.
+    color (str): The color of the bars.
+    ylabel (str): The label of the y-axis.
+    ax (matplotlib.axes.Axes): The matplotlib axes object on which to plot the bar chart.
+
+    Returns:
+    None
+    """
+    plot_coefficients(df=df, col=col, ax=ax, color=color)
+    ax.set_ylabel(ylabel)
+
+
 def plot_evaluation_results_custom(
     evaluation_result, ax, bins=None, savepath=None, display=True
 ):
@@ -0,0 +1,229 @@
+"""
+Approximate kernel (conditional) independence tests with linear cost in the number of rows.
+
+The kernel-based tests of dowhy (used by falsify_graph and gcm.evaluate_causal_model) scale
+super-linearly in the number of rows and are therefore run on subsamples. The tests here follow
+RCIT/RCoT (Strobl et al., "Approximate kernel-based conditional independence tests for fast
+non-parametric causal discovery", 2019): the kernels are approximated with random Fourier features,
+the features of X and Y are regressed on those of Z and the test statistic is the squared
+Frobenius norm of the cross-covariance of the residuals. Its null distribution (a weighted sum
+of chi-squared variables) is approximated with the Hall-Buckley-Eagleson method, no permutations
+are needed. All rows can be used.
+
+The tests have the signature of the tests of dowhy and can be passed to falsify_graph,
+EvaluateCausalModelConfig or create_eval_scm (ci_test="rcot").
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from dowhy.graph import get_ordered_predecessors
+
+
+def _as_2d(X):
+    X = np.asarray(X, dtype=np.float64)
+    return X.reshape(-1, 1) if X.ndim == 1 else X
+
+
+def _standardize(X):
+    std = X.std(axis=0)
+    return (X - X.mean(axis=0)) / np.where(std > 0, std, 1)
+
+
+def random_fourier_features(X, num_features, rng, max_num_samples_bandwidth=500):
+    """
+    Random Fourier features of a Gaussian kernel, the bandwidth is the median distance of the
+    (first) rows.
+
+    Parameters:
+    X (numpy.ndarray): The standardized data (rows, dimensions).
+    num_features (int): The number of features.
+    rng (numpy.random.Generator): The random generator.
+    max_num_samples_bandwidth (int, optional): Number of rows used for the median heuristic. Defaults to 500.
+
+    Returns:
+    numpy.ndarray: The centered features (rows, num_features).
+    """
+    sample = X[:max_num_samples_bandwidth]
+    distances = np.sqrt(((sample[:, None, :] - sample[None, :, :]) ** 2).sum(axis=2))
+    bandwidth = np.median(distances[distances > 0]) if (distances > 0).any() else 1.0
+    W = rng.normal(scale=1 / bandwidth, size=(X.shape[1], num_features))
+    b = rng.uniform(0, 2 * np.pi, size=num_features)
+    features = np.sqrt(2 / num_features) * np.cos(X @ W + b)
+    return features - features.mean(axis=0)
+
+
+def _hbe_p_value(statistic, eigenvalues):
+    # Hall-Buckley-Eagleson approximation of a weighted sum of chi-squared variables
+    eigenvalues = eigenvalues[eigenvalues > 0]
+    if len(eigenvalues) == 0:
+        return 1.0
+    kappa1 = eigenvalues.sum()
+    kappa2 = 2 * (eigenvalues**2).sum()
+    kappa3 = 8 * (eigenvalues**3).sum()
+    nu = 8 * kappa2**3 / kappa3**2
+    x = (statistic - kappa1) * np.sqrt(2 * nu / kappa2) + nu
+    return float(scipy.stats.chi2.sf(x, df=nu))
+
+
+def rcot(
+    X,
+    Y,
+    Z=None,
+    num_features_xy=5,
+    num_features_z=100,
+    ridge=1e-10,
+    random_seed=0,
+):
+    """
+    Randomized conditional correlation test (RCoT) of X independent of Y given Z, or the randomized
+    independence test (RIT) if Z is None. The cost is linear in the number of rows.
+
+    Parameters:
+    X (numpy.ndarray): Samples of X (rows) or (rows, dimensions).
+    Y (numpy.ndarray): Samples of Y.
+    Z (numpy.ndarray, optional): Samples of the conditioning variables. Defaults to None.
+    num_features_xy (int, optional): Number of random Fourier features of X and Y. Defaults to 5.
+    num_features_z (int, optional): Number of random Fourier features of Z. Defaults to 100.
+    ridge (float, optional): Ridge penalty of the regression on the features of Z. Defaults to 1e-10.
+    random_seed (int, optional): Seed of the random features. Defaults to 0.
+
+    Returns:
+    float: The p-value.
+    """
+    rng = np.random.default_rng(random_seed)
+    X, Y = _standardize(_as_2d(X)), _standardize(_as_2d(Y))
+    n = X.shape[0]
+    f_x = random_fourier_features(X, num_features_xy, rng)
+    f_y = random_fourier_features(Y, num_features_xy, rng)
+    if Z is not None and _as_2d(Z).shape[1] > 0:
+        Z = _standardize(_as_2d(Z))
+        f_z = random_fourier_features(Z, num_features_z, rng)
+        # residuals of the ridge regressions of the features of X and Y on those of Z
+        C_zz = f_z.T @ f_z / n + ridge * np.eye(num_features_z)
+        beta = np.linalg.solve(C_zz, f_z.T @ np.hstack([f_x, f_y]) / n)
+        residuals = np.hstack([f_x, f_y]) - f_z @ beta
+        f_x, f_y = residuals[:, :num_features_xy], residuals[:, num_features_xy:]
+
+    C_xy = f_x.T @ f_y / n
+    statistic = n * (C_xy**2).sum()
+    # covariance of the products of the features, its eigenvalues are the weights of the null distribution
+    products = (f_x[:, :, None] * f_y[:, None, :]).reshape(n, -1)
+    products = products - products.mean(axis=0)
+    eigenvalues = np.linalg.eigvalsh(products.T @ products / n)
+    return _hbe_p_value(statistic, eigenvalues)
+
+
+def rit(X, Y, num_features_xy=5, random_seed=0):
+    """
+    Randomized independence test (RIT) of X independent of Y, see rcot.
+
+    Parameters:
+    X (numpy.ndarray): Samples of X.
+    Y (numpy.ndarray): Samples of Y.
+    num_features_xy (int, optional): Number of random Fourier features of X and Y. Defaults to 5.
+    random_seed (int, optional): Seed of the random features. Defaults to 0.
+
+    Returns:
+    float: The p-value.
+    """
+    return rcot(X, Y, None, num_features_xy=num_features_xy, random_seed=random_seed)
+
+
+def local_markov_statements(causal_graph):
+    """
+    The conditional independence statements implied by the local Markov property of a graph:
+    every node is independent of each non-descendant that is not a parent, given its parents.
+
+    Parameters:
+    causal_graph (networkx.DiGraph): The causal graph.
+
+    Returns:
+    list: Tuples (node, non-descendant, parents).
+    """
+    import networkx as nx
+
+    statements = []
+    for node in causal_graph.nodes:
+        parents = get_ordered_predecessors(causal_graph, node)
+        descendants = nx.descendants(causal_graph, node)
+        for other in causal_graph.nodes:
+            if other != node and other not in descendants and other not in parents:
+                statements.append((node, other, parents))
+    return statements
+
+
+def compare_ci_tests(causal_graph, data, tests, max_statements=None, random_seed=0):
+    """
+    Compare the p-values of several (conditional) independence tests on the local Markov statements
+    of a graph, e.g. the exact kernel test of dowhy and rcot on synthetic data.
+
+    Parameters:
+    causal_graph (networkx.DiGraph): The causal graph.
+    data (pandas.DataFrame): The (normalized) data.
+    tests (dict): Maps a name to a test with the signature test(X, Y, Z=None).
+    max_statements (int, optional): Number of randomly chosen statements. Defaults to all.
+    random_seed (int, optional): Seed of the choice of the statements. Defaults to 0.
+
+    Returns:
+    pandas.DataFrame: One row per statement (node, other, parents) with the p-value of every test.
+    """
+    statements = local_markov_statements(causal_graph)
+    if max_statements is not None and max_statements < len(statements):
+        rng = np.random.default_rng(random_seed)
+        chosen = rng.choice(len(statements), size=max_statements, replace=False)
+        statements = [statements[i] for i in sorted(chosen)]
+    rows = []
+    for node, other, parents in statements:
+        X, Y = data[node].to_numpy(), data[other].to_numpy()
+        Z = data[parents].to_numpy() if parents else None
+        row = {"node": node, "other": other, "parents": ", ".join(parents)}
+        for name, test in tests.items():
+            row[name] = test(X, Y) if Z is None else test(X, Y, Z)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+CI_TESTS = ["kernel", "rcot"]
+
+
+def falsify_graph_tests(ci_test):
+    """
+    Keyword arguments of falsify_graph selecting the (conditional) independence tests.
+
+    Parameters:
+    ci_test (str): "kernel" (the exact kernel tests of dowhy) or "rcot".
+
+    Returns:
+    dict: The keyword arguments (empty for the defaults of dowhy).
+    """
+    if ci_test not in CI_TESTS:
+        raise ValueError(f"unknown ci test {ci_test}")
+    if ci_test == "kernel":
+        return {}
+    return {"independence_test": rit, "conditional_independence_test": rcot}
+
+
+def evaluation_config(ci_test):
+    """
+    Config of gcm.evaluate_causal_model selecting the (conditional) independence tests of the
+    invertibility check and of the graph falsification.
+
+    Parameters:
+    ci_test (str): "kernel" (the exact kernel tests of dowhy) or "rcot".
+
+    Returns:
+    gcm.model_evaluation.EvaluateCausalModelConfig: The config (None for the defaults of dowhy).
+    """
+    from dowhy.gcm.model_evaluation import EvaluateCausalModelConfig
+
+    if ci_test not in CI_TESTS:
+        raise ValueError(f"unknown ci test {ci_test}")
+    if ci_test == "kernel":
+        return None
+    return EvaluateCausalModelConfig(
+        independence_test_invertible=rit,
+        independence_test_falsify=rit,
+        conditional_independence_test_falsify=rcot,
+    )
@@ -0,0 +1,320 @@
+"""
+Attribution of the change of the distribution of a target (e.g. price_da before and after
+ENERGY_CRISIS) to the changes of the causal mechanisms of the nodes, in the spirit of
+gcm.distribution_change (Budhathoki et al., "Why did the distribution change?", 2021).
+
+The two causal models are fitted once per period (see fit_period_models) and their mechanisms are
+reused: a coalition S of nodes takes the mechanisms of the new period, all other nodes those of the
+old period, and the value of S is the change of the mean and variance of the target relative to the
+old model. The Shapley values of the nodes split the total change (the new model) among them.
+- method="linear": for linear SCMs (see causal_functions.create_causal_model) the mean and variance of
+  the target of every coalition are computed in closed form (the total effects on the target follow
+  from a linear solve). The Shapley values are exact, all coalitions are evaluated with batched solves.
+- method="sampling": any mechanisms. Target samples are drawn for the coalitions along random
+  permutations of the nodes, with the same random numbers for every coalition. The permutations are
+  evaluated on a process pool.
+Both models have to be fitted on data normalized with the same standardizer, the results are given in
+the unit of the target if the standardizer is passed.
+"""
+
+import os
+import multiprocessing
+from math import factorial
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from dowhy import gcm
+from dowhy.graph import is_root_node, get_ordered_predecessors
+from dowhy.gcm.causal_models import PARENTS_DURING_FIT
+from dowhy.gcm.util.general import set_random_seed
+
+from scripts.causal_functions import create_causal_model
+from scripts.profiling import trace
+
+MEASURES = ["mean", "variance"]
+
+# models of the worker process, set by _init_worker
+_MODELS = None
+
+
+def fit_period_models(graph_dict, data, split, standardizer, mechanism_cache=None):
+    """
+    Fit the causal models of the periods before and after a point in time (e.g. ENERGY_CRISIS) on data
+    normalized with the same standardizer.
+
+    Parameters:
+    graph_dict (dict): The causal graph dictionary.
+    data (pandas.DataFrame): The original data with a time index.
+    split (pandas.Timestamp): The first time step of the new period.
+    standardizer (scripts.utils.Standardizer): Means and standard deviations of the original data.
+    mechanism_cache (MechanismCache, optional): Cache of fitted mechanisms shared by several graphs.
+
+    Returns:
+    tuple: The causal models of the old and of the new period.
+    """
+    data = standardizer.transform(data.loc[:, graph_dict["nodes"]].dropna())
+    old = create_causal_model(
+        graph_dict["graph"], data[data.index < split], mechanism_cache=mechanism_cache
+    )
+    new = create_causal_model(
+        graph_dict["graph"], data[data.index >= split], mechanism_cache=mechanism_cache
+    )
+    return old, new
+
+
+def _players(causal_model, target):
+    # nodes whose mechanism can change the target, in topological order
+    graph = causal_model.graph
+    upstream = nx.ancestors(graph, target) | {target}
+    return [node for node in nx.topological_sort(graph) if node in upstream]
+
+
+def _linear_parameters(causal_model, players):
+    # B[i, j]: coefficient of parent i in the mechanism of j, offset and variance of the noise of j
+    position = {node: i for i, node in enumerate(players)}
+    n = len(players)
+    B, offset, variance = np.zeros((n, n)), np.zeros(n), np.zeros(n)
+    for node in players:
+        mechanism = causal_model.causal_mechanism(node)
+        j = position[node]
+        if is_root_node(causal_model.graph, node):
+            values = np.ravel(mechanism.data).astype(float)
+            offset[j], variance[j] = values.mean(), values.var()
+            continue
+        model = mechanism.prediction_model.sklearn_model
+        parents = get_ordered_predecessors(causal_model.graph, node)
+        B[[position[p] for p in parents], j] = np.ravel(model.coef_).astype(float)
+        noise = np.ravel(mechanism.noise_model.data).astype(float)
+        offset[j] = float(np.ravel(model.intercept_)[0]) + noise.mean()
+        variance[j] = noise.var()
+    return B, offset, variance
+
+
+def _linear_values(coalitions, old, new, target_position):
+    # mean and variance of the target for every coalition (boolean rows, True: new mechanism)
+    (B_old, offset_old, var_old), (B_new, offset_new, var_new) = old, new
+    n = len(offset_old)
+    I = np.eye(n)
+    A = np.where(coalitions[:, None, :], I - B_new, I - B_old)
+    e_target = np.zeros((len(coalitions), n, 1))
+    e_target[:, target_position] = 1
+    # total effect of the noise of every node on the target
+    total_effect = np.linalg.solve(A, e_target)[:, :, 0]
+    offset = np.where(coalitions, offset_new, offset_old)
+    variance = np.where(coalitions, var_new, var_old)
+    return np.column_stack(
+        [(total_effect * offset).sum(axis=1), (total_effect**2 * variance).sum(axis=1)]
+    )
+
+
+def _exact_shapley(values, n):
+    # Shapley values from the values of all 2^n coalitions (index: bit mask of the coalition)
+    masks = np.arange(2**n)
+    size = np.zeros(2**n, dtype=int)
+    for i in range(n):
+        size += (masks >> i) & 1
+    weights = np.array(
+        [factorial(s) * factorial(n - s - 1) / factorial(n) for s in range(n)]
+    )
+    shapley = np.zeros((n, values.shape[1]))
+    for i in range(n):
+        without = masks[((masks >> i) & 1) == 0]
+        shapley[i] = (
+            weights[size[without], None] * (values[without | (1 << i)] - values[without])
+        ).sum(axis=0)
+    return shapley
+
+
+def linear_distribution_change(
+    causal_model_old,
+    causal_model_new,
+    target,
+    max_exact_players=16,
+    num_permutations=2000,
+    chunk_size=16384,
+    random_seed=0,
+):
+    """
+    Shapley attribution of the change of the mean and variance of the target to the mechanisms of
+    linear SCMs, see module docstring. With at most max_exact_players nodes upstream of the target the
+    values of all coalitions are computed (exact), otherwise along random permutations.
+
+    Parameters:
+    causal_model_old (gcm.StructuralCausalModel): The fitted linear causal model of the old period.
+    causal_model_new (gcm.StructuralCausalModel): The fitted linear causal model of the new period.
+    target (str): The target node.
+    max_exact_players (int, optional): Maximal number of nodes for the exact computation. Defaults to 16.
+    num_permutations (int, optional): Number of permutations otherwise. Defaults to 2000.
+    chunk_size (int, optional): Number of coalitions per batched solve. Defaults to 16384.
+    random_seed (int, optional): Seed of the permutations. Defaults to 0.
+
+    Returns:
+    pandas.DataFrame: The contributions to the change of the mean and variance (normalized scale) per node.
+    """
+    players = _players(causal_model_old, target)
+    n = len(players)
+    old = _linear_parameters(causal_model_old, players)
+    new = _linear_parameters(causal_model_new, players)
+    target_position = players.index(target)
+
+    if n <= max_exact_players:
+        values = np.empty((2**n, len(MEASURES)))
+        for start in range(0, 2**n, chunk_size):
+            masks = np.arange(start, min(start + chunk_size, 2**n))
+            coalitions = ((masks[:, None] >> np.arange(n)) & 1).astype(bool)
+            values[masks] = _linear_values(coalitions, old, new, target_position)
+        shapley = _exact_shapley(values - values[0], n)
+    else:
+        rng = np.random.default_rng(random_seed)
+        shapley = np.zeros((n, len(MEASURES)))
+        for _ in range(num_permutations):
+            order = rng.permutation(n)
+            # coalitions along the permutation: none, the first node, the first two nodes, ...
+            coalitions = np.zeros((n + 1, n), dtype=bool)
+            for k, i in enumerate(order):
+                coalitions[k + 1 :, i] = True
+            values = _linear_values(coalitions, old, new, target_position)
+            shapley[order] += np.diff(values, axis=0)
+        shapley /= num_permutations
+    return pd.DataFrame(shapley, index=pd.Index(players, name="node"), columns=MEASURES)
+
+
+def _coalition_model(coalition, players):
+    # causal model with the new mechanisms for the nodes of the coalition
+    old, new = _MODELS
+    causal_model = gcm.StructuralCausalModel(old.graph.copy())
+    for node in causal_model.graph.nodes:
+        source = new if node in coalition else old
+        causal_model.set_causal_mechanism(node, source.causal_mechanism(node))
+        causal_model.graph.nodes[node][PARENTS_DURING_FIT] = get_ordered_predecessors(
+            causal_model.graph, node
+        )
+    return causal_model
+
+
+def _coalition_value(coalition, players, target, num_samples, seed):
+    # mean and variance of the target, the same seed for all coalitions (common random numbers)
+    set_random_seed(seed)
+    samples = gcm.draw_samples(_coalition_model(coalition, players), num_samples)
+    target_samples = samples[target].to_numpy()
+    return np.array([target_samples.mean(), target_samples.var()])
+
+
+def _init_worker(models):
+    global _MODELS
+    _MODELS = models
+
+
+def _permutation_contributions(task):
+    # summed marginal contributions of the nodes along some permutations
+    permutations, players, target, num_samples, seed = task
+    contributions = np.zeros((len(players), len(MEASURES)))
+    with trace("distribution_change_permutations", rows=len(permutations)):
+        cache = {}
+        for order in permutations:
+            coalition = frozenset()
+            if coalition not in cache:
+                cache[coalition] = _coalition_value(
+                    coalition, players, target, num_samples, seed
+                )
+            previous = cache[coalition]
+            for i in order:
+                coalition = coalition | {players[i]}
+                if coalition not in cache:
+                    cache[coalition] = _coalition_value(
+                        coalition, players, target, num_samples, seed
+                    )
+                contributions[i] += cache[coalition] - previous
+                previous = cache[coalition]
+    return contributions
+
+
+def sampled_distribution_change(
+    causal_model_old,
+    causal_model_new,
+    target,
+    num_permutations=100,
+    num_samples=5000,
+    processes=None,
+    random_seed=0,
+):
+    """
+    Shapley attribution of the change of the mean and variance of the target to the mechanisms, for
+    any mechanisms, see module docstring. The permutations are evaluated on a process pool.
+
+    Parameters:
+    causal_model_old (gcm.StructuralCausalModel): The fitted causal model of the old period.
+    causal_model_new (gcm.StructuralCausalModel): The fitted causal model of the new period.
+    target (str): The target node.
+    num_permutations (int, optional): Number of random permutations. Defaults to 100.
+    num_samples (int, optional): Number of samples drawn per coalition. Defaults to 5000.
+    processes (int, optional): Number of worker processes, 1 evaluates in this process. Defaults to the number of CPUs.
+    random_seed (int, optional): Seed of the permutations and of the samples. Defaults to 0.
+
+    Returns:
+    pandas.DataFrame: The contributions to the change of the mean and variance (normalized scale) per node.
+    """
+    global _MODELS
+    players = _players(causal_model_old, target)
+    rng = np.random.default_rng(random_seed)
+    permutations = [rng.permutation(len(players)) for _ in range(num_permutations)]
+    processes = min(processes or os.cpu_count(), num_permutations)
+    tasks = [
+        (permutations[i::processes], players, target, num_samples, random_seed)
+        for i in range(processes)
+    ]
+    models = (causal_model_old, causal_model_new)
+    if processes == 1:
+        _MODELS = models
+        results = [_permutation_contributions(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=(models,)
+        ) as pool:
+            results = pool.map(_permutation_contributions, tasks)
+    shapley = np.sum(results, axis=0) / num_permutations
+    return pd.DataFrame(shapley, index=pd.Index(players, name="node"), columns=MEASURES)
+
+
+def distribution_change(
+    causal_model_old,
+    causal_model_new,
+    target,
+    method="linear",
+    standardizer=None,
+    **kwargs,
+):
+    """
+    Attribute the change of the mean and variance of the target between two periods to the changes of
+    the mechanisms of the nodes, see module docstring.
+
+    Parameters:
+    causal_model_old (gcm.StructuralCausalModel): The fitted causal model of the old period.
+    causal_model_new (gcm.StructuralCausalModel): The fitted causal model of the new period.
+    target (str): The target node, e.g. "price_da".
+    method (str, optional): "linear" (exact, linear SCMs only) or "sampling". Defaults to "linear".
+    standardizer (scripts.utils.Standardizer, optional): The standardizer of the data of both models. If
+        given, the contributions are returned in the unit of the target (variance: unit squared).
+    **kwargs: Arguments of linear_distribution_change or sampled_distribution_change.
+
+    Returns:
+    pandas.DataFrame: The contributions to the change of the mean and variance per node, sorted by the
+        absolute contribution to the change of the mean. The contributions sum to the total change.
+    """
+    with trace("distribution_change", target=target, method=method):
+        if method == "linear":
+            result = linear_distribution_change(
+                causal_model_old, causal_model_new, target, **kwargs
+            )
+        elif method == "sampling":
+            result = sampled_distribution_change(
+                causal_model_old, causal_model_new, target, **kwargs
+            )
+        else:
+            raise ValueError(f"unknown method {method}")
+    if standardizer is not None:
+        result["mean"] *= standardizer.std[target]
+        result["variance"] *= standardizer.std[target] ** 2
+    return result.loc[result["mean"].abs().sort_values(ascending=False).index]
@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import pickle as pkl
 from dowhy.graph import is_root_node
@@ -29,15 +30,19 @@ def compare_coefficients(graph_name: str, var: str, years: list) -> pd.DataFrame
     return pd.concat(frames, axis=1)
 
 
-def compare_r2_scores(graph: dict, years: list) -> pd.DataFrame:
+def compare_r2_scores(graph: dict, years: list, table: pd.DataFrame = None) -> pd.DataFrame:
     """
     Create a DataFrame of R2 scores for different times as columns.
     This function reads evaluation results from serialized files, extracts the R2 scores for non-root
-    nodes, and organizes them into a DataFrame.
+    nodes, and organizes them into a DataFrame. The compact table of the budgeted evaluation
+    (evaluation/<graph>_<years>_mechanisms.csv, see scripts.mechanism_evaluation) is read if it exists,
+    otherwise the result of gcm.evaluate_causal_model.
 
     Parameters:
     graph (dict): The causal graph dictionary.
-    years (list): A list of years to compare.
+    years (list): A list of years (windows) to compare.
+    table (pd.DataFrame, optional): A table of scripts.mechanism_evaluation.evaluate_mechanisms with the
+        windows given in years, used instead of the files.
 
     Returns:
     pd.DataFrame: A DataFrame containing the R2 scores for different times as columns.
@@ -45,16 +50,22 @@ def compare_r2_scores(graph: dict, years: list) -> pd.DataFrame:
     causal_graph = graph["graph"]
     graph_name = graph["name"]
     dir = f"../models/{graph_name}/"
+    non_root = [node for node in causal_graph.nodes if not is_root_node(causal_graph, node)]
 
     frames = []
     for t in years:
-        with open(dir + f"evaluation/{graph_name}_{t}_evaluation.pkl", "rb") as handle:
-            evaluate_causal_model = pkl.load(handle)
-        performances = evaluate_causal_model.mechanism_performances
-        r2_scores = {
-            node: performances[node].r2
-            for node in causal_graph.nodes
-            if not is_root_node(causal_graph, node)
-        }
+        if table is not None:
+            performances = table[table["window"] == t].set_index("node")["r2"]
+            r2_scores = performances.loc[non_root].to_dict()
+        elif os.path.exists(dir + f"evaluation/{graph_name}_{t}_mechanisms.csv"):
+            performances = pd.read_csv(
+                dir + f"evaluation/{graph_name}_{t}_mechanisms.csv", index_col="node"
+            )["r2"]
+            r2_scores = performances.loc[non_root].to_dict()
+        else:
+            with open(dir + f"evaluation/{graph_name}_{t}_evaluation.pkl", "rb") as handle:
+                evaluate_causal_model = pkl.load(handle)
+            performances = evaluate_causal_model.mechanism_performances
+            r2_scores = {node: performances[node].r2 for node in non_root}
         frames.append(pd.DataFrame.from_dict(r2_scores, orient="index", columns=[t]))
     return pd.concat(frames, axis=1).sort_index()
@@ -0,0 +1,248 @@
+"""
+Feature store of the derived features of the combined dataset.
+
+The derived features have one definition here and are used by the SCM notebooks, the multi-zone
+pipeline, the synthetic data and the GBT models (shapley-flow):
+
+- hour_sin, hour_cos: the fractional hour of the day (resolution.hour_of_day) on the unit circle,
+- day_of_year_sin, day_of_year_cos: (day_of_year - 1) * 2 pi / 365, so January 1st is at angle 0,
+- isworkingday: 1.0 on working days (no weekend, no public holiday), 0.0 otherwise, as float,
+- ramps like rl_FR_ramp: ramp(t) = f(t) - f(t - one time step) of the residual loads.
+
+materialize_features computes them once, vectorized, from a combined dataset (e.g. data_selected_FR_2018-2023.csv
+of 01-get_data_nuc.ipynb) and stores them next to it (data_selected_FR_2018-2023_features.npz, one
+array per feature). load_features and add_features load them by name, only the requested arrays are
+read. The store is rebuilt when the dataset is newer.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from scripts.profiling import traced
+from scripts.resolution import hour_of_day, infer_freq
+
+CYCLICAL_FEATURES = ["hour_sin", "hour_cos", "day_of_year_sin", "day_of_year_cos"]
+CALENDAR_FEATURES = CYCLICAL_FEATURES + ["isworkingday"]
+
+
+def working_day(index, holidays=None):
+    """
+    Whether the time steps lie on a working day: Monday to Friday and no public holiday. A holiday
+    covers the whole (UTC) day of its timestamp.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The timestamps.
+    holidays (pandas.DatetimeIndex, optional): The public holidays. Defaults to None (no holidays).
+
+    Returns:
+    numpy.ndarray: Boolean array, True on working days.
+    """
+    working = np.asarray(index.weekday < 5)
+    if holidays is not None and len(holidays) > 0:
+        holidays = pd.DatetimeIndex(holidays).normalize()
+        working &= ~np.asarray(index.normalize().isin(holidays))
+    return working
+
+
+def calendar_features(index, holidays=None):
+    """
+    The calendar features of a time index of any resolution, see module docstring.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The timestamps.
+    holidays (pandas.DatetimeIndex, optional): The public holidays. Defaults to None (no holidays).
+
+    Returns:
+    pandas.DataFrame: DataFrame with the columns CALENDAR_FEATURES (float).
+    """
+    hour = hour_of_day(index)
+    day_of_year = np.asarray(index.dayofyear) - 1
+    return pd.DataFrame(
+        {
+            "hour_sin": np.sin(hour * (2.0 * np.pi / 24)),
+            "hour_cos": np.cos(hour * (2.0 * np.pi / 24)),
+            "day_of_year_sin": np.sin(day_of_year * (2.0 * np.pi / 365)),
+            "day_of_year_cos": np.cos(day_of_year * (2.0 * np.pi / 365)),
+            "isworkingday": working_day(index, holidays).astype(float),
+        },
+        index=index,
+    )
+
+
+def ramp(series, freq=None):
+    """
+    The ramp of a time series, ramp(t) = f(t) - f(t - one time step). Missing time steps give NaN.
+
+    Parameters:
+    series (pandas.Series): The time series.
+    freq (str, optional): The time step, e.g. "h" or "15min". Defaults to the resolution of the
+        series (see resolution.infer_freq).
+
+    Returns:
+    pandas.Series: The ramp with the index of the series.
+    """
+    if freq is None:
+        freq = infer_freq(series.index)
+    return (series - series.shift(periods=1, freq=freq)).reindex(series.index)
+
+
+def ramp_sources(columns):
+    """
+    The residual load columns whose ramps are derived features, as in calc_ramps of 01-get_data_nuc.ipynb.
+
+    Parameters:
+    columns (list): The columns of a dataset.
+
+    Returns:
+    list: The source columns, the ramp of column c is named c + "_ramp".
+    """
+    return [
+        column
+        for column in columns
+        if column.startswith("rl_")
+        and "cutoff" not in column
+        and not column.endswith("_ramp")
+    ]
+
+
+def derived_features(data, names=None, freq=None):
+    """
+    Compute derived features of a dataset, see module docstring. isworkingday is taken from the
+    column of the dataset if it has one (it includes the public holidays), otherwise it is computed
+    from the timestamps. A ramp is computed from its source column, a dataset without the source
+    (e.g. data_selected has rl_FR_ramp but not rl_FR) provides the ramp computed by 01-get_data_nuc.ipynb.
+
+    Parameters:
+    data (pandas.DataFrame): The dataset with a DatetimeIndex.
+    names (list, optional): The features. Defaults to CALENDAR_FEATURES and all ramps of the dataset.
+    freq (str, optional): The time step of the ramps. Defaults to the smallest step of the index.
+
+    Returns:
+    pandas.DataFrame: The features (float) with the index of the dataset.
+    """
+    if names is None:
+        ramps = [f"{column}_ramp" for column in ramp_sources(data.columns)]
+        ramps += [
+            c for c in data.columns if c.startswith("rl_") and c.endswith("_ramp")
+        ]
+        names = CALENDAR_FEATURES + sorted(set(ramps))
+    if freq is None:
+        freq = infer_freq(data.index)
+
+    calendar = calendar_features(data.index)
+    if "isworkingday" in data.columns:
+        calendar["isworkingday"] = data["isworkingday"].astype(float)
+    features = {}
+    for name in names:
+        if name in CALENDAR_FEATURES:
+            features[name] = calendar[name]
+        elif name.endswith("_ramp") and name[: -len("_ramp")] in data.columns:
+            features[name] = ramp(data[name[: -len("_ramp")]].astype(float), freq)
+        elif name.endswith("_ramp") and name in data.columns:
+            features[name] = data[name].astype(float)
+        else:
+            raise KeyError(f"unknown feature {name}")
+    return pd.DataFrame(features, index=data.index)
+
+
+def features_path(data_path):
+    """
+    The path of the feature store of a combined dataset, next to it.
+
+    Parameters:
+    data_path (str): The path of the dataset, e.g. ../data/processed/combined_data/data_selected_FR_2018-2023.csv.
+
+    Returns:
+    str: The path of the store, e.g. ../data/processed/combined_data/data_selected_FR_2018-2023_features.npz.
+    """
+    return os.path.splitext(data_path)[0] + "_features.npz"
+
+
+@traced()
+def materialize_features(data_path, names=None, freq=None):
+    """
+    Compute the derived features of a combined dataset csv file once and store them next to it.
+    Only the timestamps, isworkingday and the residual load columns are read.
+
+    Parameters:
+    data_path (str): The path of the dataset (csv file with a timestamp column).
+    names (list, optional): The features. Defaults to CALENDAR_FEATURES and all ramps of the dataset.
+    freq (str, optional): The time step of the ramps. Defaults to the smallest step of the index.
+
+    Returns:
+    str: The path of the store.
+    """
+    header = pd.read_csv(data_path, nrows=0).columns
+    columns = [c for c in header if c == "isworkingday" or c.startswith("rl_")]
+    data = pd.read_csv(data_path, usecols=["timestamp"] + columns)
+    data.index = pd.to_datetime(data.pop("timestamp"), utc=True)
+    features = derived_features(data, names, freq)
+
+    path = features_path(data_path)
+    # written to a temporary file first, a reader never sees a partial store
+    tmp = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(
+        tmp,
+        timestamp=features.index.asi8,
+        **{name: features[name].to_numpy(dtype=np.float64) for name in features},
+    )
+    os.replace(tmp, path)
+    return path
+
+
+def _is_stale(path, data_path):
+    if not os.path.exists(path):
+        return True
+    return os.path.getmtime(data_path) > os.path.getmtime(path)
+
+
+def load_features(data_path, names=None):
+    """
+    Load derived features of a combined dataset by name from its feature store. The store is
+    materialized first if it does not exist or the dataset is newer.
+
+    Parameters:
+    data_path (str): The path of the dataset.
+    names (list, optional): The features. Defaults to all features of the store.
+
+    Returns:
+    pandas.DataFrame: The features with the (UTC) timestamps of the dataset as index.
+    """
+    path = features_path(data_path)
+    if _is_stale(path, data_path):
+        materialize_features(data_path)
+    with np.load(path) as store:
+        available = [name for name in store.files if name != "timestamp"]
+        if names is None:
+            names = available
+        missing = [name for name in names if name not in available]
+        if missing:
+            raise KeyError(f"{missing} not in the feature store {path} ({available})")
+        index = pd.to_datetime(store["timestamp"], utc=True).rename("timestamp")
+        return pd.DataFrame({name: store[name] for name in names}, index=index)
+
+
+def add_features(data, data_path, names):
+    """
+    Add derived features from the feature store of a combined dataset to the data loaded from it.
+    Existing columns with the same names (e.g. the boolean isworkingday) are replaced in place,
+    new features are appended in the given order.
+
+    Parameters:
+    data (pandas.DataFrame): The data with a DatetimeIndex (a subset of the rows of the dataset).
+    data_path (str): The path of the dataset.
+    names (list): The features.
+
+    Returns:
+    pandas.DataFrame: The data with the features.
+    """
+    features = load_features(data_path, names)
+    if data.index.tz is None:
+        features.index = features.index.tz_localize(None)
+    features = features.reindex(data.index)
+    data = data.copy()
+    for name in names:
+        data[name] = features[name].to_numpy()
+    return data
@@ -0,0 +1,223 @@
+"""
+Zero-copy lag features for graphs with lagged nodes (see causal_graphs.add_lags).
+
+The data of every variable is kept once as a contiguous array over a regular time index. A lagged
+column, e.g. gas_price[t-24], is a view into that array shifted by the lag (in time steps of the
+data, see resolution.py), and the lag matrix of a
+variable (e.g. river_temp[t-1..t-72]) is a strided view (numpy sliding_window_view). No shifted
+copies of the data are made per lag, only the rows of a chunk are copied when they are used (e.g. by
+causal_functions.get_grouped_linear_coefficients), so dozens of lags of the full series fit in memory
+for the grouped fit. Only the lagged variables are kept (not the other columns of the data) and a
+float32 variable stays float32.
+
+A causal model fitted with gcm (causal_functions.create_causal_model, create_eval_scm) needs a
+DataFrame, lagged_frame and LaggedFrame.to_frame copy every (lagged) column, so there the memory grows
+with the number of lags.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from scripts.causal_graphs import parse_lag
+from scripts.resolution import infer_freq, step
+
+
+def lag_matrix(values, lags, max_lag=None):
+    """
+    The lag matrix of a variable as a zero-copy view: element [i, j] is values[max_lag + i - lags[j]],
+    i.e. row i belongs to time step max_lag + i. The lags have to be equally spaced,
+    e.g. range(1, 73) or [24, 48, 72].
+
+    Parameters:
+    values (numpy.ndarray): The values of the variable over a regular time index.
+    lags (list): The lags in rows, ascending and equally spaced.
+    max_lag (int, optional): The first row of the matrix is time step max_lag. Defaults to max(lags).
+
+    Returns:
+    numpy.ndarray: A read-only view of shape (len(values) - max_lag, len(lags)).
+    """
+    lags = list(lags)
+    if max_lag is None:
+        max_lag = lags[-1]
+    steps = np.diff(lags)
+    if len(lags) > 1 and (steps[0] <= 0 or (steps != steps[0]).any()):
+        raise ValueError("the lags have to be ascending and equally spaced")
+    step = int(steps[0]) if len(lags) > 1 else 1
+    span = lags[-1] - lags[0] + 1
+    # window[r, k] = values[r + k], time step t = r + lags[-1] and lag = lags[-1] - k
+    windows = sliding_window_view(values, span)
+    start = max_lag - lags[-1]
+    return windows[start : start + len(values) - max_lag, ::-1][:, ::step]
+
+
+class LaggedFrame:
+    """
+    The columns of a graph with lagged nodes as views into one contiguous array per variable. The rows
+    are the time steps from the largest lag on, for which all lags are available.
+
+    Parameters:
+    data (pandas.DataFrame): The data with a time index and the (non-lagged) variables as columns.
+    columns (list): The columns, e.g. the nodes of a graph with lagged nodes like "gas_price[t-24]".
+    freq (str, optional): Frequency of the regular time index the lags refer to (a lag is one step).
+        Missing time steps are filled with NaN. Only used if there are lagged columns. Defaults to the
+        resolution of the data (see resolution.infer_freq). A freq coarser than the data raises a
+        ValueError, the rows between the time steps would be dropped.
+    """
+
+    def __init__(self, data, columns, freq=None):
+        self.columns = list(columns)
+        parsed = {column: parse_lag(column) for column in self.columns}
+        self.max_lag = max([lag for _, lag in parsed.values()], default=0)
+        if self.max_lag > 0:
+            resolution = infer_freq(data.index)
+            if freq is None:
+                freq = resolution
+            elif step(resolution) < step(freq):
+                raise ValueError(
+                    f"the data has a resolution of {resolution}, finer than freq={freq}, "
+                    "the rows between the time steps of freq would be dropped"
+                )
+            index = pd.date_range(
+                data.index[0], data.index[-1], freq=freq, name=data.index.name
+            )
+        else:
+            index = data.index
+        self.variables = list(dict.fromkeys(variable for variable, _ in parsed.values()))
+        # only the variables of the columns are copied, a float column keeps its dtype (e.g.
+        # float32), other columns become float64 for the NaN of the missing time steps
+        positions = index.get_indexer(data.index)
+        on_grid = positions >= 0
+        self.values = {}
+        for variable in self.variables:
+            column = data[variable].to_numpy()
+            if not np.issubdtype(column.dtype, np.floating):
+                column = column.astype(np.float64)
+            if index is data.index:
+                self.values[variable] = np.ascontiguousarray(column)
+            else:
+                values = np.full(len(index), np.nan, dtype=column.dtype)
+                values[positions[on_grid]] = column[on_grid]
+                self.values[variable] = values
+        self.index = index[self.max_lag :]
+        n = len(index)
+        self.lags = {column: lag for column, (_, lag) in parsed.items()}
+        self.views = {
+            column: self.values[variable][self.max_lag - lag : n - lag]
+            for column, (variable, lag) in parsed.items()
+        }
+
+    def __len__(self):
+        return len(self.index)
+
+    def variable(self, column):
+        """
+        The variable of a (lagged) column.
+
+        Parameters:
+        column (str): The column.
+
+        Returns:
+        str: The variable.
+        """
+        return parse_lag(column)[0]
+
+    def lag_matrix(self, variable, lags):
+        """
+        The lag matrix of a variable aligned with the rows, see lag_matrix.
+
+        Parameters:
+        variable (str): The variable.
+        lags (list): The lags, ascending and equally spaced, at most the largest lag of the columns.
+
+        Returns:
+        numpy.ndarray: A zero-copy view of shape (len(self), len(lags)).
+        """
+        return lag_matrix(self.values[variable], lags, self.max_lag)
+
+    def take(self, positions, columns=None):
+        """
+        Copy of some rows.
+
+        Parameters:
+        positions (numpy.ndarray): The positions of the rows.
+        columns (list, optional): The columns. Defaults to all columns.
+
+        Returns:
+        numpy.ndarray: The values of shape (len(positions), len(columns)) as float64.
+        """
+        columns = self.columns if columns is None else columns
+        out = np.empty((len(positions), len(columns)))
+        for j, column in enumerate(columns):
+            out[:, j] = self.views[column][positions]
+        return out
+
+    def valid(self, chunk_size=8192):
+        """
+        Rows without missing values in any column.
+
+        Parameters:
+        chunk_size (int, optional): Number of rows checked at once. Defaults to 8192.
+
+        Returns:
+        numpy.ndarray: The boolean mask of the rows.
+        """
+        valid = np.ones(len(self), dtype=bool)
+        for column in self.columns:
+            view = self.views[column]
+            for start in range(0, len(self), chunk_size):
+                valid[start : start + chunk_size] &= ~np.isnan(
+                    view[start : start + chunk_size]
+                )
+        return valid
+
+    def moments(self):
+        """
+        Mean and standard deviation of the variable of every column (the same for all lags).
+
+        Returns:
+        tuple: The means and standard deviations as arrays in the order of the columns.
+        """
+        stats = {
+            variable: (
+                np.nanmean(values, dtype=np.float64),
+                np.nanstd(values, ddof=1, dtype=np.float64),
+            )
+            for variable, values in self.values.items()
+        }
+        mean = np.array([stats[self.variable(column)][0] for column in self.columns])
+        std = np.array([stats[self.variable(column)][1] for column in self.columns])
+        return mean, std
+
+    def to_frame(self):
+        """
+        The columns as a DataFrame, e.g. to fit a causal model with gcm. This copies all columns.
+
+        Returns:
+        pandas.DataFrame: The data with one column per (lagged) column.
+        """
+        return pd.DataFrame(
+            {column: self.views[column] for column in self.columns}, index=self.index
+        )
+
+
+def lagged_frame(data, columns, freq=None):
+    """
+    The (lagged) columns of a graph as a DataFrame, e.g. to fit a causal model with gcm. Data that
+    already has all columns is returned as it is (the selected columns), otherwise the lagged columns
+    are built with LaggedFrame. This copies all columns, one per lag, so unlike the grouped fit
+    the memory grows with the number of lags.
+
+    Parameters:
+    data (pandas.DataFrame): The data with a time index and the (non-lagged) variables as columns.
+    columns (list): The columns, e.g. the nodes of a graph with lagged nodes like "gas_price[t-24]".
+    freq (str, optional): Frequency of the regular time index the lags refer to, see LaggedFrame.
+        Defaults to the resolution of the data.
+
+    Returns:
+    pandas.DataFrame: The data with one column per (lagged) column.
+    """
+    columns = list(columns)
+    if all(column in data.columns for column in columns):
+        return data.loc[:, columns]
+    return LaggedFrame(data, columns, freq=freq).to_frame()
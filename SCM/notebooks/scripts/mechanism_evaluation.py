@@ -0,0 +1,266 @@
+"""
+Budgeted, parallel evaluation of the causal mechanisms of fitted SCMs.
+
+gcm.evaluate_causal_model evaluates every node serially over all rows and returns one large object.
+Here the evaluation of every mechanism (of every window) is an independent task of a process pool,
+and every metric gets an explicit row budget:
+- "r2": rows of the k-fold cross validation of R2, MSE and NMSE (and KL divergence of root nodes),
+- "crps": rows of the test folds used for the CRPS (a subset of the "r2" rows),
+- "invertibility": rows of the independence test of the parents and the estimated noise.
+The rows are sampled stratified by year and hour, so that every year and every hour of the day
+keeps its share of the data.
+
+The result is a compact table with one row per window and node, see evaluate_mechanisms. It is
+saved by create_eval_scm (evaluation_budget) as evaluation/<graph>_<years>_mechanisms.csv and read
+by evaluate_causal_results.compare_r2_scores.
+"""
+
+import os
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from dowhy.graph import is_root_node, get_ordered_predecessors
+from dowhy.gcm.causal_mechanisms import PostNonlinearModel
+from dowhy.gcm.divergence import auto_estimate_kl_divergence
+from dowhy.gcm.model_evaluation import EvaluateCausalModelConfig, crps, nmse
+from dowhy.gcm.util.general import set_random_seed
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import KFold
+from statsmodels.stats.multitest import multipletests
+
+from scripts.ci_tests import evaluation_config
+from scripts.profiling import trace
+
+DEFAULT_BUDGET = {"r2": 20000, "crps": 1000, "invertibility": 2000}
+
+
+def stratified_sample(index, budget, random_seed=0):
+    """
+    Positions of a random sample of at most budget rows, stratified by year and hour. The budget is
+    allocated proportionally to the size of the strata (largest remainder), within a stratum the
+    rows are drawn without replacement.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The time index of the data.
+    budget (int): The number of rows. All rows are returned if the data is smaller.
+    random_seed (int, optional): The seed of the sample. Defaults to 0.
+
+    Returns:
+    numpy.ndarray: The sorted positions of the sampled rows.
+    """
+    n = len(index)
+    if budget is None or budget >= n:
+        return np.arange(n)
+    strata = np.unique(
+        np.asarray(index.year) * 24 + np.asarray(index.hour), return_inverse=True
+    )[1]
+    sizes = np.bincount(strata)
+    # proportional allocation, the remaining rows go to the largest remainders
+    exact = budget * sizes / n
+    quota = np.floor(exact).astype(int)
+    remainder = budget - quota.sum()
+    quota[np.argsort(quota - exact, kind="stable")[:remainder]] += 1
+    # random rank of every row within its stratum
+    rng = np.random.default_rng(random_seed)
+    order = np.lexsort((rng.random(n), strata))
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n) - starts[strata[order]]
+    return np.flatnonzero(rank < quota[strata])
+
+
+def _conditional_expectations(mechanism, parent_data, num_samples=50):
+    if isinstance(mechanism, PostNonlinearModel):
+        # e.g. the additive noise models of create_causal_model: f(x) + 0
+        return mechanism.evaluate(parent_data, np.zeros(parent_data.shape[0])).reshape(-1)
+    draws = [mechanism.draw_samples(parent_data).reshape(-1) for _ in range(num_samples)]
+    return np.mean(draws, axis=0)
+
+
+def _evaluate_mechanism(task):
+    # one node of one window, see mechanism_tasks
+    window, node, is_root, mechanism, node_data, parent_data, rows, kfolds, test, seed = task
+    set_random_seed(seed)
+    metrics = {"r2": [], "mse": [], "nmse": [], "crps": [], "kl_divergence": []}
+    with trace("evaluate_mechanism", rows=len(rows["r2"]), window=window, node=node):
+        Y = node_data[rows["r2"]]
+        X = None if is_root else parent_data[rows["r2"]]
+        # positions of the crps rows within the r2 rows
+        crps_mask = np.isin(rows["r2"], rows["crps"])
+        for train, test_rows in KFold(n_splits=kfolds, shuffle=True).split(Y):
+            fold_mechanism = mechanism.clone()
+            if is_root:
+                fold_mechanism.fit(Y[train])
+                metrics["kl_divergence"].append(
+                    auto_estimate_kl_divergence(
+                        fold_mechanism.draw_samples(len(test_rows)), Y[test_rows]
+                    )
+                )
+                continue
+            fold_mechanism.fit(X[train], Y[train])
+            prediction = _conditional_expectations(fold_mechanism, X[test_rows])
+            metrics["r2"].append(r2_score(Y[test_rows], prediction))
+            metrics["mse"].append(mean_squared_error(Y[test_rows], prediction))
+            metrics["nmse"].append(nmse(Y[test_rows], prediction))
+            crps_rows = test_rows[crps_mask[test_rows]]
+            if len(crps_rows) > 0:
+                metrics["crps"].append(
+                    crps(X[crps_rows], Y[crps_rows], fold_mechanism.draw_samples)
+                )
+
+        p_value = None
+        if not is_root and hasattr(mechanism, "estimate_noise"):
+            inv = rows["invertibility"]
+            noise = mechanism.estimate_noise(node_data[inv], parent_data[inv])
+            p_value = float(test(noise, parent_data[inv]))
+
+    result = {"window": window, "node": node, "is_root": is_root}
+    for metric, values in metrics.items():
+        result[metric] = float(np.mean(values)) if len(values) > 0 else None
+    result["invertibility_p_value"] = p_value
+    for metric in ["r2", "crps", "invertibility"]:
+        result[f"rows_{metric}"] = 0 if is_root and metric != "r2" else len(rows[metric])
+    return result
+
+
+def mechanism_tasks(
+    causal_model,
+    data,
+    window,
+    budget=None,
+    kfolds=5,
+    ci_test="kernel",
+    random_seed=0,
+):
+    """
+    The evaluation tasks of the mechanisms of a fitted causal model, one per node. A task only
+    contains the mechanism and the sampled rows of the node and its parents.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted causal model.
+    data (pandas.DataFrame): The (normalized) data with a time index.
+    window (str): The label of the data, e.g. the years.
+    budget (dict, optional): Rows per metric ("r2", "crps", "invertibility"), missing metrics
+        use DEFAULT_BUDGET. Defaults to DEFAULT_BUDGET.
+    kfolds (int, optional): Number of folds of the cross validation. Defaults to 5.
+    ci_test (str, optional): The independence test of the invertibility check, "kernel" or "rcot".
+        Defaults to "kernel".
+    random_seed (int, optional): Seed of the samples and of the folds. Defaults to 0.
+
+    Returns:
+    list: The tasks.
+    """
+    budget = {**DEFAULT_BUDGET, **(budget or {})}
+    test = (
+        evaluation_config(ci_test) or EvaluateCausalModelConfig()
+    ).independence_test_invertible
+    r2_rows = stratified_sample(data.index, budget["r2"], random_seed)
+    rows = {
+        "r2": r2_rows,
+        "crps": r2_rows[
+            stratified_sample(data.index[r2_rows], budget["crps"], random_seed)
+        ],
+        "invertibility": stratified_sample(
+            data.index, budget["invertibility"], random_seed + 1
+        ),
+    }
+    # only the sampled rows are sent to the workers, the positions are relative to them
+    used = np.union1d(rows["r2"], rows["invertibility"])
+    rows = {metric: np.searchsorted(used, r) for metric, r in rows.items()}
+    values = data.iloc[used]
+    tasks = []
+    graph = causal_model.graph
+    for i, node in enumerate(graph.nodes):
+        is_root = is_root_node(graph, node)
+        parents = get_ordered_predecessors(graph, node)
+        tasks.append(
+            (
+                window,
+                node,
+                is_root,
+                causal_model.causal_mechanism(node),
+                values[node].to_numpy(),
+                None if is_root else values[parents].to_numpy(),
+                rows,
+                kfolds,
+                test,
+                random_seed + i,
+            )
+        )
+    return tasks
+
+
+def evaluate_mechanisms(
+    models,
+    budget=None,
+    processes=None,
+    kfolds=5,
+    ci_test="kernel",
+    significance_level=0.05,
+    random_seed=0,
+):
+    """
+    Evaluate the mechanisms of one or many fitted causal models (e.g. one per window of a graph) in
+    one batch on a process pool. Every node of every model is a task.
+    The invertibility p-values are Bonferroni corrected within every window (as in
+    gcm.evaluate_causal_model).
+
+    Parameters:
+    models (dict): Maps the label of a window (e.g. "2018-2023") to the fitted causal model and its
+        (normalized) data with a time index.
+    budget (dict, optional): Rows per metric ("r2", "crps", "invertibility"). Defaults to DEFAULT_BUDGET.
+    processes (int, optional): Number of worker processes, 1 evaluates in this process. Defaults to the number of CPUs.
+    kfolds (int, optional): Number of folds of the cross validation. Defaults to 5.
+    ci_test (str, optional): The independence test of the invertibility check, "kernel" or "rcot".
+        Defaults to "kernel".
+    significance_level (float, optional): Significance level of the invertibility check. Defaults to 0.05.
+    random_seed (int, optional): Seed of the samples and of the folds. Defaults to 0.
+
+    Returns:
+    pandas.DataFrame: One row per window and node with the columns window, node, is_root, r2, mse,
+        nmse, crps, kl_divergence, invertibility_p_value, invertibility_rejected and the number of
+        rows of every metric (rows_r2, rows_crps, rows_invertibility).
+    """
+    tasks = []
+    for window, (causal_model, data) in models.items():
+        tasks += mechanism_tasks(
+            causal_model, data, window, budget, kfolds, ci_test, random_seed
+        )
+    processes = min(processes or os.cpu_count(), len(tasks))
+    if processes == 1:
+        results = [_evaluate_mechanism(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_evaluate_mechanism, tasks)
+
+    table = pd.DataFrame(results)
+    table["invertibility_rejected"] = None
+    for window, group in table.groupby("window", sort=False):
+        tested = group["invertibility_p_value"].notna()
+        if not tested.any():
+            continue
+        rejected, p_values, _, _ = multipletests(
+            group.loc[tested, "invertibility_p_value"].astype(float),
+            significance_level,
+            method="bonferroni",
+        )
+        table.loc[tested[tested].index, "invertibility_p_value"] = p_values
+        table.loc[tested[tested].index, "invertibility_rejected"] = rejected
+    columns = [
+        "window",
+        "node",
+        "is_root",
+        "r2",
+        "mse",
+        "nmse",
+        "crps",
+        "kl_divergence",
+        "invertibility_p_value",
+        "invertibility_rejected",
+        "rows_r2",
+        "rows_crps",
+        "rows_invertibility",
+    ]
+    return table.loc[:, columns]
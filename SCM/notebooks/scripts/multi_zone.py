@@ -0,0 +1,219 @@
+"""
+Run the SCM pipeline (data assembly, SCM fit and structural coefficients) for many bidding zones
+in parallel.
+
+The European panel with the day-ahead price (price_da_<zone>) and the day-ahead residual load
+(rl_<zone>) of all bidding zones is loaded once and placed in shared memory. The workers of the
+process pool attach to it instead of rereading it, only the zone specific data
+(data_selected_<zone>_<years>.csv, see 01-get_data_nuc.ipynb) is read per zone.
+
+The zone specific data (generation, nuclear availability, river data, ...) is not assembled here, it
+has to be created with 01-get_data_nuc.ipynb for every zone (COUNTRY_CODE = <zone>). Zones without it
+are reported as errors by run_zones.
+"""
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from scripts.causal_functions import create_eval_scm
+from scripts.causal_graphs import create_graph, get_neighbours, restrict_graph
+from scripts.features import CYCLICAL_FEATURES, calendar_features, ramp
+from scripts.profiling import trace
+from scripts.resolution import compact_dtypes, infer_freq
+from scripts.utils import Standardizer
+
+TARGETS = {"graph18": "price_da", "graph22": "agg_net_export"}
+
+# panel of the worker process, set by _init_worker
+_PANEL = None
+_PANEL_SHM = None
+
+
+class SharedPanel:
+    """
+    A numeric DataFrame in shared memory. The handle is small and can be sent to worker processes,
+    which get a DataFrame backed by the same memory with attach. The values are stored as float32 by
+    default, which halves the memory of the (quarter-hourly) panel.
+    """
+
+    def __init__(self, df, dtype=np.float32):
+        values = np.ascontiguousarray(df.to_numpy(dtype=dtype))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        shared = np.ndarray(values.shape, dtype=values.dtype, buffer=self.shm.buf)
+        shared[:] = values
+        self.handle = {
+            "name": self.shm.name,
+            "shape": values.shape,
+            "dtype": values.dtype.str,
+            "index": df.index,
+            "columns": list(df.columns),
+        }
+
+    @staticmethod
+    def attach(handle):
+        """
+        Attach to a shared panel.
+
+        Parameters:
+        handle (dict): The handle of the SharedPanel.
+
+        Returns:
+        tuple: The shared memory block (has to be kept alive) and the DataFrame using it without copy.
+        """
+        shm = shared_memory.SharedMemory(name=handle["name"])
+        values = np.ndarray(handle["shape"], dtype=handle["dtype"], buffer=shm.buf)
+        values.flags.writeable = False
+        df = pd.DataFrame(values, index=handle["index"], columns=handle["columns"], copy=False)
+        return shm, df
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _init_worker(handle):
+    global _PANEL, _PANEL_SHM
+    _PANEL_SHM, _PANEL = SharedPanel.attach(handle)
+
+
+def assemble_zone(zone, panel, data_path, neighbours=None, freq=None):
+    """
+    Assemble the data of one bidding zone: the zone specific data is joined with its price,
+    its residual load ramp and the residual load of its neighbours taken from the European panel.
+    Hour and day of year are converted to cyclical values and the ramp is computed with the
+    definitions of the feature store (scripts/features.py).
+    The data is stored in compact dtypes (see resolution.compact_dtypes).
+
+    Parameters:
+    zone (str): The bidding zone, e.g. "FR".
+    panel (pandas.DataFrame): The European panel with columns price_da_<zone> and rl_<zone>.
+    data_path (str): Path of the zone specific data, "{zone}" is replaced by the zone.
+    neighbours (list, optional): The neighbouring bidding zones. Defaults to get_neighbours(zone).
+    freq (str, optional): The resolution of the data, e.g. "h" or "15min". Defaults to the resolution
+        of the zone specific data (see resolution.infer_freq).
+
+    Returns:
+    pandas.DataFrame: The data of the zone.
+    """
+    if neighbours is None:
+        neighbours = get_neighbours(zone)
+    data = (
+        pd.read_csv(data_path.format(zone=zone), parse_dates=["timestamp"])
+        .set_index("timestamp")
+        .rename(columns={"nuclear_avail": "na", "ramperation_da": "gen_da_ramp"})
+    )
+    if freq is None:
+        freq = infer_freq(data.index)
+    rl_columns = [f"rl_{cc}" for cc in neighbours if f"rl_{cc}" in panel.columns]
+    zone_panel = panel[rl_columns].reindex(data.index)
+    zone_panel["price_da"] = panel[f"price_da_{zone}"].reindex(data.index)
+    zone_panel[f"rl_{zone}_ramp"] = ramp(panel[f"rl_{zone}"], freq).reindex(data.index)
+    data = data.drop(columns=zone_panel.columns, errors="ignore").join(zone_panel)
+
+    # convert hour, season to cyclical value for linear regression
+    calendar = calendar_features(data.index)
+    for name in CYCLICAL_FEATURES:
+        data[name] = calendar[name]
+    return compact_dtypes(data)
+
+
+def run_zone(zone, graph_name, data_path, neighbour_map=None, panel=None, freq=None):
+    """
+    Assemble the data, fit the SCM and save the structural coefficients of one bidding zone.
+    The coefficients are saved in ../models/<graph_name>_<zone>/coefficients/.
+
+    Parameters:
+    zone (str): The bidding zone.
+    graph_name (str): "graph18" (price_da as target) or "graph22" (agg_net_export as target).
+    data_path (str): Path of the zone specific data, "{zone}" is replaced by the zone.
+    neighbour_map (dict, optional): Maps a bidding zone to its neighbours. Defaults to entsoe.mappings.NEIGHBOURS.
+    panel (pandas.DataFrame, optional): The European panel. Defaults to the shared panel of the worker.
+    freq (str, optional): The resolution of the data. Defaults to the resolution of the data of the zone.
+
+    Returns:
+    tuple: The zone and the error message (None if successful).
+    """
+    if panel is None:
+        panel = _PANEL
+    try:
+        with trace("run_zone", zone=zone, graph=graph_name) as record:
+            neighbours = get_neighbours(zone, neighbour_map)
+            data = assemble_zone(zone, panel, data_path, neighbours, freq)
+            record["rows"] = len(data)
+            graph = create_graph(
+                f"{graph_name}_{zone}",
+                TARGETS[graph_name],
+                country_code=zone,
+                neighbours=neighbours,
+            )
+            # e.g. no nuclear or river data
+            graph = restrict_graph(graph, data.columns)
+            create_eval_scm(
+                graph_dict=graph,
+                df_data=data,
+                with_coefficients=True,
+                standardizer=Standardizer(data.loc[:, graph["nodes"]]),
+            )
+    except Exception as e:
+        return zone, repr(e)
+    return zone, None
+
+
+def run_zones(
+    zones,
+    panel,
+    data_path,
+    graph_name="graph18",
+    neighbour_map=None,
+    processes=None,
+    freq=None,
+):
+    """
+    Run the SCM pipeline for many bidding zones on a process pool. The panel is shared with the
+    workers through shared memory. Only zones with zone specific data (see module docstring) are
+    run, the other zones are returned with an error.
+
+    Parameters:
+    zones (list): The bidding zones, e.g. countries.EUROPEAN_BZN.
+    panel (pandas.DataFrame): The European panel with columns price_da_<zone> and rl_<zone>.
+    data_path (str): Path of the zone specific data, "{zone}" is replaced by the zone.
+    graph_name (str, optional): "graph18" or "graph22". Defaults to "graph18".
+    neighbour_map (dict, optional): Maps a bidding zone to its neighbours. Defaults to entsoe.mappings.NEIGHBOURS.
+    processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+    freq (str, optional): The resolution of the data. Defaults to the resolution of the data of the zone.
+
+    Returns:
+    dict: Maps every zone to its error message (None if successful).
+    """
+    if neighbour_map is None:
+        from entsoe.mappings import NEIGHBOURS as neighbour_map
+    missing = {
+        zone: repr(
+            FileNotFoundError(
+                f"no data {data_path.format(zone=zone)}, "
+                f"create it with 01-get_data_nuc.ipynb for COUNTRY_CODE = {zone}"
+            )
+        )
+        for zone in zones
+        if not os.path.exists(data_path.format(zone=zone))
+    }
+    found = [zone for zone in zones if zone not in missing]
+    if not found:
+        return missing
+    shared_panel = SharedPanel(panel)
+    try:
+        with multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=(shared_panel.handle,)
+        ) as pool:
+            results = pool.starmap(
+                run_zone,
+                [(zone, graph_name, data_path, neighbour_map, None, freq) for zone in found],
+            )
+    finally:
+        shared_panel.close()
+    results = dict(results)
+    return {zone: results[zone] if zone in results else missing[zone] for zone in zones}
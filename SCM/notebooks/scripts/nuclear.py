@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from scripts.profiling import traced
+from scripts.resolution import BASE_FREQ, time_index
+
+
+@traced(rows_arg="df_data_nuclear")
+def calc_nuclear_unavailability(
+    df_data_nuclear,
+    start,
+    end,
+    freq=BASE_FREQ,
+    min_unplanned_duration="1D",
+    min_duration="3h",
+):
+    """
+    Calculate the unavailable nuclear capacity at every time step from the ENTSO-E unavailability entries.
+    - only planned maintenance and
+    - unplanned outages longer than a day
+    - no cancelled maintanaces (have to be removed beforehand)
+    - started time steps count as full time steps
+    The minimum durations are given as time spans, so the rules are the same for every resolution
+    (with hourly data, "longer than a day" was "at least 24 rows"). The entries are added to the time
+    steps they cover in one vectorized pass (cumulative sum of the changes at their start and end).
+
+    Parameters:
+    df_data_nuclear (pandas.DataFrame): Unavailability entries of nuclear units with the columns
+        start, end (utc timestamps), nominal_power, avail_qty and businesstype.
+    start (pd.Timestamp): The first time step of the time span.
+    end (pd.Timestamp): The last time step of the time span.
+    freq (str, optional): The resolution of the time steps, e.g. "h" or "15min". Defaults to BASE_FREQ.
+    min_unplanned_duration (str, optional): Minimum duration of an unplanned outage to be included,
+        shorter outages should not affect the day-ahead price. Defaults to "1D".
+    min_duration (str, optional): Minimum duration of any entry to be included. Defaults to "3h".
+
+    Returns:
+    pandas.DataFrame: DataFrame with the column nuclear_unavail (MW) and an index with the given resolution.
+    """
+    index = time_index(start, end, freq, name=None)
+    # an entry covers the time steps from the started one to the one its end falls into (excluded)
+    entry_start = pd.DatetimeIndex(df_data_nuclear["start"]).floor(freq)
+    entry_end = pd.DatetimeIndex(df_data_nuclear["end"]).floor(freq)
+    duration = entry_end - entry_start
+    nominal_power = df_data_nuclear["nominal_power"].to_numpy(dtype=float)
+    unavailable = nominal_power - df_data_nuclear["avail_qty"].to_numpy(dtype=float)
+
+    unplanned = (df_data_nuclear["businesstype"] == "Unplanned outage").to_numpy()
+    included = duration >= pd.Timedelta(min_duration)
+    included &= ~(unplanned & (duration < pd.Timedelta(min_unplanned_duration)))
+
+    changes = np.zeros(len(index) + 1)
+    np.add.at(changes, index.searchsorted(entry_start[included]), unavailable[included])
+    np.subtract.at(
+        changes, index.searchsorted(entry_end[included]), unavailable[included]
+    )
+    return pd.DataFrame({"nuclear_unavail": np.cumsum(changes[:-1])}, index=index)
@@ -0,0 +1,329 @@
+"""
+Day-ahead price spreads and market coupling of all pairs of bidding zones (see 07-price_difference.ipynb).
+
+The spread of the pair (zone_1, zone_2) is price_1 - price_2. The statistics of all pairs and all
+periods (e.g. before and during the energy crisis, or rolling windows) are computed in one pass over
+the (time x zone) price panel: the panel is processed in chunks of rows, the spreads of all pairs of a
+chunk are broadcast differences of the prices of every zone and the prices of all later zones, and
+every period adds the rows of the chunk it contains. The chunks are sized such that the spreads of a
+chunk fit in max_bytes, so the memory does not depend on the length of the time span.
+
+Per pair and period the number of rows with a spread, the sum and the sum of squares (mean and
+standard deviation), the number of coupled rows (|spread| <= coupling_tol, the market coupling
+converged to one price, "sync" in the notebook) and a histogram are kept. The histograms are one
+compact (pair x period x bin) array of counts. Only the pairs with zone_1 before zone_2 in the order of
+the zones are stored, the statistics of the reversed pair follow from them (negated spreads).
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from scripts.profiling import traced
+
+
+def rolling_periods(start, end, window, step=None):
+    """
+    Windows of a time span as periods, e.g. every month ("MS") or 30 days every 7 days ("30D", "7D").
+
+    Parameters:
+    start (pd.Timestamp): The start of the first window.
+    end (pd.Timestamp): The last timestamp of the time span (included).
+    window (str): The length of a window, a pandas frequency.
+    step (str, optional): The time between the starts of two windows. Defaults to window.
+
+    Returns:
+    dict: Maps the start of every window to its (start, end) timestamps, both included.
+    """
+    window = to_offset(window)
+    starts = pd.date_range(start, end, freq=step or window)
+    one_ns = pd.Timedelta(1, unit="ns")
+    return {
+        window_start: (window_start, min(window_start + window - one_ns, end))
+        for window_start in starts
+    }
+
+
+class SpreadStatistics:
+    """
+    Spread statistics of all pairs of bidding zones and all periods, see module docstring.
+    The arrays are indexed by pair (see pairs) and period (see periods), counts also by bin.
+
+    Parameters:
+    zones (list): The bidding zones.
+    periods (list): The labels of the periods.
+    bin_edges (numpy.ndarray): The edges of the histogram bins.
+    counts (numpy.ndarray): Histogram counts (pair x period x bin).
+    rows (numpy.ndarray): Number of rows with a spread (pair x period).
+    total (numpy.ndarray): Sum of the spreads (pair x period).
+    squares (numpy.ndarray): Sum of the squared spreads (pair x period).
+    coupled (numpy.ndarray): Number of coupled rows (pair x period).
+    coupling_tol (float): The largest absolute spread of a coupled row.
+    """
+
+    def __init__(
+        self,
+        zones,
+        periods,
+        bin_edges,
+        counts,
+        rows,
+        total,
+        squares,
+        coupled,
+        coupling_tol,
+    ):
+        self.zones = list(zones)
+        self.periods = list(periods)
+        self.bin_edges = bin_edges
+        self.counts = counts
+        self.rows = rows
+        self.total = total
+        self.squares = squares
+        self.coupled = coupled
+        self.coupling_tol = coupling_tol
+        first, second = np.triu_indices(len(self.zones), k=1)
+        self.pairs = [(self.zones[i], self.zones[j]) for i, j in zip(first, second)]
+        self._pair_position = {pair: p for p, pair in enumerate(self.pairs)}
+
+    @property
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.total / self.rows
+
+    @property
+    def std(self):
+        # sample standard deviation (ddof=1) as pandas
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = (self.squares - self.total**2 / self.rows) / (self.rows - 1)
+        return np.sqrt(np.maximum(variance, 0))
+
+    @property
+    def coupling_rate(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.coupled / self.rows
+
+    def _position(self, zone_1, zone_2):
+        # position of the pair and the sign of its spreads relative to the stored pair
+        if (zone_1, zone_2) in self._pair_position:
+            return self._pair_position[(zone_1, zone_2)], 1
+        return self._pair_position[(zone_2, zone_1)], -1
+
+    def histogram(self, zone_1, zone_2, period):
+        """
+        The histogram of the spreads price_1 - price_2 in a period. The bins of a reversed pair are
+        the negated bins (closed on the other side).
+
+        Parameters:
+        zone_1 (str): The first bidding zone.
+        zone_2 (str): The second bidding zone.
+        period: The label of the period.
+
+        Returns:
+        tuple: The counts and the bin edges, as numpy.histogram.
+        """
+        p, sign = self._position(zone_1, zone_2)
+        counts = self.counts[p, self.periods.index(period)]
+        if sign > 0:
+            return counts, self.bin_edges
+        return counts[::-1], -self.bin_edges[::-1]
+
+    def pair(self, zone_1, zone_2):
+        """
+        The statistics of one pair of bidding zones in all periods.
+
+        Parameters:
+        zone_1 (str): The first bidding zone.
+        zone_2 (str): The second bidding zone.
+
+        Returns:
+        pandas.DataFrame: rows, mean, std, coupled and coupling_rate of the spreads price_1 - price_2
+            indexed by period.
+        """
+        p, sign = self._position(zone_1, zone_2)
+        return pd.DataFrame(
+            {
+                "rows": self.rows[p],
+                "mean": sign * self.mean[p],
+                "std": self.std[p],
+                "coupled": self.coupled[p],
+                "coupling_rate": self.coupling_rate[p],
+            },
+            index=pd.Index(self.periods, name="period"),
+        )
+
+    def table(self):
+        """
+        The statistics of all stored pairs and periods as a table.
+
+        Returns:
+        pandas.DataFrame: rows, mean, std, coupled and coupling_rate indexed by zone_1, zone_2 and period.
+        """
+        index = pd.MultiIndex.from_tuples(
+            [(z1, z2, period) for z1, z2 in self.pairs for period in self.periods],
+            names=["zone_1", "zone_2", "period"],
+        )
+        return pd.DataFrame(
+            {
+                "rows": self.rows.ravel(),
+                "mean": self.mean.ravel(),
+                "std": self.std.ravel(),
+                "coupled": self.coupled.ravel(),
+                "coupling_rate": self.coupling_rate.ravel(),
+            },
+            index=index,
+        )
+
+    def save(self, path):
+        """
+        Save the statistics as a compressed npz file.
+
+        Parameters:
+        path (str): The path of the file.
+        """
+        np.savez_compressed(
+            path,
+            zones=np.array(self.zones),
+            periods=np.array([str(period) for period in self.periods]),
+            bin_edges=self.bin_edges,
+            counts=self.counts,
+            rows=self.rows,
+            total=self.total,
+            squares=self.squares,
+            coupled=self.coupled,
+            coupling_tol=self.coupling_tol,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load statistics saved with save. The period labels are strings.
+
+        Parameters:
+        path (str): The path of the file.
+
+        Returns:
+        SpreadStatistics: The statistics.
+        """
+        with np.load(path, allow_pickle=False) as stored:
+            return cls(
+                zones=stored["zones"].tolist(),
+                periods=stored["periods"].tolist(),
+                bin_edges=stored["bin_edges"],
+                counts=stored["counts"],
+                rows=stored["rows"],
+                total=stored["total"],
+                squares=stored["squares"],
+                coupled=stored["coupled"],
+                coupling_tol=float(stored["coupling_tol"]),
+            )
+
+
+@traced(rows_arg="prices")
+def spread_statistics(
+    prices,
+    zones=None,
+    periods=None,
+    bins=np.arange(-250, 251, 1),
+    coupling_tol=0.0,
+    max_bytes=2**27,
+):
+    """
+    Spread statistics of all pairs of bidding zones for all periods in one chunked pass over the
+    price panel, see module docstring. The histograms have the bins of numpy.histogram (the last bin
+    includes its right edge), spreads outside the bins are not counted in the histograms.
+
+    Parameters:
+    prices (pandas.DataFrame): The day-ahead prices with a sorted time index and one column per zone.
+    zones (list, optional): The bidding zones (columns of prices). Defaults to all columns.
+    periods (dict, optional): Maps the label of a period to its (start, end) timestamps, both
+        included (as .loc), e.g. {"before": (TRUE_START, ENERGY_CRISIS), "during": (ENERGY_CRISIS, TRUE_END)}
+        or rolling_periods(...). Periods may overlap. Defaults to one period "all" with all rows.
+    bins (numpy.ndarray, optional): The edges of the histogram bins. Defaults to -250, ..., 250 (EUR).
+    coupling_tol (float, optional): The largest absolute spread of a coupled row. Defaults to 0.0.
+    max_bytes (int, optional): Memory of the spreads of one chunk and their temporaries. Defaults to 128 MiB.
+
+    Returns:
+    SpreadStatistics: The statistics of all pairs and periods.
+    """
+    zones = list(prices.columns) if zones is None else list(zones)
+    if periods is None:
+        periods = {"all": (prices.index[0], prices.index[-1])}
+    bins = np.asarray(bins, dtype=np.float64)
+    n_bins = len(bins) - 1
+    # zone x time, the spreads of a zone and all later zones are one broadcast difference of rows
+    values = np.ascontiguousarray(prices[zones].to_numpy(dtype=np.float64).T)
+    n_zones, n_rows = values.shape
+    n_pairs = n_zones * (n_zones - 1) // 2
+
+    # rows of every period, the index is sorted
+    bounds = np.array(
+        [
+            [
+                prices.index.searchsorted(start, "left"),
+                prices.index.searchsorted(end, "right"),
+            ]
+            for start, end in periods.values()
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    counts = np.zeros((n_pairs, len(periods), n_bins), dtype=np.int32)
+    rows = np.zeros((n_pairs, len(periods)), dtype=np.int64)
+    total = np.zeros((n_pairs, len(periods)))
+    squares = np.zeros((n_pairs, len(periods)))
+    coupled = np.zeros((n_pairs, len(periods)), dtype=np.int64)
+
+    # the spreads, their bins and a few temporaries of the same size per chunk
+    chunk_rows = max(1, max_bytes // (4 * 8 * max(n_pairs, 1)))
+    pair_offset = (np.arange(n_pairs) * n_bins)[:, None]
+    spreads = np.empty((n_pairs, min(chunk_rows, n_rows)))
+    for chunk_start in range(0, n_rows, chunk_rows):
+        chunk_end = min(chunk_start + chunk_rows, n_rows)
+        in_chunk = (bounds[:, 0] < chunk_end) & (bounds[:, 1] > chunk_start)
+        if not in_chunk.any():
+            continue
+        chunk = values[:, chunk_start:chunk_end]
+        chunk_spreads = spreads[:, : chunk_end - chunk_start]
+        p = 0
+        for i in range(n_zones - 1):
+            later = n_zones - 1 - i
+            np.subtract(chunk[i], chunk[i + 1 :], out=chunk_spreads[p : p + later])
+            p += later
+        valid = ~np.isnan(chunk_spreads)
+        bin_index = _bin_index(chunk_spreads, bins)
+        filled = np.where(valid, chunk_spreads, 0.0)
+        is_coupled = np.abs(chunk_spreads) <= coupling_tol
+
+        for k in np.flatnonzero(in_chunk):
+            start = max(bounds[k, 0], chunk_start) - chunk_start
+            end = min(bounds[k, 1], chunk_end) - chunk_start
+            rows[:, k] += valid[:, start:end].sum(axis=1)
+            total[:, k] += filled[:, start:end].sum(axis=1)
+            squares[:, k] += np.square(filled[:, start:end]).sum(axis=1)
+            coupled[:, k] += is_coupled[:, start:end].sum(axis=1)
+            period_bins = bin_index[:, start:end]
+            flat = (period_bins + pair_offset)[period_bins >= 0]
+            counts[:, k] += np.bincount(flat, minlength=n_pairs * n_bins).reshape(
+                n_pairs, n_bins
+            ).astype(np.int32)
+    return SpreadStatistics(
+        zones, periods.keys(), bins, counts, rows, total, squares, coupled, coupling_tol
+    )
+
+
+def _bin_index(values, bins):
+    # bin of every value as numpy.histogram (the last bin includes its right edge), -1 for values
+    # outside of the bins and NaN
+    n_bins = len(bins) - 1
+    inside = (values >= bins[0]) & (values <= bins[-1])
+    widths = np.diff(bins)
+    if np.allclose(widths, widths[0]):
+        # equal bins: scaled values, corrected by one bin where rounding crossed an edge (as numpy)
+        scaled = np.where(inside, values - bins[0], 0.0) * (n_bins / (bins[-1] - bins[0]))
+        index = np.minimum(scaled.astype(np.intp), n_bins - 1)
+        index[values < bins[index]] -= 1
+        index[(values >= bins[index + 1]) & (index != n_bins - 1)] += 1
+    else:
+        index = np.minimum(np.searchsorted(bins, values, side="right") - 1, n_bins - 1)
+    index[~inside] = -1
+    return index
@@ -0,0 +1,255 @@
+"""
+Lightweight stage-level tracing for the SCM and Shapley-flow pipelines.
+
+Tracing is switched off by default and then costs nothing. It is switched on with enable_tracing(path)
+or by setting the environment variable PIPELINE_TRACE to the path of the trace file before starting
+Python. Because the setting is stored in the environment, worker processes of a multiprocessing
+(or multiprocess) pool started afterwards write into the same file.
+
+Every traced stage appends one record with wall time, CPU time, memory, rows processed and the
+process/worker that ran it. The memory of a stage is recorded as
+- rss_start_mb, rss_end_mb: the resident set size of the process at the start and end of the stage,
+- process_max_rss_mb: the high-water mark of the RSS of the whole process up to the end of the stage
+  (ru_maxrss), i.e. it includes all earlier stages of the process,
+- max_rss_increase_mb: how much the stage raised that high-water mark. 0 means the stage stayed below
+  the peak of an earlier stage, not that it allocated nothing.
+Two formats are supported:
+- "jsonl": one JSON object per line, can be read with read_trace.
+- "chrome": Chrome trace event format, can be opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import os
+import json
+import time
+import socket
+import functools
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+TRACE_ENV = "PIPELINE_TRACE"
+TRACE_FORMAT_ENV = "PIPELINE_TRACE_FORMAT"
+
+
+def enable_tracing(path, trace_format="jsonl"):
+    """
+    Switch on tracing for this process and all worker processes started afterwards.
+
+    Parameters:
+    path (str): The path of the trace file. Records are appended.
+    trace_format (str, optional): "jsonl" or "chrome". Defaults to "jsonl".
+
+    Returns:
+    None
+    """
+    if trace_format not in ["jsonl", "chrome"]:
+        raise ValueError(f"unknown trace format {trace_format}")
+    os.environ[TRACE_ENV] = os.path.abspath(path)
+    os.environ[TRACE_FORMAT_ENV] = trace_format
+    if trace_format == "chrome" and not os.path.exists(path):
+        # the closing bracket is optional in the chrome trace format
+        with open(path, "w") as f:
+            f.write("[\n")
+
+
+def disable_tracing():
+    """
+    Switch off tracing for this process and all worker processes started afterwards.
+
+    Returns:
+    None
+    """
+    os.environ.pop(TRACE_ENV, None)
+    os.environ.pop(TRACE_FORMAT_ENV, None)
+
+
+def _max_rss_mb():
+    # high-water mark of the process, never reset
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _rss_mb():
+    # current RSS, only available on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def _write_record(path, trace_format, record):
+    if trace_format == "chrome":
+        event = {
+            "name": record["stage"],
+            "cat": "pipeline",
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["wall_time"] * 1e6,
+            "pid": record["pid"],
+            "tid": record["pid"],
+            "args": {
+                k: v for k, v in record.items() if k not in ["stage", "start", "pid"]
+            },
+        }
+        line = json.dumps(event, default=str) + ",\n"
+    else:
+        line = json.dumps(record, default=str) + "\n"
+    # a single small write with O_APPEND is not interleaved with writes of other processes
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def trace(stage, rows=None, **attributes):
+    """
+    Context manager that records one stage of the pipeline if tracing is switched on.
+    The yielded dictionary can be used to add information that is only known at the end
+    of the stage, e.g. record["rows"] = len(df).
+
+    Parameters:
+    stage (str): The name of the stage.
+    rows (int, optional): The number of rows processed in the stage. Defaults to None.
+    **attributes: Additional information saved with the record, e.g. the graph name.
+
+    Returns:
+    dict: The record of the stage (yielded).
+    """
+    path = os.environ.get(TRACE_ENV)
+    record = {"stage": stage, "rows": rows, **attributes}
+    if not path:
+        yield record
+        return
+
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    rss_start = _rss_mb()
+    max_rss_start = _max_rss_mb()
+    try:
+        yield record
+    finally:
+        max_rss = _max_rss_mb()
+        record.update(
+            {
+                "start": start,
+                "wall_time": time.perf_counter() - wall_start,
+                "cpu_time": time.process_time() - cpu_start,
+                "rss_start_mb": rss_start,
+                "rss_end_mb": _rss_mb(),
+                "process_max_rss_mb": max_rss,
+                "max_rss_increase_mb": (
+                    None if max_rss is None else max_rss - max_rss_start
+                ),
+                "pid": os.getpid(),
+                "worker": multiprocessing.current_process().name,
+                "host": socket.gethostname(),
+            }
+        )
+        _write_record(path, os.environ.get(TRACE_FORMAT_ENV, "jsonl"), record)
+
+
+def traced(stage=None, rows_arg=None):
+    """
+    Decorator that traces every call of a function, see trace.
+
+    Parameters:
+    stage (str, optional): The name of the stage. Defaults to the name of the function.
+    rows_arg (str, optional): Name of the argument whose length is recorded as rows processed.
+        If None and the function returns a DataFrame or array, its length is recorded.
+
+    Returns:
+    callable: The decorator.
+    """
+
+    def decorator(func):
+        name = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not os.environ.get(TRACE_ENV):
+                return func(*args, **kwargs)
+            rows = None
+            if rows_arg is not None:
+                value = kwargs.get(rows_arg)
+                if value is None:
+                    arg_names = func.__code__.co_varnames[: func.__code__.co_argcount]
+                    if rows_arg in arg_names and arg_names.index(rows_arg) < len(args):
+                        value = args[arg_names.index(rows_arg)]
+                rows = len(value) if hasattr(value, "__len__") else None
+            with trace(name, rows=rows) as record:
+                result = func(*args, **kwargs)
+                if rows is None and hasattr(result, "shape") and len(result.shape) > 0:
+                    record["rows"] = len(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def read_trace(path):
+    """
+    Read a trace file into a DataFrame.
+
+    Parameters:
+    path (str): The path of the trace file (jsonl or chrome format).
+
+    Returns:
+    pandas.DataFrame: One row per traced stage.
+    """
+    import pandas as pd
+
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line in ["", "[", "]"]:
+                continue
+            event = json.loads(line)
+            if "ph" in event:  # chrome format
+                event = {
+                    "stage": event["name"],
+                    "start": event["ts"] / 1e6,
+                    "pid": event["pid"],
+                    **event["args"],
+                }
+            records.append(event)
+    return pd.DataFrame.from_records(records)
+
+
+def summarize_trace(path):
+    """
+    Summarize a trace file per stage, sorted by total wall time.
+
+    Parameters:
+    path (str): The path of the trace file.
+
+    Returns:
+    pandas.DataFrame: Number of calls, total and mean wall time, total CPU time, rows, the
+        largest RSS at the end of a call, the largest increase of the high-water mark of the
+        process by a call and the high-water mark of the process per stage (see module docstring).
+    """
+    df = read_trace(path)
+    summary = df.groupby("stage").agg(
+        calls=("wall_time", "size"),
+        wall_time=("wall_time", "sum"),
+        mean_wall_time=("wall_time", "mean"),
+        cpu_time=("cpu_time", "sum"),
+        rows=("rows", "sum"),
+        rss_end_mb=("rss_end_mb", "max"),
+        max_rss_increase_mb=("max_rss_increase_mb", "max"),
+        process_max_rss_mb=("process_max_rss_mb", "max"),
+        workers=("worker", "nunique"),
+    )
+    return summary.sort_values("wall_time", ascending=False)
@@ -0,0 +1,181 @@
+"""
+Headless batch rendering of figures.
+
+A figure is described by a spec (dict):
+- "output" (str): Path of the figure, the format is taken from the extension (e.g. ".pdf").
+- "func" (callable): Module-level function drawing the figure with matplotlib. It either returns the
+  figure or draws into the current figure. Calls of plt.show() inside the function are ignored.
+- "args" (tuple, optional) and "kwargs" (dict, optional): Arguments of func.
+- "figsize" (tuple, optional): If given, a figure with one axes is created and passed to func as ax.
+- "rc" (dict, optional): matplotlib rcParams used while drawing.
+- "savefig_kwargs" (dict, optional): Keyword arguments of savefig, e.g. {"bbox_inches": "tight"}.
+or, for graphviz graphs:
+- "output" (str) and "dot" (str): The dot source of the graph, e.g. graph.string().
+
+The figures are rendered on a process pool with the Agg backend. The hash of every spec (including the
+arguments, i.e. the data of the figure, and the code of func and of the module it is defined in) is
+saved in a cache file, figures whose spec, data and drawing code did not change since the last
+rendering are skipped. Outputs are written to a temporary file first and then
+moved, so that an interrupted rendering never leaves a broken figure.
+"""
+
+import os
+import sys
+import json
+import pickle
+import hashlib
+import inspect
+import warnings
+import multiprocessing
+
+CACHE_FILE = ".render_cache.json"
+
+
+def _code_fingerprint(code):
+    # bytecode, names and constants of a code object, including nested functions
+    parts = [code.co_code, repr(code.co_names)]
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            parts.append(_code_fingerprint(const))
+        else:
+            parts.append(repr(const))
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def _func_fingerprint(func):
+    # name and code of the function and the source of its module, so that editing the function or a
+    # helper in the same module (style, labels, ...) renders the figure again
+    parts = [f"{func.__module__}.{func.__qualname__}"]
+    code = getattr(func, "__code__", None)
+    if code is not None:
+        parts.append(_code_fingerprint(code))
+    module = sys.modules.get(func.__module__)
+    try:
+        parts.append(inspect.getsource(module))
+    except (TypeError, OSError):
+        # e.g. functions defined in a notebook, only their own code is known
+        pass
+    return parts
+
+
+def _spec_hash(spec):
+    # functions are hashed by name and code, everything else (arguments, i.e. the data) by value
+    content = {k: v for k, v in spec.items() if k != "func"}
+    if "func" in spec:
+        content["func"] = _func_fingerprint(spec["func"])
+    try:
+        payload = pickle.dumps(sorted(content.items()), protocol=4)
+    except Exception:
+        import dill
+
+        payload = dill.dumps(sorted(content.items()), protocol=4)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg", force=True)
+
+
+def _atomic_path(output):
+    root, ext = os.path.splitext(output)
+    return f"{root}.tmp-{os.getpid()}{ext}"
+
+
+def _render_dot(spec):
+    import graphviz
+
+    output = spec["output"]
+    fmt = os.path.splitext(output)[1][1:]
+    data = graphviz.Source(spec["dot"]).pipe(format=fmt)
+    tmp = _atomic_path(output)
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, output)
+
+
+def _render_matplotlib(spec):
+    import matplotlib.pyplot as plt
+
+    output = spec["output"]
+    tmp = _atomic_path(output)
+    kwargs = dict(spec.get("kwargs", {}))
+    with plt.rc_context(spec.get("rc", {})), warnings.catch_warnings():
+        # plt.show() is a no-op with Agg
+        warnings.filterwarnings("ignore", message=".*non-interactive.*")
+        plt.close("all")
+        if spec.get("figsize") is not None:
+            fig, ax = plt.subplots(1, 1, figsize=spec["figsize"])
+            kwargs["ax"] = ax
+        fig = spec["func"](*spec.get("args", ()), **kwargs)
+        if not hasattr(fig, "savefig"):
+            fig = plt.gcf()
+        fig.savefig(tmp, **spec.get("savefig_kwargs", {}))
+        plt.close("all")
+    os.replace(tmp, output)
+
+
+def _render(spec):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(spec["output"])), exist_ok=True)
+        if "dot" in spec:
+            _render_dot(spec)
+        else:
+            _render_matplotlib(spec)
+    except Exception as e:
+        return spec["output"], repr(e)
+    return spec["output"], None
+
+
+def render_figures(specs, processes=None, cache_file=CACHE_FILE, force=False):
+    """
+    Render figures on a process pool, skipping figures whose spec and data are unchanged.
+
+    Parameters:
+    specs (list): The figure specs (see module docstring).
+    processes (int, optional): Number of worker processes. Defaults to the number of CPUs.
+    cache_file (str, optional): Path of the file with the hashes of the rendered figures.
+        Defaults to ".render_cache.json".
+    force (bool, optional): If True, all figures are rendered. Defaults to False.
+
+    Returns:
+    dict: Lists of the "rendered" and "skipped" outputs and the "failed" outputs with their error.
+    """
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    hashes = {spec["output"]: _spec_hash(spec) for spec in specs}
+    todo = [
+        spec
+        for spec in specs
+        if force
+        or cache.get(spec["output"]) != hashes[spec["output"]]
+        or not os.path.exists(spec["output"])
+    ]
+    todo_outputs = {spec["output"] for spec in todo}
+    result = {
+        "rendered": [],
+        "skipped": [spec["output"] for spec in specs if spec["output"] not in todo_outputs],
+        "failed": {},
+    }
+    if todo:
+        with multiprocessing.Pool(
+            min(processes or os.cpu_count(), len(todo)), initializer=_init_worker
+        ) as pool:
+            for output, error in pool.imap_unordered(_render, todo):
+                if error is None:
+                    result["rendered"].append(output)
+                    cache[output] = hashes[output]
+                else:
+                    result["failed"][output] = error
+                    cache.pop(output, None)
+
+    if cache_file is not None:
+        tmp = _atomic_path(cache_file)
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, cache_file)
+    return result
@@ -0,0 +1,187 @@
+"""
+Base time resolution of the pipeline.
+
+Since the European day-ahead market moved to a 15-minute market time unit (MTU), ENTSO-E returns
+quarter-hourly series for many bidding zones (hourly data before the switch, sometimes mixed in one
+query). All timestamps of the combined dataset lie on a regular grid with the base resolution
+(BASE_FREQ, "h" or "15min"), the inputs are aligned to it with align:
+
+- rows finer than the base resolution are aggregated per base period (e.g. the mean of the four
+  quarter hours of an hour),
+- a coarser row holds for its whole period (e.g. an hourly value for its four quarter hours).
+
+Durations that were given in rows of hourly data (e.g. "unplanned outages longer than 24 rows") are
+converted to rows of the base resolution with rows. The lags of lagged nodes (see lags.py) are time
+steps of the data and are not converted: gas_price[t-24] is 24 hours back in hourly data but 6 hours
+back in quarter-hourly data. A lag of a fixed duration is written with rows, e.g.
+f"gas_price[t-{rows('24h', freq)}]". Functions working on existing data (lags, ramps) take the
+resolution from its index (infer_freq) unless it is given. The calendar features
+use the fractional hour of the day (hour_of_day), so hour_sin/hour_cos distinguish the quarter hours.
+compact_dtypes reduces the memory of the 4x larger quarter-hourly data.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+BASE_FREQ = "h"
+
+
+def step(freq=BASE_FREQ):
+    """
+    The length of one time step of a resolution.
+
+    Parameters:
+    freq (str, optional): The resolution, e.g. "h" or "15min". Defaults to BASE_FREQ.
+
+    Returns:
+    pd.Timedelta: The length of a time step.
+    """
+    return pd.Timedelta(to_offset(freq).nanos, unit="ns")
+
+
+def infer_freq(index):
+    """
+    The resolution of a time index: the smallest step between two consecutive timestamps, so gaps
+    (e.g. rows dropped because of missing values) do not matter.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The sorted time index.
+
+    Returns:
+    str: The resolution, e.g. "h" or "15min". BASE_FREQ for fewer than two timestamps.
+    """
+    if len(index) < 2:
+        return BASE_FREQ
+    return to_offset(pd.Timedelta(np.diff(index.asi8).min(), unit="ns")).freqstr
+
+
+def rows(duration, freq=BASE_FREQ):
+    """
+    Number of time steps of a resolution in a duration, e.g. rows("1D", "15min") is 96.
+
+    Parameters:
+    duration (str or pd.Timedelta): The duration.
+    freq (str, optional): The resolution. Defaults to BASE_FREQ.
+
+    Returns:
+    int: The number of time steps.
+    """
+    return int(pd.Timedelta(duration) // step(freq))
+
+
+def time_index(start, end, freq=BASE_FREQ, name="timestamp"):
+    """
+    The regular time index of a time span, e.g. the scaffold the inputs of the dataset are joined on.
+
+    Parameters:
+    start (pd.Timestamp): The first timestamp.
+    end (pd.Timestamp): The last timestamp (included).
+    freq (str, optional): The resolution. Defaults to BASE_FREQ.
+    name (str, optional): The name of the index. Defaults to "timestamp".
+
+    Returns:
+    pandas.DatetimeIndex: The time index.
+    """
+    return pd.date_range(start, end, freq=freq, name=name)
+
+
+def hour_of_day(index):
+    """
+    The fractional hour of the day of a time index, e.g. 13.25 for 13:15.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The time index.
+
+    Returns:
+    numpy.ndarray: The hours of the day.
+    """
+    return np.asarray(index.hour) + np.asarray(index.minute) / 60.0
+
+
+def align(data, freq=BASE_FREQ, how="mean", start=None, end=None, max_period=None):
+    """
+    Align a time series of any native resolution (or of mixed resolutions, e.g. hourly ENTSO-E data
+    before and quarter-hourly data after the switch to the 15-minute MTU) to a regular grid in one
+    vectorized pass, see module docstring. Rows finer than the grid are aggregated per grid period
+    with how. Every grid period then takes the value of the last row at or before it, as long as it
+    lies within the period of that row (the time until the next row, at most max_period).
+    With max_period=None this is a forward fill (as resample(freq).ffill()), with max_period set to
+    the coarsest native resolution (e.g. "1h") gaps in the data stay missing (as resample(freq).mean()).
+
+    Parameters:
+    data (pandas.DataFrame or pandas.Series): The data with a sorted DatetimeIndex.
+    freq (str, optional): The resolution of the grid. Defaults to BASE_FREQ.
+    how (str, optional): Aggregation of the rows within a grid period, e.g. "mean" or "last". Defaults to "mean".
+    start (pd.Timestamp, optional): The first timestamp of the grid. Defaults to the first row.
+    end (pd.Timestamp, optional): The last timestamp of the grid (included). Defaults to the last row.
+    max_period (str or pd.Timedelta, optional): The longest time a row holds for. Defaults to None (no limit).
+
+    Returns:
+    pandas.DataFrame or pandas.Series: The data on the grid.
+    """
+    grouped = data.groupby(data.index.floor(freq)).agg(how)
+    if start is None:
+        start = grouped.index[0]
+    if end is None:
+        end = grouped.index[-1]
+    grid = time_index(start, end, freq, name=data.index.name)
+    if len(grouped) == 0:
+        return grouped.reindex(grid)
+
+    source = grouped.index.asi8
+    if max_period is None:
+        limit = np.iinfo(np.int64).max
+    else:
+        limit = pd.Timedelta(max_period).value
+    # period of every row: until the next row, at most max_period
+    period = np.full(len(source), limit)
+    period[:-1] = np.minimum(np.diff(source), limit)
+    position = np.searchsorted(source, grid.asi8, side="right") - 1
+    valid = position >= 0
+    valid[valid] = grid.asi8[valid] - source[position[valid]] < period[position[valid]]
+    position = np.where(valid, position, 0)
+
+    values = grouped.to_numpy()
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+    aligned = values[position]
+    aligned[~valid] = np.nan
+    if isinstance(grouped, pd.Series):
+        return pd.Series(aligned, index=grid, name=grouped.name)
+    return pd.DataFrame(aligned, index=grid, columns=grouped.columns)
+
+
+def compact_dtypes(data, float_dtype=np.float32, exclude=()):
+    """
+    Store the columns of the data in compact dtypes: floats as float_dtype (float32 keeps about 7
+    significant digits, more than the data of ENTSO-E has) and integers (e.g. hour, day_of_year) as the
+    smallest signed integer type. Booleans and other columns are kept.
+
+    Parameters:
+    data (pandas.DataFrame): The data.
+    float_dtype (numpy.dtype, optional): The dtype of the float columns. Defaults to np.float32.
+    exclude (sequence, optional): Columns to keep as they are. Defaults to ().
+
+    Returns:
+    pandas.DataFrame: The data with compact dtypes.
+    """
+    dtypes = {}
+    for column, dtype in data.dtypes.items():
+        if column in exclude:
+            continue
+        if pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = float_dtype
+        elif pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_bool_dtype(
+            dtype
+        ):
+            values = data[column]
+            # signed, differences like day_of_year - 1 must not wrap around
+            for int_dtype in (np.int8, np.int16, np.int32, np.int64):
+                info = np.iinfo(int_dtype)
+                if len(values) == 0 or (
+                    values.min() >= info.min and values.max() <= info.max
+                ):
+                    dtypes[column] = int_dtype
+                    break
+    return data.astype(dtypes)
@@ -0,0 +1,167 @@
+"""
+Streaming update of a fitted linear SCM (see causal_functions.create_causal_model) with new rows,
+e.g. every new hour of ENTSO-E data, without refitting on the whole history.
+
+The regression of every non-root node on its parents is updated with recursive least squares (RLS).
+An update costs O(parents^2) per node and row. With a forgetting factor < 1 older rows are
+down-weighted exponentially (weight forgetting_factor^age), so the coefficients follow changes of
+the market. With a forgetting factor of 1 and the fit data given, the coefficients are those of a
+refit on the fit data and all rows streamed so far.
+
+The noise distributions of the mechanisms and the distributions of the root nodes are not updated.
+
+Graphs with lagged nodes (see causal_graphs.add_lags) are supported: the lagged columns of the new
+rows are built with lags.lagged_frame from the last rows seen before (the fit data or the previous
+updates), so the first rows of a stream without fit data are skipped until all lags are available.
+"""
+
+import numpy as np
+import pandas as pd
+
+from dowhy.graph import is_root_node, get_ordered_predecessors
+
+from scripts.causal_functions import get_linear_coefficients
+from scripts.causal_graphs import parse_lag
+from scripts.lags import lagged_frame
+
+
+class StreamingSCM:
+    """
+    Recursive least squares updater of a fitted linear SCM. The regressions of the causal model are
+    updated in place, so it can be used (e.g. for interventions) with the current coefficients.
+
+    Parameters:
+    causal_model (gcm.StructuralCausalModel): The fitted linear causal model.
+    graph_dict (dict): The causal graph dictionary the model was fitted for (see causal_graphs).
+    standardizer (scripts.utils.Standardizer): The means and standard deviations used to normalize the data
+        of the fit. New rows are normalized with them.
+    data (pandas.DataFrame, optional): The original data the model was fitted on. If given, the RLS state
+        continues the least squares fit exactly, otherwise the fitted coefficients are used as a weak prior.
+    forgetting_factor (float, optional): Weight of the previous rows per new row, in (0, 1]. Defaults to 1.
+    initial_covariance (float, optional): Diagonal of the initial inverse Gram matrix if no data is given.
+        Larger values let the first rows move the coefficients more. Defaults to 100.
+    freq (str, optional): Frequency of the time steps of lagged nodes, see lags.LaggedFrame. Defaults to
+        the resolution of the data.
+    """
+
+    def __init__(
+        self,
+        causal_model,
+        graph_dict,
+        standardizer,
+        data=None,
+        forgetting_factor=1.0,
+        initial_covariance=100.0,
+        freq=None,
+    ):
+        if not 0 < forgetting_factor <= 1:
+            raise ValueError("forgetting_factor has to be in (0, 1]")
+        self.causal_model = causal_model
+        self.name = graph_dict["name"]
+        self.standardizer = standardizer
+        self.forgetting_factor = forgetting_factor
+        self.n_updates = 0
+        self.nodes = list(graph_dict["nodes"])
+        self.freq = freq
+        # the variables are normalized before the lagged columns are built, as in create_eval_scm
+        self.variables = list(dict.fromkeys(parse_lag(node)[0] for node in self.nodes))
+        self.max_lag = max(parse_lag(node)[1] for node in self.nodes)
+        # the last max_lag rows of the variables (normalized), the lags of the next new rows
+        self.history = None
+
+        graph = causal_model.graph
+        if data is not None:
+            data = standardizer.transform(data.loc[:, self.variables], dtype=np.float64)
+            if self.max_lag > 0:
+                self.history = data.iloc[-self.max_lag :]
+            data = lagged_frame(data, self.nodes, freq).dropna()
+        # per non-root node: parents, coefficients [intercept, coef_...] and inverse Gram matrix P
+        self.parents, self.theta, self.P = {}, {}, {}
+        for node in self.nodes:
+            if is_root_node(graph, node):
+                continue
+            parents = get_ordered_predecessors(graph, node)
+            model = causal_model.causal_mechanism(node).prediction_model.sklearn_model
+            self.parents[node] = parents
+            self.theta[node] = np.concatenate(
+                [
+                    np.ravel(model.intercept_).astype(np.float64),
+                    np.ravel(model.coef_).astype(np.float64),
+                ]
+            )
+            if data is None:
+                self.P[node] = initial_covariance * np.eye(len(parents) + 1)
+            else:
+                X = np.column_stack([np.ones(len(data)), data[parents].to_numpy()])
+                self.P[node] = np.linalg.pinv(X.T @ X)
+
+    def update(self, rows):
+        """
+        Update the regressions with new rows, one row after the other. Rows with missing values of a
+        node or its parents are skipped for that node.
+
+        Parameters:
+        rows (pandas.DataFrame): The new rows (original data) with the variables of the graph as columns,
+            following the rows of the fit data or the previous update.
+
+        Returns:
+        StreamingSCM: self.
+        """
+        rows = self.standardizer.transform(
+            rows.loc[:, list(self.standardizer.mean.index.intersection(rows.columns))],
+            dtype=np.float64,
+        )
+        n_rows = len(rows)
+        if self.max_lag > 0:
+            rows = self._lagged(rows)
+        lam = self.forgetting_factor
+        for node, parents in self.parents.items():
+            y = rows[node].to_numpy()
+            X = np.column_stack([np.ones(len(rows)), rows[parents].to_numpy()])
+            theta, P = self.theta[node], self.P[node]
+            for x, y_t in zip(X, y):
+                if np.isnan(y_t) or np.isnan(x).any():
+                    continue
+                Px = P @ x
+                gain = Px / (lam + x @ Px)
+                theta = theta + gain * (y_t - x @ theta)
+                P = (P - np.outer(gain, Px)) / lam
+            # keep P symmetric against rounding errors
+            self.theta[node], self.P[node] = theta, (P + P.T) / 2
+            model = self.causal_model.causal_mechanism(node).prediction_model.sklearn_model
+            model.intercept_ = np.float64(theta[0])
+            model.coef_ = theta[1:].copy()
+        self.n_updates += n_rows
+        return self
+
+    def _lagged(self, rows):
+        """
+        The (lagged) columns of the nodes for new normalized rows. The lags before the first new row are
+        taken from the history, which is moved on to the last rows.
+
+        Parameters:
+        rows (pandas.DataFrame): The new normalized rows of the variables.
+
+        Returns:
+        pandas.DataFrame: The new rows with all lags available, one column per node.
+        """
+        rows = rows.reindex(columns=self.variables)
+        previous = self.history
+        if previous is not None:
+            rows = pd.concat([previous, rows])
+        self.history = rows.iloc[-self.max_lag :]
+        if len(rows) <= self.max_lag:
+            return pd.DataFrame(columns=self.nodes, dtype=np.float64)
+        lagged = lagged_frame(rows, self.nodes, self.freq)
+        if previous is not None:
+            lagged = lagged.loc[lagged.index > previous.index[-1]]
+        return lagged
+
+    def coefficients(self):
+        """
+        The current structural coefficients in the original scale, see get_linear_coefficients.
+
+        Returns:
+        dict: Maps every non-root node to its coefficients per parent and its intercept.
+        """
+        return get_linear_coefficients(self.causal_model, standardizer=self.standardizer)
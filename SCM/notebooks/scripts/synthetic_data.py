@@ -0,0 +1,213 @@
+"""
+This module generates synthetic hourly (or quarter-hourly) data from the causal graphs in causal_graphs.py.
+The data is sampled from a linear Gaussian structural causal model. The calendar confounders
+(hour and day of year as sin/cos, isworkingday) are the seasonal root nodes and are computed from
+the timestamps, all other nodes are linear functions of their parents plus Gaussian noise.
+Each node is scaled to a realistic mean and standard deviation, such that the data can replace
+data_selected_FR_2018-2023.csv for offline runs and benchmarks.
+"""
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+from scripts.features import calendar_features as derived_calendar_features
+from scripts.resolution import BASE_FREQ, step
+
+# (mean, std) of the nodes, roughly matching the French data 2018-2023
+NODE_SCALES = {
+    "price_da": (95.0, 90.0),
+    "price_da_DE_LU": (100.0, 95.0),
+    "price_da_IT_NORD": (120.0, 100.0),
+    "agg_net_export": (6000.0, 5000.0),
+    "total_export": (10000.0, 4000.0),
+    "FR->IT_NORD": (2500.0, 1000.0),
+    "carbon_price": (60.0, 25.0),
+    "gas_price": (45.0, 40.0),
+    "na": (45000.0, 8000.0),
+    "run_off_gen": (5500.0, 1500.0),
+    "solar_da": (1700.0, 2500.0),
+    "load_da": (52000.0, 11000.0),
+    "wind_da": (4300.0, 3000.0),
+    "rl_FR_ramp": (0.0, 1500.0),
+    "rl_BE": (8000.0, 1800.0),
+    "rl_DE_LU": (42000.0, 12000.0),
+    "rl_ES": (22000.0, 5000.0),
+    "rl_IT_NORD": (20000.0, 4500.0),
+    "river_flow_mean": (180000.0, 90000.0),
+    "temp_mean": (12.5, 7.0),
+    "river_temp": (14.0, 6.0),
+}
+
+CALENDAR_NODES = [
+    "hour_sin",
+    "hour_cos",
+    "day_of_year_sin",
+    "day_of_year_cos",
+    "isworkingday",
+]
+
+
+def calendar_features(index):
+    """
+    Compute the calendar root nodes for a time index of any resolution.
+    The features are the ones of the feature store (scripts/features.py), without public holidays.
+
+    Parameters:
+    index (pandas.DatetimeIndex): The timestamps.
+
+    Returns:
+    pandas.DataFrame: DataFrame with the columns hour, day_of_year and the calendar nodes.
+    """
+    df = pd.DataFrame(index=index)
+    df["hour"] = index.hour
+    df["day_of_year"] = index.dayofyear
+    return df.join(derived_calendar_features(index)[CALENDAR_NODES])
+
+
+def sample_linear_gaussian(graph, index, seed=0, noise_std=0.5):
+    """
+    Sample standardized data from a linear Gaussian SCM with the structure of the given graph.
+    Calendar nodes are computed from the index, other root nodes are drawn once per year
+    (like the yearly carbon price) plus Gaussian noise at every time step. Every non-root node is a
+    linear combination of its parents with random coefficients plus Gaussian noise.
+
+    Parameters:
+    graph (networkx.DiGraph): A directed acyclic graph representing the causal structure.
+    index (pandas.DatetimeIndex): The timestamps.
+    seed (int, optional): Seed of the random number generator. Defaults to 0.
+    noise_std (float, optional): Standard deviation of the additive noise relative to the
+        standard deviation of the parents' contribution. Defaults to 0.5.
+
+    Returns:
+    tuple:
+        A tuple containing:
+        - data (pandas.DataFrame): The standardized samples of all nodes (mean 0, std 1).
+        - coefficients (dict): The coefficients of the standardized SCM as {child: {parent: coef}}.
+    """
+    rng = np.random.default_rng(seed)
+    calendar = calendar_features(index)
+    n = len(index)
+    data = {}
+    coefficients = {}
+    for node in nx.topological_sort(graph):
+        parents = sorted(graph.predecessors(node))
+        if node in CALENDAR_NODES:
+            values = calendar[node].to_numpy(dtype=float)
+        elif len(parents) == 0:
+            years, year_idx = np.unique(index.year, return_inverse=True)
+            values = rng.normal(size=len(years))[year_idx] + 0.2 * rng.normal(size=n)
+        else:
+            coef = rng.uniform(-1.0, 1.0, size=len(parents))
+            values = np.column_stack([data[p] for p in parents]) @ coef
+            values = values + noise_std * values.std() * rng.normal(size=n)
+            coefficients[node] = dict(zip(parents, coef))
+        data[node] = values
+        if node not in CALENDAR_NODES:
+            # standardize, the scale of the parents' contribution is kept in the coefficients
+            mean, std = values.mean(), values.std()
+            data[node] = (values - mean) / std
+            if node in coefficients:
+                coefficients[node] = {p: c / std for p, c in coefficients[node].items()}
+    return pd.DataFrame(data, index=index), coefficients
+
+
+def synthetic_data(
+    graph_dict, years=1, countries=("FR",), start="20180101T00", seed=0, freq=BASE_FREQ
+):
+    """
+    Generate realistic hourly (or quarter-hourly) synthetic data for one or more causal graphs.
+    The graphs are combined, so e.g. [GRAPH18, GRAPH22] yields one dataset containing both targets.
+    Scales from one year of one country up to many country-years.
+
+    Parameters:
+    graph_dict (dict or list): A causal graph dictionary from causal_graphs.py or a list of them.
+    years (int, optional): Number of years per country. Defaults to 1.
+    countries (sequence, optional): Labels of the countries to generate. Every country is an
+        independent draw with its own coefficients. Defaults to ("FR",).
+    start (str or pd.Timestamp, optional): The first timestamp (UTC). Defaults to "20180101T00".
+    seed (int, optional): Seed of the random number generator. Defaults to 0.
+    freq (str, optional): The resolution of the data, e.g. "h" or "15min". Defaults to BASE_FREQ.
+
+    Returns:
+    pandas.DataFrame: The synthetic data in original units, including the columns hour and day_of_year.
+        For a single country the index is the timestamp, otherwise a MultiIndex (country, timestamp).
+    """
+    graph_dicts = graph_dict if isinstance(graph_dict, list) else [graph_dict]
+    graph = nx.compose_all([g["graph"] for g in graph_dicts])
+    start = pd.Timestamp(start, tz="utc")
+    end = start + pd.DateOffset(years=years) - step(freq)
+    index = pd.date_range(start, end, freq=freq, name="timestamp")
+
+    frames = []
+    for i, _ in enumerate(countries):
+        data, _ = sample_linear_gaussian(graph, index, seed=seed + i)
+        for node in data.columns:
+            if node in CALENDAR_NODES:
+                continue
+            mean, std = NODE_SCALES.get(node, (0.0, 1.0))
+            data[node] = data[node] * std + mean
+        calendar = calendar_features(index)
+        data["hour"] = calendar["hour"]
+        data["day_of_year"] = calendar["day_of_year"]
+        frames.append(data)
+
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, keys=list(countries), names=["country", "timestamp"])
+
+
+def to_data_selected(data):
+    """
+    Convert synthetic data of one country to the layout of data_selected_FR_2018-2023.csv,
+    i.e. the file written by 01-get_data_nuc.ipynb and read by the SCM and GBT notebooks.
+
+    Parameters:
+    data (pandas.DataFrame): Synthetic data of one country from synthetic_data.
+
+    Returns:
+    pandas.DataFrame: The data with nuclear_avail instead of na, boolean isworkingday and
+        without the derived sin/cos columns.
+    """
+    df = data.rename(columns={"na": "nuclear_avail"}).drop(
+        columns=[c for c in CALENDAR_NODES if c != "isworkingday"]
+    )
+    df["isworkingday"] = df["isworkingday"].astype(bool)
+    return df
+
+
+def synthetic_unavailability(start, end, n_units=60, seed=0):
+    """
+    Generate a synthetic table of nuclear unavailabilities in the format returned by
+    EntsoePandasClient.query_unavailability_of_generation_units (only the used columns).
+
+    Parameters:
+    start (pd.Timestamp): The first timestamp of the time span.
+    end (pd.Timestamp): The last timestamp of the time span.
+    n_units (int, optional): Number of unavailability entries per year. Defaults to 60.
+    seed (int, optional): Seed of the random number generator. Defaults to 0.
+
+    Returns:
+    pandas.DataFrame: The unavailability entries.
+    """
+    rng = np.random.default_rng(seed)
+    n_years = max(1, int(np.ceil((end - start) / pd.Timedelta(days=365))))
+    n = n_units * n_years
+    span_hours = int((end - start) / pd.Timedelta(hours=1))
+    offsets = rng.integers(0, span_hours, size=n)
+    durations = rng.lognormal(mean=4.0, sigma=1.5, size=n).astype(int) + 1
+    nominal_power = rng.choice([900.0, 1300.0, 1500.0], size=n)
+    starts = start + pd.to_timedelta(offsets, unit="h")
+    return pd.DataFrame(
+        {
+            "plant_type": "Nuclear",
+            "docstatus": rng.choice(["Active", "Cancelled"], size=n, p=[0.9, 0.1]),
+            "businesstype": rng.choice(
+                ["Planned maintenance", "Unplanned outage"], size=n
+            ),
+            "start": starts,
+            "end": starts + pd.to_timedelta(durations, unit="h"),
+            "nominal_power": nominal_power,
+            "avail_qty": nominal_power * rng.uniform(0.0, 0.8, size=n).round(1),
+        }
+    )
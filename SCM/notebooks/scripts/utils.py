@@ -1,11 +1,13 @@
 # miscellaneous functions used by many notebooks
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
 import pickle as pkl
 
 from scripts.countries import country_codes, COUNTRY_CODE_TO_COUNTRY
+from scripts.profiling import traced
 
 
 def normalize(data, mean, std):
@@ -23,6 +25,53 @@ def normalize(data, mean, std):
     return (data - mean) / std
 
 
+class Standardizer:
+    """
+    Means and standard deviations of all columns, computed once in one vectorized pass over the data.
+    Used to normalize the data for the SCM and to denormalize the structural coefficients
+    (see get_linear_coefficients) without keeping a second normalized copy of the whole DataFrame.
+    NaN values are ignored as in pandas.DataFrame.mean/std.
+
+    Parameters:
+    data (pandas.DataFrame): The original data.
+    """
+
+    def __init__(self, data):
+        values = data.to_numpy(dtype=np.float64)
+        self.mean = pd.Series(np.nanmean(values, axis=0), index=data.columns)
+        self.std = pd.Series(np.nanstd(values, axis=0, ddof=1), index=data.columns)
+
+    def transform(self, data, dtype=np.float32):
+        """
+        Normalize data by subtracting the mean and dividing by the standard deviation of each column.
+        Only one array of the given dtype is allocated.
+
+        Parameters:
+        data (pandas.DataFrame): The data to normalize, its columns have to be a subset of the original columns.
+        dtype (numpy.dtype, optional): The dtype of the normalized data. Defaults to np.float32.
+
+        Returns:
+        pandas.DataFrame: The normalized data.
+        """
+        values = data.to_numpy(dtype=dtype, copy=True)
+        values -= self.mean[data.columns].to_numpy(dtype=dtype)
+        values /= self.std[data.columns].to_numpy(dtype=dtype)
+        return pd.DataFrame(values, index=data.index, columns=data.columns, copy=False)
+
+    def inverse_transform(self, data):
+        """
+        Denormalize data by multiplying with the standard deviation and adding the mean of each column.
+
+        Parameters:
+        data (pandas.DataFrame): The normalized data.
+
+        Returns:
+        pandas.DataFrame: The data in the original scale.
+        """
+        return data * self.std[data.columns] + self.mean[data.columns]
+
+
+@traced()
 def read_file(path, column_names):
     """
     Read a CSV file, rename columns, convert to timestamp, and set as index.
@@ -138,6 +187,7 @@ def split_column(df):
     return df
 
 
+@traced()
 def read_eurostat_tsv(path):
     """
     Read a Eurostat TSV file, split the first column, filter by country codes, and rename columns.
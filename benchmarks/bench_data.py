@@ -0,0 +1,211 @@
+# benchmarks of the data loaders, the nuclear availability calculation, the alignment to the base resolution,
+# the price spreads of all pairs of bidding zones and the feature store on synthetic data
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .common import GRAPH18, GRAPH22, SEED
+
+from scripts.features import (
+    CALENDAR_FEATURES,
+    calendar_features,
+    load_features,
+    materialize_features,
+)
+from scripts.nuclear import calc_nuclear_unavailability
+from scripts.price_spreads import rolling_periods, spread_statistics
+from scripts.resolution import align, compact_dtypes
+from scripts.synthetic_data import (
+    synthetic_data,
+    synthetic_unavailability,
+    to_data_selected,
+)
+from scripts.utils import read_file
+from shap_flow_util import read_csv_incl_timeindex
+import gbt_data
+
+
+class NuclearAvailability:
+    params = [[1, 6], ["h", "15min"]]
+    param_names = ["years", "freq"]
+    timeout = 1800
+
+    def setup(self, years, freq):
+        self.start = pd.Timestamp("20180101T00", tz="utc")
+        self.end = self.start + pd.DateOffset(years=years) - pd.Timedelta(hours=1)
+        unavail = synthetic_unavailability(self.start, self.end, seed=SEED)
+        self.df_data_nuclear = unavail[unavail["docstatus"] != "Cancelled"]
+
+    def time_calc_nuclear_unavailability(self, years, freq):
+        calc_nuclear_unavailability(self.df_data_nuclear, self.start, self.end, freq=freq)
+
+
+class Resolution:
+    # quarter-hourly data of the 15-minute MTU aligned to an hourly and a quarter-hourly base resolution
+    # (scripts/resolution.py) and its memory in compact dtypes
+    params = [1, 6]
+    param_names = ["years"]
+    timeout = 1800
+
+    def setup(self, years):
+        self.data = to_data_selected(
+            synthetic_data(GRAPH18, years=years, seed=SEED, freq="15min")
+        ).drop(columns=["isworkingday"])
+
+    def time_resample_hourly(self, years):
+        # before: resample("1h").mean() of every input
+        self.data.resample("1h").mean()
+
+    def time_align_hourly(self, years):
+        align(self.data, "h", max_period="1h")
+
+    def time_align_quarter_hourly(self, years):
+        align(self.data, "15min", max_period="1h")
+
+    def track_memory_mb(self, years):
+        return self.data.memory_usage().sum() / 1e6
+
+    def track_memory_compact_mb(self, years):
+        return compact_dtypes(self.data).memory_usage().sum() / 1e6
+
+
+class PriceSpreads:
+    # histograms, means and coupled hours of the spreads of all pairs of bidding zones before and during
+    # the energy crisis or per month: one np.histogram per pair and period (07-price_difference.ipynb,
+    # before) vs. one chunked pass over the price panel (scripts/price_spreads.py)
+    params = [[5, 20], [1, 6], ["crisis", "monthly"]]
+    param_names = ["zones", "years", "periods"]
+    timeout = 1800
+
+    def setup(self, zones, years, periods):
+        rng = np.random.default_rng(SEED)
+        price_da = synthetic_data(GRAPH18, years=years, seed=SEED)["price_da"]
+        noise = rng.normal(0.0, 20.0, size=(len(price_da), zones)).round(2)
+        # hours with a coupled market have the same price in all zones
+        noise[rng.random(len(price_da)) < 0.4] = 0.0
+        self.price = pd.DataFrame(
+            price_da.to_numpy()[:, None] + noise,
+            index=price_da.index,
+            columns=["Z{}".format(i) for i in range(zones)],
+        )
+        first, last = self.price.index[0], self.price.index[-1]
+        if periods == "crisis":
+            crisis = self.price.index[len(self.price) // 2]
+            self.periods = {"before": (first, crisis), "during": (crisis, last)}
+        else:
+            self.periods = rolling_periods(first, last, "MS")
+        self.bins = np.arange(-250, 251, 1)
+
+    def time_per_pair(self, zones, years, periods):
+        columns = self.price.columns
+        for i, zone_1 in enumerate(columns):
+            for zone_2 in columns[i + 1 :]:
+                price_diff = self.price[zone_1] - self.price[zone_2]
+                for start, end in self.periods.values():
+                    selected = price_diff.loc[start:end]
+                    np.histogram(selected, self.bins)
+                    np.mean(selected)
+                    np.count_nonzero(selected == 0)
+
+    def time_spread_statistics(self, zones, years, periods):
+        spread_statistics(self.price, periods=self.periods, bins=self.bins)
+
+
+class DataLoaders:
+    params = [1, 6]
+    param_names = ["years"]
+
+    def setup(self, years):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        data = to_data_selected(
+            synthetic_data([GRAPH18, GRAPH22], years=years, seed=SEED)
+        )
+        self.path = os.path.join(self.tmp_dir.name, "data_selected.csv")
+        data.to_csv(self.path)
+
+    def teardown(self, years):
+        self.tmp_dir.cleanup()
+
+    def time_read_data_selected(self, years):
+        # as in 04-evaluate_scm.ipynb
+        pd.read_csv(self.path, parse_dates=["timestamp"]).set_index("timestamp")
+
+    def peakmem_read_data_selected(self, years):
+        pd.read_csv(self.path, parse_dates=["timestamp"]).set_index("timestamp")
+
+    def time_read_file(self, years):
+        read_file(self.path, column_names={})
+
+    def time_read_csv_incl_timeindex(self, years):
+        read_csv_incl_timeindex(self.path)
+
+
+class FeatureStore:
+    # derived features (scripts/features.py): computed from the timestamps, materialized next to the dataset
+    # once and loaded by name by the SCM and GBT notebooks
+    params = [[1, 6], ["h", "15min"]]
+    param_names = ["years", "freq"]
+    timeout = 1800
+
+    def setup(self, years, freq):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        data = to_data_selected(
+            synthetic_data(GRAPH18, years=years, seed=SEED, freq=freq)
+        )
+        self.path = os.path.join(self.tmp_dir.name, "data_selected.csv")
+        data.to_csv(self.path)
+        self.index = data.index
+        materialize_features(self.path)
+
+    def teardown(self, years, freq):
+        self.tmp_dir.cleanup()
+
+    def time_calendar_features(self, years, freq):
+        calendar_features(self.index)
+
+    def time_materialize_features(self, years, freq):
+        materialize_features(self.path)
+
+    def time_load_features(self, years, freq):
+        load_features(self.path, CALENDAR_FEATURES)
+
+
+class GBTSplits:
+    # test split of a GBT model: csv copy (before) vs. split manifest over the binary dataset and cached DMatrix
+    # (shapley-flow/gbt_data.py), the paths of gbt_data are relative to the working directory
+    params = [1, 6]
+    param_names = ["years"]
+
+    def setup(self, years):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        data = to_data_selected(synthetic_data(GRAPH18, years=years, seed=SEED))
+        os.makedirs("data/bench")
+        X = data.drop(columns=["price_da"]).rename_axis("timestamp")
+        X.to_csv("data/bench/X_full.csv")
+        for target in gbt_data.TARGETS:
+            data[["price_da"]].rename_axis("timestamp").to_csv(
+                "data/bench/y_{}_full.csv".format(target)
+            )
+        dataset = gbt_data.load_dataset("bench")
+        train, test = gbt_data.block_split(dataset.index)
+        gbt_data.save_split("bench", "model", train=train, test=test)
+        gbt_data.load_split_frame("bench", "model", "test").to_csv("X_test.csv")
+        gbt_data.split_dmatrix("bench", "model", "test", "price")
+
+    def teardown(self, years):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def time_read_test_csv(self, years):
+        read_csv_incl_timeindex("X_test.csv")
+
+    def time_load_split_frame(self, years):
+        gbt_data.load_split_frame("bench", "model", "test")
+
+    def time_split_dmatrix(self, years):
+        gbt_data.split_dmatrix("bench", "model", "test", "price")
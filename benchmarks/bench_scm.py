@@ -0,0 +1,311 @@
+# benchmarks of the SCM pipeline (scripts/causal_functions.py) on synthetic data
+
+from .common import GRAPH18, load_synthetic, seed_all
+
+from dowhy import gcm
+from dowhy.gcm.falsify import falsify_graph
+from dowhy.gcm.independence_test import kernel_based
+
+from scripts.causal_functions import (
+    create_causal_model,
+    get_grouped_linear_coefficients,
+    get_linear_coefficients,
+    linear_edge_credit,
+)
+from scripts.causal_graphs import add_lags
+from scripts.causal_influence import causal_influences
+from scripts.ci_tests import compare_ci_tests, rcot
+from scripts.distribution_change import distribution_change, fit_period_models
+from scripts.mechanism_evaluation import evaluate_mechanisms
+from scripts.streaming import StreamingSCM
+from scripts.utils import Standardizer
+
+
+class CreateCausalModel:
+    # 1 year, 10 and 50 country-years
+    params = [1, 10, 50]
+    param_names = ["country_years"]
+    timeout = 1800
+
+    def setup(self, country_years):
+        countries = [f"C{i}" for i in range(country_years)]
+        data, normalized_data = load_synthetic(countries=countries)
+        self.data = data.loc[:, GRAPH18["nodes"]]
+        self.normalized_data = normalized_data.loc[:, GRAPH18["nodes"]]
+        seed_all()
+
+    def time_create_causal_model(self, country_years):
+        create_causal_model(GRAPH18["graph"], self.normalized_data)
+
+    def peakmem_create_causal_model(self, country_years):
+        create_causal_model(GRAPH18["graph"], self.normalized_data)
+
+
+class Standardize:
+    params = [1, 10]
+    param_names = ["country_years"]
+
+    def setup(self, country_years):
+        countries = [f"C{i}" for i in range(country_years)]
+        self.data, _ = load_synthetic(countries=countries)
+
+    def time_standardize(self, country_years):
+        Standardizer(self.data).transform(self.data)
+
+    def peakmem_standardize(self, country_years):
+        Standardizer(self.data).transform(self.data)
+
+
+class LinearCoefficients:
+    params = [1, 10]
+    param_names = ["country_years"]
+
+    def setup(self, country_years):
+        countries = [f"C{i}" for i in range(country_years)]
+        data, normalized_data = load_synthetic(countries=countries)
+        self.data = data.loc[:, GRAPH18["nodes"]]
+        seed_all()
+        self.causal_model = create_causal_model(
+            GRAPH18["graph"], normalized_data.loc[:, GRAPH18["nodes"]]
+        )
+
+    def time_get_linear_coefficients(self, country_years):
+        get_linear_coefficients(self.causal_model, self.data)
+
+
+class GroupedLinearCoefficients:
+    # one SCM per working day/holiday and hour of the day (48 groups)
+    params = [1, 6]
+    param_names = ["years"]
+
+    def setup(self, years):
+        data, _ = load_synthetic(years=years)
+        self.data = data.loc[:, GRAPH18["nodes"]]
+
+    def time_get_grouped_linear_coefficients(self, years):
+        get_grouped_linear_coefficients(
+            GRAPH18, self.data, ["isworkingday", self.data.index.hour]
+        )
+
+
+class LaggedLinearCoefficients:
+    # 6 years with 265 lagged nodes (see scripts/lags.py)
+    timeout = 600
+
+    def setup(self):
+        data, _ = load_synthetic(years=6)
+        self.data = data.loc[:, GRAPH18["nodes"]]
+        self.graph = add_lags(
+            GRAPH18,
+            {
+                "price_da": ["gas_price[t-24..t-168]"],
+                "na": ["river_temp[t-1..t-72]"],
+                "run_off_gen": ["river_flow_mean[t-1..t-48]"],
+            },
+        )
+
+    def time_lagged_linear_coefficients(self):
+        get_grouped_linear_coefficients(self.graph, self.data)
+
+    def peakmem_lagged_linear_coefficients(self):
+        get_grouped_linear_coefficients(self.graph, self.data)
+
+
+class StreamingUpdate:
+    # one day of new hourly rows after a fit on one year
+    def setup(self):
+        data, _ = load_synthetic(years=2)
+        data = data.loc[:, GRAPH18["nodes"]]
+        self.history, self.rows = data.iloc[:8760], data.iloc[8760:8784]
+        self.standardizer = Standardizer(self.history)
+        seed_all()
+        self.causal_model = create_causal_model(
+            GRAPH18["graph"], self.standardizer.transform(self.history)
+        )
+
+    def time_update(self):
+        StreamingSCM(
+            self.causal_model, GRAPH18, self.standardizer, forgetting_factor=0.999
+        ).update(self.rows).coefficients()
+
+
+class LinearEdgeCredit:
+    params = [1000, 10000]
+    param_names = ["n_fg"]
+
+    def setup(self, n_fg):
+        data, normalized_data = load_synthetic(years=1)
+        self.data = data.loc[:, GRAPH18["nodes"]]
+        seed_all()
+        self.causal_model = create_causal_model(
+            GRAPH18["graph"], normalized_data.loc[:, GRAPH18["nodes"]]
+        )
+        self.standardizer = Standardizer(self.data)
+        self.fg = self.data.sample(n=n_fg, random_state=1)
+        self.bg = self.data.sample(n=100, random_state=2)
+
+    def time_linear_edge_credit(self, n_fg):
+        linear_edge_credit(
+            self.causal_model, "price_da", self.fg, self.bg, self.standardizer
+        )
+
+
+class EvaluateCausalModel:
+    # evaluation and falsification are run on reduced sample sizes and permutations
+    timeout = 3600
+
+    def setup(self):
+        _, normalized_data = load_synthetic(years=1)
+        self.normalized_data = normalized_data.loc[:, GRAPH18["nodes"]].iloc[:2000]
+        seed_all()
+        self.causal_model = create_causal_model(GRAPH18["graph"], self.normalized_data)
+
+    def time_evaluate_causal_model(self):
+        gcm.evaluate_causal_model(
+            self.causal_model,
+            self.normalized_data,
+            evaluate_overall_kl_divergence=False,
+            evaluate_causal_structure=False,
+        )
+
+    def peakmem_evaluate_causal_model(self):
+        gcm.evaluate_causal_model(
+            self.causal_model,
+            self.normalized_data,
+            evaluate_overall_kl_divergence=False,
+            evaluate_causal_structure=False,
+        )
+
+
+class EvaluateMechanisms:
+    # budgeted evaluation of the mechanisms (scripts/mechanism_evaluation.py) on all rows of 3 years
+    timeout = 1800
+
+    def setup(self):
+        _, normalized_data = load_synthetic(years=3)
+        self.normalized_data = normalized_data.loc[:, GRAPH18["nodes"]]
+        seed_all()
+        self.causal_model = create_causal_model(GRAPH18["graph"], self.normalized_data)
+
+    def time_evaluate_mechanisms(self):
+        evaluate_mechanisms(
+            {"2018-2020": (self.causal_model, self.normalized_data)},
+            ci_test="rcot",
+        )
+
+
+class DistributionChange:
+    # attribution of the change of price_da between two halves of 4 years to the mechanisms
+    # (scripts/distribution_change.py), exact for the linear models and sampled
+    params = ["linear", "sampling"]
+    param_names = ["method"]
+    timeout = 1800
+
+    def setup(self, method):
+        data, _ = load_synthetic(years=4)
+        data = data.loc[:, GRAPH18["nodes"]]
+        standardizer = Standardizer(data)
+        seed_all()
+        self.old, self.new = fit_period_models(
+            GRAPH18, data, data.index[len(data) // 2], standardizer
+        )
+        self.kwargs = (
+            {} if method == "linear" else {"num_permutations": 10, "num_samples": 2000}
+        )
+
+    def time_distribution_change(self, method):
+        distribution_change(self.old, self.new, "price_da", method=method, **self.kwargs)
+
+
+class CausalInfluences:
+    # arrow strengths of all edges and intrinsic causal influences of price_da for the SCMs of
+    # 6 yearly windows (scripts/causal_influence.py), closed form
+    timeout = 1800
+
+    def setup(self):
+        _, normalized_data = load_synthetic(years=6)
+        normalized_data = normalized_data.loc[:, GRAPH18["nodes"]]
+        self.windows = {
+            str(year): group
+            for year, group in normalized_data.groupby(normalized_data.index.year)
+        }
+        seed_all()
+
+    def time_causal_influences(self):
+        causal_influences(GRAPH18, self.windows, targets=["price_da"])
+
+
+class SampledCausalInfluences:
+    # the sampling estimators (gcm.intrinsic_causal_influence on the upstream nodes of load_da, which
+    # leaves out nodes that are not upstream of it) for the SCM of one window, reduced samples
+    timeout = 1800
+    number = 1
+    repeat = 1
+    warmup_time = 0
+
+    def setup(self):
+        _, normalized_data = load_synthetic(years=1)
+        self.windows = {"2018": normalized_data.loc[:, GRAPH18["nodes"]].iloc[:3000]}
+        seed_all()
+
+    def time_sampled_causal_influences(self):
+        causal_influences(
+            GRAPH18,
+            self.windows,
+            targets=["load_da"],
+            method="sampling",
+            processes=1,
+            num_parent_samples=20,
+            num_samples_conditional=50,
+        )
+
+
+class FalsifyGraph:
+    # a single run takes minutes even at reduced permutations
+    timeout = 3600
+    number = 1
+    repeat = 1
+    warmup_time = 0
+
+    def setup(self):
+        _, normalized_data = load_synthetic(years=1)
+        self.normalized_data = normalized_data.loc[:, GRAPH18["nodes"]].iloc[:500]
+        seed_all()
+
+    def time_falsify_graph(self):
+        falsify_graph(
+            causal_graph=GRAPH18["graph"],
+            data=self.normalized_data,
+            suggestions=False,
+            n_permutations=3,
+            show_progress_bar=False,
+        )
+
+
+class CITestCalibration:
+    # rcot (scripts/ci_tests.py) against the exact kernel test of dowhy on 40 local Markov statements of
+    # GRAPH18, which all hold for the synthetic data: the size (share of the p-values below 0.05) and the
+    # Spearman correlation of the p-values. The kernel tests take minutes, they run once in setup_cache
+    timeout = 3600
+
+    def setup_cache(self):
+        _, normalized_data = load_synthetic(years=1)
+        seed_all()
+        return compare_ci_tests(
+            GRAPH18["graph"],
+            normalized_data.loc[:, GRAPH18["nodes"]].iloc[:2000],
+            {"kernel": kernel_based, "rcot": rcot},
+            max_statements=40,
+        )
+
+    def track_size_kernel(self, p_values):
+        return (p_values["kernel"] < 0.05).mean()
+
+    def track_size_rcot(self, p_values):
+        return (p_values["rcot"] < 0.05).mean()
+
+    def track_agreement(self, p_values):
+        return ((p_values["kernel"] < 0.05) == (p_values["rcot"] < 0.05)).mean()
+
+    def track_spearman(self, p_values):
+        return p_values["kernel"].corr(p_values["rcot"], method="spearman")
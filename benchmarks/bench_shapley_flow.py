@@ -0,0 +1,154 @@
+# benchmarks of the shapley flow pipeline (shapley-flow/shap_flow_util.py) on synthetic data
+
+import numpy as np
+
+from .common import GRAPH18, SEED
+
+from scripts.synthetic_data import synthetic_data, to_data_selected
+
+
+class EdgeCredit:
+    # reduced number of foreground samples and monte carlo runs
+    params = [(50, 10), (200, 20)]
+    param_names = ["n_fg_nruns"]
+    timeout = 1800
+
+    def setup(self, n_fg_nruns):
+        try:
+            import xgboost as xgb
+            from shap_flow_util import build_causal_graph
+        except ImportError:
+            raise NotImplementedError("shapflow/xgboost not installed")
+
+        data = to_data_selected(synthetic_data(GRAPH18, years=1, seed=SEED))
+        # features as in shapley-flow/01_prepare_data.ipynb
+        X = data[
+            [
+                "nuclear_avail", "carbon_price", "gas_price", "solar_da", "load_da",
+                "wind_da", "rl_BE", "rl_DE_LU", "rl_ES", "rl_IT_NORD", "temp_mean",
+                "river_temp", "river_flow_mean", "rl_FR_ramp", "run_off_gen",
+                "isworkingday",
+            ]
+        ].copy()
+        X["isworkingday"] = X["isworkingday"] * 1.0
+        X["day_of_year_sin"] = np.sin(X.index.dayofyear / 365 * 2 * np.pi)
+        X["day_of_year_cos"] = np.cos(X.index.dayofyear / 365 * 2 * np.pi)
+        X["hour_sin"] = np.sin(X.index.hour / 24 * 2 * np.pi)
+        X["hour_cos"] = np.cos(X.index.hour / 24 * 2 * np.pi)
+
+        model = xgb.train(
+            {"max_depth": 6, "objective": "reg:squarederror", "nthread": 1},
+            xgb.DMatrix(X, label=data["price_da"]),
+            num_boost_round=100,
+        )
+        n_fg, _ = n_fg_nruns
+        self.causal_graph = build_causal_graph(X.iloc[:2000], model, "price_da")
+        self.bg = X.sample(n=1, random_state=SEED)
+        self.fg = X.sample(n=n_fg, random_state=SEED + 1)
+
+    def time_calculate_edge_credit(self, n_fg_nruns):
+        from shap_flow_util import calculate_edge_credit
+
+        _, nruns = n_fg_nruns
+        np.random.seed(SEED)
+        calculate_edge_credit(self.causal_graph, self.bg, self.fg, nruns)
+
+    def peakmem_calculate_edge_credit(self, n_fg_nruns):
+        from shap_flow_util import calculate_edge_credit
+
+        _, nruns = n_fg_nruns
+        np.random.seed(SEED)
+        calculate_edge_credit(self.causal_graph, self.bg, self.fg, nruns)
+
+
+class ModelEvaluation:
+    # one evaluation of the target function of the graph for 1000 foreground samples
+    params = ["create_xgboost_f", "XGBoostPredictor"]
+    param_names = ["predictor"]
+
+    def setup(self, predictor):
+        try:
+            import xgboost as xgb
+            from shapflow.flow import create_xgboost_f
+            from shap_flow_util import XGBoostPredictor
+        except ImportError:
+            raise NotImplementedError("shapflow/xgboost not installed")
+
+        data = to_data_selected(synthetic_data(GRAPH18, years=1, seed=SEED))
+        X = data[["gas_price", "load_da", "wind_da", "solar_da", "nuclear_avail"]]
+        model = xgb.train(
+            {"max_depth": 6, "objective": "reg:squarederror", "nthread": 1},
+            xgb.DMatrix(X, label=data["price_da"]),
+            num_boost_round=100,
+        )
+        names = list(X.columns)
+        if predictor == "create_xgboost_f":
+            self.f = create_xgboost_f(names, model)
+        else:
+            self.f = XGBoostPredictor(names, model, nthread=1)
+        fg = X.sample(n=1000, random_state=SEED)
+        self.args = [fg[name].to_numpy() for name in names]
+
+    def time_model_evaluation(self, predictor):
+        self.f(*self.args)
+
+
+class ExternalMemoryTraining:
+    # training of a GBT model on the train split of 6 synthetic years, in memory (DMatrix of the split) and from the
+    # memory mapped dataset in batches (shapley-flow/external_memory.py)
+    params = ["in_memory", "external_memory"]
+    param_names = ["training"]
+    timeout = 1800
+
+    def setup(self, training):
+        import os
+        import tempfile
+
+        try:
+            import gbt_data
+            import external_memory
+        except ImportError:
+            raise NotImplementedError("xgboost not installed")
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        data = to_data_selected(synthetic_data(GRAPH18, years=6, seed=SEED))
+        os.makedirs("data/bench")
+        data.drop(columns=["price_da"]).rename_axis("timestamp").to_csv("data/bench/X_full.csv")
+        for target in gbt_data.TARGETS:
+            data[["price_da"]].rename_axis("timestamp").to_csv(
+                "data/bench/y_{}_full.csv".format(target)
+            )
+        dataset = gbt_data.load_dataset("bench")
+        train, test = gbt_data.block_split(dataset.index)
+        gbt_data.save_split("bench", "model", train=train, test=test)
+        self.partitions = external_memory.split_partitions("bench", "model")
+        self.dtrain = gbt_data.split_dmatrix("bench", "model", "train", "price")
+        self.params = {"max_depth": 6, "learning_rate": 0.1}
+
+    def teardown(self, training):
+        import os
+
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def time_train(self, training):
+        import xgboost as xgb
+        import external_memory
+
+        if training == "in_memory":
+            xgb.train(
+                external_memory.booster_params(self.params, 0.0, nthread=1),
+                self.dtrain,
+                num_boost_round=100,
+            )
+        else:
+            external_memory.train_external_memory(
+                self.partitions,
+                "price",
+                self.params,
+                num_boost_round=100,
+                batch_rows=10000,
+                nthread=1,
+            )
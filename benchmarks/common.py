@@ -0,0 +1,51 @@
+# shared set up of the asv benchmarks: import paths and synthetic data
+
+import os
+import sys
+
+# asv copies the checked out commit into the environment (see install_command in asv.conf.json),
+# outside of asv the working tree is used
+SRC_DIR = os.path.join(os.environ.get("ASV_ENV_DIR", ""), "src")
+if not os.path.isdir(SRC_DIR):
+    SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in [
+    os.path.join(SRC_DIR, "SCM", "notebooks"),
+    os.path.join(SRC_DIR, "shapley-flow"),
+]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import numpy as np
+
+from scripts.causal_graphs import GRAPH18, GRAPH22
+from scripts.synthetic_data import synthetic_data
+from scripts.utils import Standardizer
+
+SEED = 42
+
+
+def load_synthetic(years=1, countries=("FR",)):
+    """
+    Synthetic data for GRAPH18 and GRAPH22 and its normalized version, as used in 04-evaluate_scm.ipynb.
+
+    Parameters:
+    years (int, optional): Number of years per country. Defaults to 1.
+    countries (sequence, optional): Countries to generate. Defaults to ("FR",).
+
+    Returns:
+    tuple: The original and the normalized data.
+    """
+    data = synthetic_data([GRAPH18, GRAPH22], years=years, countries=countries, seed=SEED)
+    if len(countries) > 1:
+        # stack the country-years along the time axis
+        data = data.reset_index(level="country", drop=True)
+    normalized_data = Standardizer(data).transform(data)
+    return data, normalized_data
+
+
+def seed_all():
+    import random
+
+    np.random.seed(SEED)
+    random.seed(SEED)
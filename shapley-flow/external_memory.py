@@ -0,0 +1,159 @@
+# external memory training of the GBT models of 03_gbt_training.ipynb for datasets larger than the memory (e.g. a
+# pan-European panel of several countries or 15-minute data). the training rows are given as partitions, a partition
+# is a binary dataset of gbt_data (memory mapped) with the positions of its training rows (e.g. the train part of the
+# split manifest of the model, i.e. the 4-day block split). a DataIter reads the partitions in batches of at most
+# batch_rows rows and xgboost builds an ExtMemQuantileDMatrix from them: the quantile sketch and the histogram pages
+# are kept in a local page cache on disk, only one batch of raw rows is in memory at a time.
+# the hyperparameter search is the one of 03_gbt_training.ipynb (same search space, candidates and settings as the
+# RandomizedSearchCV with 5 folds and refit on the root mean squared error), the best model is saved as
+# ./models/<version>/<model_name>_best.json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import xgboost as xgb
+from scipy.stats import randint, uniform
+from sklearn.model_selection import KFold, ParameterSampler
+
+from gbt_data import load_dataset, load_split
+from scm_scripts import trace, traced
+
+# search space and settings of 03_gbt_training.ipynb
+PARAM_DIST = {
+    'max_depth': randint(3, 12),
+    'learning_rate': uniform(0.01, 0.3),
+    'subsample': uniform(0.5, 0.5),
+    'min_child_weight': randint(1, 31),
+    'reg_lambda': uniform(0, 1),
+    'reg_alpha': uniform(0, 1)
+}
+N_ESTIMATORS = 1200
+RANDOM_STATE = 42
+
+# batches of the training rows of some partitions, see module comment. every batch is a copy of its rows (the
+# partitions are memory mapped), with the labels of the target
+class PartitionIter(xgb.DataIter):
+    def __init__(self, partitions, target, batch_rows=1000000, cache_prefix=None):
+        self.partitions = partitions
+        self.target = target
+        self.batches = [(i, positions[start:start + batch_rows])
+                        for i, (_, positions) in enumerate(partitions)
+                        for start in range(0, len(positions), batch_rows)]
+        self.features = partitions[0][0].features
+        for dataset, _ in partitions:
+            if dataset.features != self.features:
+                raise ValueError('the partitions have different features')
+        self._it = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def __len__(self):
+        return sum(len(positions) for _, positions in self.partitions)
+
+    def next(self, input_data):
+        if self._it == len(self.batches):
+            return False
+        i, positions = self.batches[self._it]
+        dataset = self.partitions[i][0]
+        with trace('external_memory_batch', rows=len(positions)):
+            input_data(data=dataset.X(positions), label=dataset.y(self.target, positions), feature_names=self.features)
+        self._it += 1
+        return True
+
+    def reset(self):
+        self._it = 0
+
+    # mean of the labels, streamed over the batches (base_score of 03_gbt_training.ipynb)
+    def label_mean(self):
+        total = 0.0
+        for i, positions in self.batches:
+            total += self.partitions[i][0].y(self.target, positions).sum(dtype=np.float64)
+        return total / len(self)
+
+    # predictions of a booster for all rows, in batches
+    def predict(self, booster):
+        return np.concatenate([booster.inplace_predict(self.partitions[i][0].X(positions), validate_features=False)
+                               for i, positions in self.batches])
+
+    def labels(self):
+        return np.concatenate([self.partitions[i][0].y(self.target, positions) for i, positions in self.batches])
+
+# the partitions of a model: the train (or another) part of its split manifest, for one or several datasets (e.g.
+# one version per country, with a split manifest of the same model name each)
+def split_partitions(versions, model_name, part='train'):
+    versions = [versions] if isinstance(versions, str) else versions
+    partitions = []
+    for version in versions:
+        dataset = load_dataset(version)
+        partitions.append((dataset, dataset.positions(load_split(version, model_name)[part])))
+    return partitions
+
+# the xgboost parameters of an XGBRegressor of 03_gbt_training.ipynb with the sampled hyperparameters
+def booster_params(params, base_score, nthread=None):
+    return {'objective': 'reg:squarederror', 'tree_method': 'hist', 'base_score': base_score,
+            'seed': RANDOM_STATE, 'nthread': nthread or os.cpu_count(), **params}
+
+# trains a booster on partitions with an ExtMemQuantileDMatrix, the page cache is written below cache_dir
+@traced()
+def train_external_memory(partitions, target, params, base_score=None, num_boost_round=N_ESTIMATORS,
+                          cache_dir=None, batch_rows=1000000, max_bin=256, nthread=None):
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    # own directory of the pages of this matrix, removed after the training
+    page_dir = tempfile.mkdtemp(prefix='xgb_cache_', dir=cache_dir)
+    it = PartitionIter(partitions, target, batch_rows=batch_rows, cache_prefix=os.path.join(page_dir, 'cache'))
+    if base_score is None:
+        base_score = it.label_mean()
+    try:
+        dtrain = xgb.ExtMemQuantileDMatrix(it, max_bin=max_bin, nthread=nthread)
+        return xgb.train(booster_params(params, base_score, nthread), dtrain, num_boost_round=num_boost_round)
+    finally:
+        shutil.rmtree(page_dir, ignore_errors=True)
+
+def _fold_partitions(partitions, rows):
+    # the rows (positions into the concatenated training rows of all partitions) of every partition
+    offsets = np.cumsum([0] + [len(positions) for _, positions in partitions])
+    return [(dataset, positions[rows[(rows >= offsets[i]) & (rows < offsets[i + 1])] - offsets[i]])
+            for i, (dataset, positions) in enumerate(partitions)
+            if ((rows >= offsets[i]) & (rows < offsets[i + 1])).any()]
+
+# random search of 03_gbt_training.ipynb with external memory: the candidates are sampled as by RandomizedSearchCV
+# (random_state=42), every candidate is trained on 4 of 5 folds of the training rows (KFold without shuffling, in the
+# order of the split manifest) and scored with the root mean squared error on the remaining fold. the best candidate
+# is refitted on all training rows. returns the best booster, its parameters and the scores of all candidates
+def random_search_external_memory(partitions, target, n_iter=60, cv=5, num_boost_round=N_ESTIMATORS,
+                                  cache_dir=None, batch_rows=1000000, max_bin=256, nthread=None):
+    n_rows = sum(len(positions) for _, positions in partitions)
+    candidates = list(ParameterSampler(PARAM_DIST, n_iter=n_iter, random_state=RANDOM_STATE))
+    # the partitions of every fold and the base score of the fold, the mean of the labels of its training rows
+    # only (a clone of the XGBRegressor is fitted on every fold, the held-out labels must not enter its model)
+    folds = []
+    for train_rows, test_rows in KFold(n_splits=cv).split(np.arange(n_rows)):
+        train_partitions = _fold_partitions(partitions, train_rows)
+        base_score = PartitionIter(train_partitions, target, batch_rows=batch_rows).label_mean()
+        folds.append((train_partitions, _fold_partitions(partitions, test_rows), base_score))
+    scores = np.zeros((len(candidates), cv))
+    for c, params in enumerate(candidates):
+        for f, (train_partitions, test_partitions, base_score) in enumerate(folds):
+            with trace('external_memory_fold', rows=sum(len(p) for _, p in train_partitions), candidate=c, fold=f):
+                booster = train_external_memory(train_partitions, target, params,
+                                                base_score=base_score, num_boost_round=num_boost_round,
+                                                cache_dir=cache_dir, batch_rows=batch_rows, max_bin=max_bin,
+                                                nthread=nthread)
+                test_it = PartitionIter(test_partitions, target, batch_rows=batch_rows)
+                scores[c, f] = np.sqrt(np.mean((test_it.predict(booster) - test_it.labels()) ** 2))
+        print('candidate {}/{}: rmse {:.4f} {}'.format(c + 1, len(candidates), scores[c].mean(), params))
+    best = int(np.argmin(scores.mean(axis=1)))
+    # the refit on all training rows, base score from all of them
+    booster = train_external_memory(partitions, target, candidates[best], num_boost_round=num_boost_round,
+                                    cache_dir=cache_dir, batch_rows=batch_rows, max_bin=max_bin, nthread=nthread)
+    return booster, candidates[best], scores
+
+# saves the best booster with the naming of 03_gbt_training.ipynb
+def save_best_model(booster, version, model_name):
+    directory = './models/{}'.format(version)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = '{}/{}_best.json'.format(directory, model_name)
+    booster.save_model(path)
+    return path
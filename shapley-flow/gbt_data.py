@@ -0,0 +1,252 @@
+# binary cache of the combined dataset of 01_prepare_data.ipynb (X_full.csv, y_<target>_full.csv) and index based
+# train/test split manifests of the GBT models (03_gbt_training.ipynb, 04 and 05 load the splits from them).
+# the dataset is parsed once into a directory ./data/<version>/dataset with
+# - X.npy: (n_rows, n_features) float32 features, C-contiguous (xgboost trains on float32)
+# - y_<target>.npy: (n_rows,) float32 labels (xgboost stores the labels as float32 as well)
+# - index.npy: timestamps of the rows (datetime64[ns], UTC)
+# - manifest.json: format version, feature names, targets, time zone, resolution (e.g. 'h' or '15min' for the
+#   15-minute market time unit) and the source files
+# the arrays are memory mapped on load, a period (a range of timestamps) is a zero-copy view. a split manifest
+# (split_<model_name>.npz) only stores the timestamps of the rows of every part (train, test, fg, bg, ...) and extra
+# arrays like the background weights, the rows are read from the dataset by position when a part is loaded (a copy,
+# the parts of the block split are not contiguous). the DMatrix of a part is cached in xgboost's binary format next
+# to the manifest, keyed on the timestamps of the part and the build of the dataset
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from sklearn.model_selection import train_test_split
+
+from scm_scripts import trace, traced
+
+DATASET_FORMAT = 'gbt_dataset'
+DATASET_VERSION = 1
+TARGETS = ['price', 'export']
+
+def dataset_dir(version):
+    return './data/{}/dataset'.format(version)
+
+def split_path(version, model_name):
+    return './data/{}/splits/split_{}.npz'.format(version, model_name)
+
+def _sources(version, targets):
+    directory = './data/{}'.format(version)
+    files = {'X': '{}/X_full.csv'.format(directory)}
+    files.update({target: '{}/y_{}_full.csv'.format(directory, target) for target in targets})
+    return files
+
+def _is_stale(path, sources):
+    manifest = os.path.join(path, 'manifest.json')
+    if not os.path.exists(manifest):
+        return True
+    mtime = os.path.getmtime(manifest)
+    return any(os.path.exists(source) and os.path.getmtime(source) > mtime for source in sources.values())
+
+# parses the csv files of 01_prepare_data.ipynb once into the binary dataset (skipped if it is newer than the csv
+# files, unless force=True). the csv files are read in chunks of chunk_rows rows and written into the memory mapped
+# arrays, so datasets larger than the memory can be built (e.g. a pan-European panel or 15-minute data)
+@traced()
+def build_dataset_cache(version, targets=TARGETS, force=False, chunk_rows=500000):
+    path = dataset_dir(version)
+    sources = _sources(version, targets)
+    if not force and not _is_stale(path, sources):
+        return path
+    index = pd.DatetimeIndex(pd.concat([pd.to_datetime(chunk['timestamp'], utc=True) for chunk in
+                                        pd.read_csv(sources['X'], usecols=['timestamp'], chunksize=chunk_rows)]))
+    features = [column for column in pd.read_csv(sources['X'], nrows=0).columns if column != 'timestamp']
+    tmp = '{}.tmp-{}'.format(path, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    X = np.lib.format.open_memmap(os.path.join(tmp, 'X.npy'), mode='w+', dtype=np.float32, shape=(len(index), len(features)))
+    start = 0
+    for chunk in pd.read_csv(sources['X'], index_col='timestamp', chunksize=chunk_rows):
+        chunk['isworkingday'] = chunk['isworkingday'] * 1.0 # boolean column as float, as in 03_gbt_training.ipynb
+        X[start:start + len(chunk)] = chunk[features].to_numpy(dtype=np.float32)
+        start += len(chunk)
+    X.flush()
+    del X
+    np.save(os.path.join(tmp, 'index.npy'), index.tz_localize(None).to_numpy(dtype='datetime64[ns]'))
+    label_names = {}
+    for target in targets:
+        y = np.lib.format.open_memmap(os.path.join(tmp, 'y_{}.npy'.format(target)), mode='w+', dtype=np.float32, shape=(len(index),))
+        start = 0
+        for chunk in pd.read_csv(sources[target], index_col='timestamp', chunksize=chunk_rows):
+            if not pd.to_datetime(chunk.index, utc=True).equals(index[start:start + len(chunk)]):
+                raise ValueError('the rows of {} and {} differ'.format(sources[target], sources['X']))
+            y[start:start + len(chunk)] = chunk.iloc[:, 0].to_numpy(dtype=np.float32)
+            start += len(chunk)
+            label_names[target] = chunk.columns[0]
+        if start != len(index):
+            raise ValueError('the rows of {} and {} differ'.format(sources[target], sources['X']))
+        y.flush()
+        del y
+    manifest = {
+        'format': DATASET_FORMAT,
+        'version': DATASET_VERSION,
+        'features': features,
+        'targets': label_names,
+        'index_tz': 'UTC',
+        'resolution': _resolution(index),
+        'sources': {key: os.path.relpath(source, path) for key, source in sources.items()},
+    }
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return path
+
+# resolution of the rows: the shortest time between two rows (rows with missing values are dropped)
+def _resolution(index):
+    if len(index) < 2:
+        return None
+    return to_offset(pd.Timedelta(np.diff(index.asi8).min(), unit='ns')).freqstr
+
+# the binary dataset, memory mapped. X and y return zero-copy views of a range of rows (e.g. a period), frame the
+# rows as DataFrame with the timestamp index (zero-copy for a range of rows)
+class Dataset:
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != DATASET_FORMAT:
+            raise ValueError('{} is not a gbt dataset'.format(path))
+        if manifest['version'] > DATASET_VERSION:
+            raise ValueError('dataset format version {} is not supported (<= {})'.format(manifest['version'], DATASET_VERSION))
+        self.path = path
+        self.manifest = manifest
+        self.features = manifest['features']
+        self.resolution = manifest.get('resolution')
+        self._X = np.load(os.path.join(path, 'X.npy'), mmap_mode='r')
+        self._y = {target: np.load(os.path.join(path, 'y_{}.npy'.format(target)), mmap_mode='r')
+                   for target in manifest['targets']}
+        self.index = pd.DatetimeIndex(np.load(os.path.join(path, 'index.npy'))).tz_localize(manifest['index_tz'])
+        self.index.name = 'timestamp'
+
+    def __len__(self):
+        return len(self.index)
+
+    # slice of the rows between two dates, both included (as read_csv_between)
+    def rows(self, start_date=None, end_date=None):
+        start = 0 if start_date is None else self.index.searchsorted(pd.Timestamp(start_date, tz=self.index.tz))
+        end = len(self) if end_date is None else self.index.searchsorted(pd.Timestamp(end_date, tz=self.index.tz) + pd.Timedelta('1D'))
+        return slice(int(start), int(end))
+
+    # positions of timestamps (e.g. of a split manifest)
+    def positions(self, timestamps):
+        positions = self.index.get_indexer(timestamps)
+        if (positions < 0).any():
+            raise KeyError('{} timestamps are not in the dataset'.format((positions < 0).sum()))
+        return positions
+
+    # features of some rows (slice: zero-copy view, positions: copy of the rows)
+    def X(self, rows=slice(None)):
+        return self._X[rows]
+
+    def y(self, target, rows=slice(None)):
+        return self._y[target][rows]
+
+    def frame(self, rows=slice(None)):
+        return pd.DataFrame(self.X(rows), index=self.index[rows], columns=self.features, copy=False)
+
+    def labels(self, target, rows=slice(None)):
+        return pd.DataFrame({self.manifest['targets'][target]: self.y(target, rows)}, index=self.index[rows])
+
+# opens the binary dataset, built from the csv files first if it does not exist or is older than them
+def load_dataset(version, targets=TARGETS):
+    return Dataset(build_dataset_cache(version, targets))
+
+# the 4-day block split of 03_gbt_training.ipynb: the rows are grouped into blocks of block_size and the blocks are
+# split randomly into train and test (no block in both, to prevent memorization of the target).
+# returns the train and test timestamps
+def block_split(index, block_size='4d', test_size=0.2, random_state=7):
+    frame = pd.DataFrame(index=index)
+    masker = [pd.Series(g.index) for n, g in frame.groupby(pd.Grouper(freq=block_size))]
+    train_mask, test_mask = train_test_split(masker, test_size=test_size, random_state=random_state)
+    return pd.DatetimeIndex(pd.concat(train_mask)), pd.DatetimeIndex(pd.concat(test_mask))
+
+# saves (or updates) the split manifest of a model: DatetimeIndex parts are stored as timestamps, other arrays
+# (e.g. the background weights) as they are. cached DMatrices of a part stay valid as long as its rows are the same
+def save_split(version, model_name, **parts):
+    path = split_path(version, model_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {}
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=False) as stored:
+            arrays = {key: stored[key] for key in stored.files}
+    for name, values in parts.items():
+        if isinstance(values, pd.Index):
+            arrays[name] = values.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]')
+        else:
+            arrays[name] = np.asarray(values)
+    tmp = '{}.tmp-{}.npz'.format(path[:-4], os.getpid())
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+def _read_split(path):
+    with np.load(path, allow_pickle=False) as stored:
+        return {key: pd.DatetimeIndex(stored[key]).tz_localize('UTC') if stored[key].dtype.kind == 'M' else stored[key]
+                for key in stored.files}
+
+# the parts of a split manifest, timestamps as DatetimeIndex (UTC)
+def load_split(version, model_name):
+    return _read_split(split_path(version, model_name))
+
+# the features (and labels) of a part of a split as DataFrame, e.g. X_test or fg. the rows are gathered by position,
+# i.e. copied from the memory mapped dataset (only the rows of the part are read)
+def load_split_frame(version, model_name, part, target=None, dataset=None):
+    dataset = load_dataset(version) if dataset is None else dataset
+    positions = dataset.positions(load_split(version, model_name)[part])
+    if target is None:
+        return dataset.frame(positions)
+    return dataset.frame(positions), dataset.labels(target, positions)
+
+# the labels of a part of a split as DataFrame, e.g. y_test next to the cached DMatrix of the part
+def load_split_labels(version, model_name, part, target, dataset=None):
+    dataset = load_dataset(version) if dataset is None else dataset
+    return dataset.labels(target, dataset.positions(load_split(version, model_name)[part]))
+
+# reference to a part of a split ('<split manifest>#<part>'), e.g. the fg/bg samples of a saved credit flow
+def split_reference(version, model_name, part):
+    return '{}#{}'.format(split_path(version, model_name), part)
+
+# the features of a part of a split given by its reference, the dataset is next to the splits directory
+def read_split_reference(reference):
+    path, part = reference.rsplit('#', 1)
+    dataset = Dataset(os.path.join(os.path.dirname(os.path.dirname(path)), 'dataset'))
+    return dataset.frame(dataset.positions(_read_split(path)[part]))
+
+def _dmatrix_path(version, model_name, part, target):
+    return './data/{}/splits/dmatrix_{}_{}_{}.buffer'.format(version, model_name, part, target)
+
+# key of a cached DMatrix: the timestamps of the part only (saving other parts of the manifest or the same rows again
+# keeps the cache) and the build of the dataset (a rebuilt dataset writes a new manifest)
+def _dmatrix_key(dataset, timestamps, target):
+    key = hashlib.sha256(np.ascontiguousarray(timestamps.asi8).tobytes())
+    key.update(str(os.stat(os.path.join(dataset.path, 'manifest.json')).st_mtime_ns).encode())
+    key.update(target.encode())
+    return key.hexdigest()
+
+# DMatrix of a part of a split with the labels of the target, cached in xgboost's binary format (loading it skips
+# parsing and the conversion of the rows). the key of the cache is stored next to it (<buffer>.key), the cache is
+# rebuilt if the rows of the part or the dataset changed
+def split_dmatrix(version, model_name, part, target, dataset=None):
+    import xgboost as xgb
+    path = _dmatrix_path(version, model_name, part, target)
+    dataset = load_dataset(version) if dataset is None else dataset
+    timestamps = load_split(version, model_name)[part]
+    key = _dmatrix_key(dataset, timestamps, target)
+    if os.path.exists(path) and os.path.exists(path + '.key'):
+        with open(path + '.key') as f:
+            if f.read() == key:
+                return xgb.DMatrix(path)
+    positions = dataset.positions(timestamps)
+    with trace('split_dmatrix', rows=len(positions), model=model_name, part=part):
+        dmatrix = xgb.DMatrix(dataset.X(positions), label=dataset.y(target, positions), feature_names=dataset.features)
+        dmatrix.save_binary(path)
+    with open(path + '.key', 'w') as f:
+        f.write(key)
+    return dmatrix
@@ -0,0 +1,14 @@
+# the scripts shared with the SCM part (SCM/notebooks/scripts): the import path is set up here once
+# - stage-level tracing, see SCM/notebooks/scripts/profiling.py
+# - headless batch rendering, see SCM/notebooks/scripts/rendering.py
+# - feature store of the derived features, see SCM/notebooks/scripts/features.py
+import os
+import sys
+
+_scm_notebooks = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SCM', 'notebooks')
+if _scm_notebooks not in sys.path:
+    sys.path.append(_scm_notebooks)
+
+from scripts.profiling import enable_tracing, disable_tracing, trace, traced, read_trace, summarize_trace
+from scripts.rendering import render_figures
+from scripts.features import CALENDAR_FEATURES, CYCLICAL_FEATURES, add_features, load_features, materialize_features
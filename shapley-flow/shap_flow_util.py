@@ -1,20 +1,370 @@
 from shapflow.flow import GraphExplainer, node_dict2str_dict
+from shapflow.flow import CausalLinks, build_feature_graph, translator
+from shapflow.flow import Node, Graph, CreditFlow, FlowDefaultDict
 import pandas as pd
 import numpy as np
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import OrderedDict
 import matplotlib.pyplot as plt
 import graphviz
 import seaborn as sns
 import re
 
-def calculate_edge_credit(causal_graph, bg_i, fg, nruns, silent=True):
-    cf_c = GraphExplainer(causal_graph, bg_i, nruns=nruns, silent=silent).shap_values(fg)
+from scm_scripts import trace, traced
+
+# allocation-free replacement of shapflow's create_xgboost_f: the inputs of a model evaluation are copied into a
+# preallocated contiguous float32 buffer and predicted with inplace_predict, i.e. without building a DataFrame and
+# a DMatrix per evaluation. nthread pins the xgboost threads of the process (1 inside the workers of a pool).
+# backend='treelite' compiles the trees into a shared library with treelite/tl2cgen (optional dependencies),
+# the library is checked against the booster on check_data
+class XGBoostPredictor:
+    def __init__(self, parents, model, nthread=1, backend='xgboost', libpath=None, check_data=None, buffer_size=1024):
+        if backend not in ['xgboost', 'treelite']:
+            raise ValueError('unknown backend {}'.format(backend))
+        self.parents = list(parents)
+        self.model = model
+        self.backend = backend
+        self.buffer_size = buffer_size
+        # column of every parent in the input of the model
+        model_features = model.feature_names
+        if model_features is None:
+            self.columns = list(range(len(self.parents)))
+        else:
+            self.columns = [list(model_features).index(name) for name in self.parents]
+        self.n_features = len(self.columns) if model_features is None else len(model_features)
+        self.libpath = libpath
+        self._buffer = None
+        self._predictor = None
+        self.set_threads(nthread)
+        if backend == 'treelite':
+            self._compile()
+            if check_data is not None:
+                self._check(check_data)
+
+    def set_threads(self, nthread):
+        self.nthread = nthread
+        self.model.set_param('nthread', nthread)
+        self._predictor = None
+
+    def _compile(self):
+        import treelite
+        import tl2cgen
+        if self.libpath is None:
+            digest = hashlib.sha256(bytes(self.model.save_raw('ubj'))).hexdigest()[:16]
+            self.libpath = os.path.join(tempfile.gettempdir(), 'xgb_treelite_{}.so'.format(digest))
+        if not os.path.exists(self.libpath):
+            tmp = '{}.tmp-{}.so'.format(self.libpath[:-3], os.getpid())
+            tl2cgen.export_lib(treelite.frontend.from_xgboost(self.model), toolchain='gcc', libpath=tmp)
+            os.replace(tmp, self.libpath)
+
+    def _check(self, X):
+        X = X[self.parents]
+        expected = self.model.inplace_predict(np.ascontiguousarray(X.to_numpy(dtype=np.float32)))
+        predicted = self(*[X[name].to_numpy() for name in self.parents])
+        if not np.allclose(predicted, expected.reshape(predicted.shape), rtol=1e-5, atol=1e-5 * np.abs(expected).max()):
+            raise ValueError('treelite predictions do not match the booster')
+
+    def _predict(self, buffer):
+        if self.backend == 'xgboost':
+            return self.model.inplace_predict(buffer, validate_features=False)
+        import tl2cgen
+        if self._predictor is None:
+            self._predictor = tl2cgen.Predictor(self.libpath, nthread=self.nthread)
+        o = self._predictor.predict(tl2cgen.DMatrix(buffer, dtype='float32'))
+        o = o.reshape(len(buffer), -1)
+        return (o.ravel() if o.shape[1] == 1 else o).astype(np.float32, copy=False)
+
+    def __call__(self, *args):
+        bs = len(args[0])
+        if self._buffer is None or len(self._buffer) < bs:
+            self._buffer = np.zeros((max(bs, self.buffer_size), self.n_features), dtype=np.float32)
+        buffer = self._buffer[:bs]
+        for column, arg in zip(self.columns, args):
+            buffer[:, column] = arg
+        o = self._predict(buffer)
+        if len(o) != bs: # categorical xgboost model with softprob bs x n_class
+            o = o.reshape(bs, -1)
+        return o
+
+    # the buffer and the loaded library are not sent to worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        state['_predictor'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.model.set_param('nthread', self.nthread)
+
+# replaces the functions of the links fitted by shapflow (create_xgboost_f) by XGBoostPredictor
+def use_fast_predictors(graph, nthread=1, backend='xgboost'):
+    for node in graph.nodes:
+        f = node.f
+        if f is None or isinstance(f, XGBoostPredictor) or getattr(f, '__qualname__', '') != 'create_xgboost_f.<locals>.f_':
+            continue
+        closure = dict(zip(f.__code__.co_freevars, (c.cell_contents for c in f.__closure__)))
+        if closure['kwargs']:
+            continue
+        node.f = XGBoostPredictor(closure['parents'], closure['m'], nthread=nthread, backend=backend)
+
+# sets the number of threads of all XGBoostPredictor of a graph (e.g. 1 in the workers of a pool, more in the main process)
+def set_predictor_threads(graph, nthread):
+    for node in graph.nodes:
+        if isinstance(node.f, XGBoostPredictor):
+            node.f.set_threads(nthread)
+
+# bounded LRU cache around a node function (e.g. the target model), keyed by a 64 bit hash of the input row. during
+# shap_values many orderings evaluate the model on identical partially intervened rows (e.g. when the hour or
+# day of year flips first or the source of an edge equals the background value), only new rows are evaluated
+class ModelCache:
+    # constants of the splitmix64 finalizer used to mix the row hash
+    _MIX = (np.uint64(30), np.uint64(0xbf58476d1ce4e5b9), np.uint64(27), np.uint64(0x94d049bb133111eb), np.uint64(31))
+
+    def __init__(self, f, maxsize=100000):
+        self.f = f
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.calls = 0
+        self.cached_calls = 0
+        self.dtype = np.float32
+
+    @classmethod
+    def _mix(cls, x):
+        s1, m1, s2, m2, s3 = cls._MIX
+        x = (x ^ (x >> s1)) * m1
+        x = (x ^ (x >> s2)) * m2
+        return x ^ (x >> s3)
+
+    # 64 bit hash of every row of the input, vectorized over the rows: the bits of every column are folded,
+    # multiplied with an odd constant per column, summed and mixed
+    def _hash_rows(self, args):
+        h = np.zeros(len(args[0]), dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for j, arg in enumerate(args):
+                bits = np.ascontiguousarray(arg, dtype=np.float64).view(np.uint64)
+                h += (bits ^ (bits >> np.uint64(32))) * np.uint64(2 * j + 0x9e3779b97f4a7c15)
+            h = self._mix(h)
+        return h.tolist()
+
+    def __call__(self, *args):
+        keys = self._hash_rows(args)
+        cache = self.cache
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in cache and key not in missing:
+                missing[key] = i
+        self.calls += 1
+        if not missing:
+            self.cached_calls += 1
+        else:
+            rows = np.fromiter(missing.values(), dtype=int, count=len(missing))
+            o = self.f(*[np.asarray(arg)[rows] for arg in args])
+            self.dtype = o.dtype
+            cache.update(zip(missing, o.tolist()))
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        values = [cache[key] for key in keys]
+        for key in keys:
+            cache.move_to_end(key)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return np.array(values, dtype=self.dtype)
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / calls if calls else 0.0,
+                'calls': self.calls, 'cached_calls': self.cached_calls, 'size': len(self.cache)}
+
+    # GraphExplainer deep copies the graph, the copies share the cache
+    def __deepcopy__(self, memo):
+        return self
+
+    # a copy sent to a worker process starts with an empty cache
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cache'] = OrderedDict()
+        state['hits'] = state['misses'] = state['calls'] = state['cached_calls'] = 0
+        return state
+
+# wraps the function of the target node of a graph with a ModelCache and returns the cache
+def cache_target_function(graph, maxsize=100000):
+    node = next(node for node in graph.nodes if node.is_target_node)
+    if not isinstance(node.f, ModelCache):
+        node.f = ModelCache(node.f, maxsize)
+    return node.f
+
+# removes the ModelCache of the target node of a graph
+def uncache_target_function(graph):
+    node = next(node for node in graph.nodes if node.is_target_node)
+    if isinstance(node.f, ModelCache):
+        node.f = node.f.f
+
+# builds the shapley flow causal graph of the GBT models (same causal links as in the SCM graphs 18 and 22)
+def build_causal_graph(X, model, target_name, nthread=1, backend='xgboost'):
+    causal_links = CausalLinks()
+    categorical_feature_names = []
+    display_translator = translator(X.columns, X, X)
+    feature_names = list(X.columns)
+
+    year_features = ['day_of_year_sin', 'day_of_year_cos']
+    causal_links.add_causes_effects(year_features, ['gas_price'])
+
+    year_hour_features = year_features + ['hour_sin', 'hour_cos']
+    wind_solar_da = ['wind_da', 'solar_da']
+    load_rl = ['load_da', 'rl_BE', 'rl_ES', 'rl_DE_LU', 'rl_IT_NORD']
+    nuc_ror = ['nuclear_avail', 'run_off_gen']
+    causal_links.add_causes_effects(year_hour_features, wind_solar_da + load_rl + nuc_ror)
+
+    river_temp_flow = ['river_temp', 'river_flow_mean']
+    causal_links.add_causes_effects(['temp_mean'], river_temp_flow)
+
+    causal_links.add_causes_effects(river_temp_flow, nuc_ror)
+
+    causal_links.add_causes_effects(['temp_mean'], wind_solar_da + load_rl)
+
+    causal_links.add_causes_effects(['isworkingday'], ['rl_FR_ramp'] + load_rl + nuc_ror)
+
+    causal_links.add_causes_effects(feature_names,
+                                    target_name,
+                                    XGBoostPredictor(feature_names, model, nthread=nthread, backend=backend, check_data=X))
+
+    causal_graph = build_feature_graph(X,
+                                    causal_links=causal_links,
+                                    categorical_feature_names=categorical_feature_names,
+                                    display_translator=display_translator,
+                                    target_name=target_name,
+                                    method='xgboost')
+    use_fast_predictors(causal_graph, nthread=nthread, backend=backend)
+    return causal_graph
+
+# cache_size: if given, the target function is cached for this fg/bg pair (see ModelCache), the hit rate is
+# recorded in the trace (stage 'model_cache')
+@traced(rows_arg='fg')
+def calculate_edge_credit(causal_graph, bg_i, fg, nruns, silent=True, cache_size=None):
+    if cache_size is None:
+        cf_c = GraphExplainer(causal_graph, bg_i, nruns=nruns, silent=silent).shap_values(fg)
+        return node_dict2str_dict(cf_c.edge_credit)
+    with trace('model_cache') as record:
+        cache = cache_target_function(causal_graph, cache_size)
+        try:
+            cf_c = GraphExplainer(causal_graph, bg_i, nruns=nruns, silent=silent).shap_values(fg)
+        finally:
+            uncache_target_function(causal_graph)
+        record.update(cache.stats())
+        record['rows'] = cache.hits + cache.misses
     return node_dict2str_dict(cf_c.edge_credit)
 
+@traced()
 def calculate_edge_credit_alt(causal_graph, bg_i, fg_file, nruns, silent=True):
     fg = read_csv_incl_timeindex(fg_file)
     cf_c = GraphExplainer(causal_graph, bg_i, nruns=nruns, silent=silent).shap_values(fg)
     return node_dict2str_dict(cf_c.edge_credit)
 
+# number of representatives per stratum, proportional to the size of the strata (at least one per stratum)
+def _allocate(sizes, k):
+    sizes = np.asarray(sizes, dtype=float)
+    k = max(k, len(sizes))
+    share = sizes / sizes.sum() * (k - len(sizes))
+    counts = 1 + np.floor(share).astype(int)
+    remainder = k - counts.sum()
+    counts[np.argsort(share - np.floor(share))[::-1][:remainder]] += 1
+    return np.minimum(counts, sizes.astype(int))
+
+def _kmeans_representatives(Z, k, seed):
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import pairwise_distances_argmin
+    kmeans = KMeans(n_clusters=k, n_init=4, random_state=seed).fit(Z)
+    # the sample closest to every centroid represents the cluster (centroids are no valid samples, e.g. isworkingday)
+    rows = pairwise_distances_argmin(kmeans.cluster_centers_, Z)
+    counts = np.bincount(kmeans.labels_, minlength=k)
+    # two centroids can share their closest sample
+    rows, inverse = np.unique(rows, return_inverse=True)
+    weights = np.zeros(len(rows))
+    np.add.at(weights, inverse, counts / counts.sum())
+    return rows, weights
+
+def _herding_representatives(Z, k, seed, n_candidates=2000, chunk_size=2000):
+    # kernel herding with a gaussian kernel (median heuristic), candidates are a random subsample
+    rng = np.random.default_rng(seed)
+    candidates = rng.choice(len(Z), size=min(n_candidates, len(Z)), replace=False)
+    C = Z[candidates]
+    sample = Z[rng.choice(len(Z), size=min(1000, len(Z)), replace=False)]
+    d2 = ((sample[:, None, :] - sample[None, :, :]) ** 2).sum(axis=2)
+    gamma = 1 / max(np.median(d2[d2 > 0]), 1e-12)
+    mean_embedding = np.zeros(len(C))
+    for start in range(0, len(Z), chunk_size):
+        d2 = ((C[:, None, :] - Z[None, start:start + chunk_size, :]) ** 2).sum(axis=2)
+        mean_embedding += np.exp(-gamma * d2).sum(axis=1)
+    mean_embedding /= len(Z)
+    K = np.exp(-gamma * ((C[:, None, :] - C[None, :, :]) ** 2).sum(axis=2))
+    chosen = []
+    kernel_sum = np.zeros(len(C))
+    for t in range(k):
+        score = mean_embedding - kernel_sum / (t + 1)
+        score[chosen] = -np.inf
+        i = int(np.argmax(score))
+        chosen.append(i)
+        kernel_sum += K[i]
+    return candidates[chosen], np.full(k, 1 / k)
+
+# picks k weighted representative background samples. the features are standardized and the samples split into
+# strata (list of (start, end) periods, e.g. before and after the energy crisis, or one label per sample); every
+# stratum gets representatives proportional to its size, chosen with k-means (weight: share of the cluster) or
+# kernel herding (equal weights). returns the background samples and their weights (sum 1, same index)
+def summarize_background(X, k=20, strata=None, method='kmeans', seed=7):
+    if method not in ['kmeans', 'herding']:
+        raise ValueError('unknown method {}'.format(method))
+    values = X.to_numpy(dtype=float)
+    std = values.std(axis=0)
+    Z = (values - values.mean(axis=0)) / np.where(std > 0, std, 1)
+    if strata is None:
+        labels = np.zeros(len(X), dtype=int)
+    elif len(strata) > 0 and isinstance(strata[0], tuple):
+        labels = np.full(len(X), -1)
+        for i, (start, end) in enumerate(strata):
+            t_start, t_end = pd.Timestamp(start, tz=X.index.tz), pd.Timestamp(end, tz=X.index.tz)
+            mask = (X.index >= t_start) & (X.index < t_end + pd.Timedelta('1D'))
+            labels[mask & (labels == -1)] = i
+    else:
+        labels = np.asarray(strata)
+    codes, _ = pd.factorize(labels)
+    sizes = np.bincount(codes)
+    rows, weights = [], []
+    for code, k_stratum in enumerate(_allocate(sizes, k)):
+        members = np.flatnonzero(codes == code)
+        if method == 'kmeans':
+            r, w = _kmeans_representatives(Z[members], k_stratum, seed)
+        else:
+            r, w = _herding_representatives(Z[members], k_stratum, seed)
+        rows.append(members[r])
+        weights.append(w * sizes[code] / len(X))
+    bg = X.iloc[np.concatenate(rows)]
+    return bg, pd.Series(np.concatenate(weights), index=bg.index, name='weight')
+
+# weighted version of shapflow's edge_credits2edge_credit: combines the edge credits of several background samples
+# (node names as keys) with their weights, e.g. of summarize_background
+def combine_edge_credits(edge_credits, weights, graph):
+    weights = np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    name2node = {node.name: node for node in graph}
+    res = FlowDefaultDict(lambda: FlowDefaultDict(int))
+    res.ecs = edge_credits
+    res.weights = weights
+    for w, ec in zip(weights, edge_credits):
+        for node1, d in ec.items():
+            for node2, val in d.items():
+                if node1 in name2node and node2 in name2node: # noise nodes that are not in the graph are skipped
+                    res[name2node[node1]][name2node[node2]] += w * np.asarray(val)
+    return res
+
+@traced()
 def read_csv_incl_timeindex(filepath):
     # expect column 'timestamp' to exist and contain valid timestamps
     df = pd.read_csv(filepath)
@@ -34,81 +384,426 @@ def get_old_feature_name(new_name):
     old_name = new_to_old_name[new_name]
     return old_name
 
+# dense representation of the edge credit of a credit flow: one row per edge, one column per foreground sample.
+# lookups of an edge are a dictionary access and summaries over many edges/periods are vectorized numpy operations
+class EdgeCreditIndex:
+    def __init__(self, credits, edges, index=None):
+        # credits: array (n_edges, n_samples), edges: list of (source name, target name), index: fg timestamps
+        self.credits = np.asarray(credits, dtype=float)
+        self.edges = list(edges)
+        self.index = pd.RangeIndex(self.credits.shape[1]) if index is None else pd.Index(index)
+        self._rows = {edge: i for i, edge in enumerate(self.edges)}
+
+    @classmethod
+    def from_credit_flow(cls, cf, index=None):
+        edges, credits = [], []
+        for node1, d in cf.edge_credit.items():
+            for node2, val in d.items():
+                edges.append((node1.name, node2.name))
+                credits.append(np.asarray(val, dtype=float).ravel())
+        n_samples = max(len(c) for c in credits)
+        # edges without any credit are stored as scalar 0
+        credits = np.vstack([np.broadcast_to(c, n_samples) if len(c) == 1 else c for c in credits])
+        return cls(credits, edges, index)
+
+    # from a DataFrame with one row per edge (index: source, target) and one column per sample, e.g. the exact
+    # credits of a linear SCM (SCM/notebooks/scripts/causal_functions.linear_edge_credit)
+    @classmethod
+    def from_frame(cls, df):
+        return cls(df.to_numpy(dtype=float), list(df.index), df.columns)
+
+    # edge credit keyed by node names, the layout of node_dict2str_dict
+    def to_dict(self):
+        res = {}
+        for (name1, name2), credit in zip(self.edges, self.credits):
+            res.setdefault(name1, {})[name2] = credit
+        return res
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __contains__(self, edge):
+        return edge in self._rows
+
+    def row(self, name1, name2):
+        try:
+            return self._rows[(name1, name2)]
+        except KeyError:
+            raise Exception("Feature not found in graph!")
+
+    def credit(self, name1, name2):
+        return self.credits[self.row(name1, name2)]
+
+    def series(self, name1, name2):
+        return pd.Series(self.credit(name1, name2), index=self.index, name='shapley-flow')
+
+    def rename(self, dict):
+        self.edges = [(dict.get(a, a), dict.get(b, b)) for a, b in self.edges]
+        self._rows = {edge: i for i, edge in enumerate(self.edges)}
+
+    def _edge_index(self, rows):
+        return pd.MultiIndex.from_tuples([self.edges[i] for i in rows], names=['source', 'target'])
+
+    def _select(self, target=None):
+        if target is None:
+            return np.arange(len(self.edges))
+        return np.array([i for i, (_, b) in enumerate(self.edges) if b == target], dtype=int)
+
+    # mean absolute credit of all edges (or of all edges into target, indexed by source)
+    def mean_abs(self, target=None):
+        rows = self._select(target)
+        values = np.abs(self.credits[rows]).mean(axis=1)
+        if target is None:
+            return pd.Series(values, index=self._edge_index(rows), name='credit')
+        return pd.Series(values, index=[self.edges[i][0] for i in rows], name='credit')
+
+    # mean absolute credit per group of samples, by is 'hour', 'month', 'dayofweek', 'year' (attribute of the
+    # timestamps), a list of (start, end) periods or an array of labels with one label per sample
+    def mean_abs_by(self, by, target=None):
+        if isinstance(by, str):
+            labels = np.asarray(getattr(self.index, by))
+        elif len(by) > 0 and isinstance(by[0], tuple):
+            labels = np.full(len(self.index), None, dtype=object)
+            for start, end in by:
+                t_start, t_end = pd.Timestamp(start, tz=self.index.tz), pd.Timestamp(end, tz=self.index.tz)
+                mask = (self.index >= t_start) & (self.index < t_end + pd.Timedelta('1D'))
+                labels[mask & pd.isnull(labels)] = '{} to {}'.format(start, end)
+        else:
+            labels = np.asarray(by)
+        valid = ~pd.isnull(labels)
+        codes, groups = pd.factorize(labels[valid], sort=True)
+        one_hot = np.zeros((valid.sum(), len(groups)))
+        one_hot[np.arange(len(codes)), codes] = 1
+        rows = self._select(target)
+        sums = np.abs(self.credits[rows][:, valid]) @ one_hot
+        index = self._edge_index(rows) if target is None else [self.edges[i][0] for i in rows]
+        return pd.DataFrame(sums / one_hot.sum(axis=0), index=index, columns=groups)
+
+    # binned dependence curve of an edge: mean, std and count of the credit per bin of the feature values
+    def dependence(self, name1, name2, values, bins=20):
+        credit = self.credit(name1, name2)
+        values = np.asarray(values, dtype=float)
+        edges = np.histogram_bin_edges(values[~np.isnan(values)], bins=bins)
+        codes = np.clip(np.digitize(values, edges[1:-1]), 0, len(edges) - 2)
+        count = np.bincount(codes, minlength=len(edges) - 1)
+        sums = np.bincount(codes, weights=credit, minlength=len(edges) - 1)
+        sums_sq = np.bincount(codes, weights=credit ** 2, minlength=len(edges) - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / count
+            std = np.sqrt(np.maximum(sums_sq / count - mean ** 2, 0))
+        return pd.DataFrame({'bin_center': (edges[:-1] + edges[1:]) / 2, 'mean': mean, 'std': std, 'count': count})
+
+# versioned on-disk format of a credit flow (replaces the dill pickles of the whole CreditFlow object).
+# a credit flow is saved as a directory with
+# - manifest.json: format version, graph (node names, flags and parents), edges, settings of the credit flow
+#   and the paths of the foreground/background samples and of the model (relative to the directory)
+# - edge_credit.npy: (n_edges, n_samples) mean edge credit over the background samples
+# - edge_credits.npy: (n_background, n_edges, n_samples) edge credit per background sample (confidence intervals)
+# - node_targets.npy: (n_nodes, n_samples) foreground values of the nodes (NaN if not available)
+# - index.npy: timestamps of the foreground samples
+# the arrays are memory mapped on load, i.e. only read when accessed
+CREDIT_FLOW_FORMAT = 'credit_flow'
+CREDIT_FLOW_VERSION = 1
+
+def _relpath(path, directory):
+    return None if path is None else os.path.relpath(path, directory)
+
+# save a credit flow in the versioned format, edge_credits is the list of edge credits per background sample
+# (node names as keys, defaults to cf.edge_credit.ecs)
+def save_credit_flow(cf, path, fg_path=None, bg_path=None, model_path=None, index=None, edge_credits=None):
+    if edge_credits is None:
+        edge_credits = getattr(cf.edge_credit, 'ecs', None)
+    nodes = list(cf.graph.nodes)
+    for node1, d in cf.edge_credit.items():
+        for node in [node1, *d.keys()]:
+            if node not in nodes:
+                nodes.append(node)
+    node2idx = {node: i for i, node in enumerate(nodes)}
+    ec_index = EdgeCreditIndex.from_credit_flow(cf, index)
+    edges = [(node2idx[node1], node2idx[node2]) for node1, d in cf.edge_credit.items() for node2 in d.keys()]
+    n_samples = ec_index.credits.shape[1]
+
+    tmp = '{}.tmp-{}'.format(path.rstrip('/'), os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    np.save(os.path.join(tmp, 'edge_credit.npy'), ec_index.credits)
+    if edge_credits:
+        ecs = np.lib.format.open_memmap(os.path.join(tmp, 'edge_credits.npy'), mode='w+', dtype=float,
+                                        shape=(len(edge_credits), len(edges), n_samples))
+        for i, ec in enumerate(edge_credits):
+            for j, (a, b) in enumerate(edges):
+                val = ec.get(nodes[a].name, {}).get(nodes[b].name, 0) if hasattr(ec, 'get') else 0
+                ecs[i, j] = np.asarray(val, dtype=float).ravel() if np.size(val) == n_samples else val
+        ecs.flush()
+        del ecs
+    targets = np.full((len(nodes), n_samples), np.nan)
+    for i, node in enumerate(nodes):
+        target = getattr(node, 'target', None)
+        if isinstance(target, np.ndarray) and target.size == n_samples:
+            targets[i] = target.ravel()
+    np.save(os.path.join(tmp, 'node_targets.npy'), targets)
+    tz = getattr(ec_index.index, 'tz', None)
+    np.save(os.path.join(tmp, 'index.npy'), np.asarray(ec_index.index if tz is None else ec_index.index.tz_localize(None)))
+
+    manifest = {
+        'format': CREDIT_FLOW_FORMAT,
+        'version': CREDIT_FLOW_VERSION,
+        'n_samples': n_samples,
+        'n_background': len(edge_credits) if edge_credits else 0,
+        'background_weights': None if getattr(cf.edge_credit, 'weights', None) is None else [float(w) for w in cf.edge_credit.weights],
+        'index_tz': None if tz is None else str(tz),
+        'nodes': [{'name': node.name,
+                   'args': [node2idx[arg] for arg in node.args if arg in node2idx],
+                   'in_graph': node in cf.graph.nodes,
+                   'is_target_node': bool(node.is_target_node),
+                   'is_noise_node': bool(node.is_noise_node),
+                   'is_dummy_node': bool(getattr(node, 'is_dummy_node', False)),
+                   'is_categorical': bool(node.is_categorical)} for node in nodes],
+        'edges': edges,
+        'settings': {'nruns': cf.nruns, 'fold_noise': cf.fold_noise, 'show_CI': cf.show_CI, 'rankdir': cf.rankdir},
+        'fg_path': _relpath(fg_path, path),
+        'bg_path': _relpath(bg_path, path),
+        'model_path': _relpath(model_path, path),
+    }
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+# convert a dill pickled credit flow (format used before CREDIT_FLOW_VERSION 1) to the versioned format
+def convert_credit_flow_pickle(pkl_file, path, fg_path=None, bg_path=None, model_path=None):
+    import dill
+    with open(pkl_file, 'rb') as file:
+        cf = dill.load(file)
+    index = read_csv_incl_timeindex(fg_path).index if fg_path is not None else None
+    save_credit_flow(cf, path, fg_path=fg_path, bg_path=bg_path, model_path=model_path, index=index)
+
+# credit flow saved with save_credit_flow. opening only reads the manifest, the edge credit is memory mapped
+# on access and a drawable CreditFlow is rebuilt on demand (attributes of CreditFlow like draw, draw_asv,
+# graph or fold_noise are forwarded to it)
+class StoredCreditFlow:
+    def __init__(self, path):
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('format') != CREDIT_FLOW_FORMAT:
+            raise ValueError('{} is not a saved credit flow'.format(path))
+        if manifest['version'] > CREDIT_FLOW_VERSION:
+            raise ValueError('credit flow format version {} is not supported (<= {})'.format(manifest['version'], CREDIT_FLOW_VERSION))
+        self.__dict__.update({'path': path, 'manifest': manifest, '_index': None, '_cf': None, '_fg': None, '_bg': None})
+
+    def _file(self, key):
+        rel = self.manifest.get(key)
+        return None if rel is None else os.path.normpath(os.path.join(self.path, rel))
+
+    @property
+    def fg_path(self):
+        return self._file('fg_path')
+
+    @property
+    def bg_path(self):
+        return self._file('bg_path')
+
+    @property
+    def model_path(self):
+        return self._file('model_path')
+
+    # csv file or part of a split manifest of gbt_data ('<split manifest>#<part>')
+    @staticmethod
+    def _read_samples(path):
+        if '#' in os.path.basename(path):
+            from gbt_data import read_split_reference
+            return read_split_reference(path)
+        return read_csv_incl_timeindex(path)
+
+    @property
+    def fg(self):
+        if self._fg is None:
+            self.__dict__['_fg'] = self._read_samples(self.fg_path)
+        return self._fg
+
+    @property
+    def bg(self):
+        if self._bg is None:
+            self.__dict__['_bg'] = self._read_samples(self.bg_path)
+        return self._bg
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+    def _timestamps(self):
+        index = pd.Index(np.load(os.path.join(self.path, 'index.npy'), allow_pickle=False))
+        if self.manifest.get('index_tz') is not None:
+            index = index.tz_localize(self.manifest['index_tz'])
+        return index
+
+    @property
+    def edge_credit_index(self):
+        if self._index is None:
+            nodes = self.manifest['nodes']
+            edges = [(nodes[a]['name'], nodes[b]['name']) for a, b in self.manifest['edges']]
+            self.__dict__['_index'] = EdgeCreditIndex(self._load('edge_credit.npy'), edges, self._timestamps())
+        return self._index
+
+    # edge credit per background sample, (n_background, n_edges, n_samples) memory mapped array or None
+    @property
+    def edge_credits(self):
+        if self.manifest['n_background'] == 0:
+            return None
+        return self._load('edge_credits.npy')
+
+    def rename(self, dict):
+        # same semantics as rename_all_nodes: the first node with the old name is renamed
+        name2node = {}
+        for node in self.manifest['nodes']:
+            if node['in_graph']:
+                name2node.setdefault(node['name'], node)
+        for old_name in dict:
+            if old_name not in name2node:
+                raise ValueError('{} is not in list'.format(old_name))
+        for old_name, new_name in dict.items():
+            name2node[old_name]['name'] = new_name
+        if self._index is not None:
+            self._index.rename(dict)
+        if self._cf is not None:
+            rename_all_nodes(self._cf.graph, dict)
+
+    # drawable CreditFlow (without model, i.e. the node functions are not restored)
+    def credit_flow(self):
+        if self._cf is not None:
+            return self._cf
+        targets = self._load('node_targets.npy')
+        nodes = []
+        for i, spec in enumerate(self.manifest['nodes']):
+            node = Node(spec['name'], is_target_node=spec['is_target_node'], is_noise_node=spec['is_noise_node'],
+                        is_dummy_node=spec['is_dummy_node'], is_categorical=spec['is_categorical'])
+            if not np.isnan(targets[i, 0]):
+                node.target = np.asarray(targets[i])
+            nodes.append(node)
+        for node, spec in zip(nodes, self.manifest['nodes']):
+            for j in spec['args']:
+                node.add_arg(nodes[j])
+        graph = Graph([node for node, spec in zip(nodes, self.manifest['nodes']) if spec['in_graph']])
+        cf = CreditFlow(graph, silent=True, **self.manifest['settings'])
+
+        ec_index = self.edge_credit_index
+        edge_credit = FlowDefaultDict(lambda: FlowDefaultDict(int))
+        for j, (a, b) in enumerate(self.manifest['edges']):
+            edge_credit[nodes[a]][nodes[b]] = ec_index.credits[j]
+        ecs = self.edge_credits
+        if ecs is not None:
+            edge_credit.ecs = []
+            for i in range(len(ecs)):
+                ec = {}
+                for j, (a, b) in enumerate(self.manifest['edges']):
+                    ec.setdefault(nodes[a].name, {})[nodes[b].name] = ecs[i, j]
+                edge_credit.ecs.append(ec)
+            if self.manifest.get('background_weights') is not None:
+                edge_credit.weights = np.asarray(self.manifest['background_weights'])
+        cf.edge_credit = edge_credit
+        cf._edge_credit_index = (edge_credit, ec_index)
+        self.__dict__['_cf'] = cf
+        return cf
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.credit_flow(), name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__ or name.startswith('_'):
+            self.__dict__[name] = value
+        else:
+            setattr(self.credit_flow(), name, value)
+
+def load_credit_flow(path):
+    return StoredCreditFlow(path)
+
+# returns the (cached) edge credit index of a credit flow
+def get_edge_credit_index(cf, index=None):
+    if isinstance(cf, EdgeCreditIndex):
+        return cf
+    if isinstance(cf, StoredCreditFlow):
+        return cf.edge_credit_index
+    if isinstance(cf, pd.DataFrame):
+        return EdgeCreditIndex.from_frame(cf)
+    cached = getattr(cf, '_edge_credit_index', None)
+    if cached is None or cached[0] is not cf.edge_credit:
+        cached = (cf.edge_credit, EdgeCreditIndex.from_credit_flow(cf, index))
+        cf._edge_credit_index = cached
+    if index is not None and cached[1].index.equals(pd.RangeIndex(len(index))):
+        cached[1].index = pd.Index(index)
+    return cached[1]
+
+# mean absolute credit of all edges for several credit flows (e.g. one per period), columns are the keys of cf_dict
+def compare_mean_abs(cf_dict, target=None):
+    return pd.DataFrame({key: get_edge_credit_index(cf).mean_abs(target) for key, cf in cf_dict.items()})
+
 def plot_dependency(name1, name2, cf, fg_values, color=True, save=False, file_name='', figsize=(8, 7), x_label='', y_label='', color_label='', scale_color=1, scale_x=1, target=None):
     # note: if name2 is target feature, do not color graph (as shapley value directy indicates prediction value)
-    for node1, d in cf.edge_credit.items():
-        for node2, val in d.items():
-            if node1.name == name1 and node2.name == name2:
-                name1_old = name1
-                df = fg_values[name1_old].copy()
-                df_shap = pd.DataFrame(val.flatten(), index=df.index, columns=['shapley-flow'])
-                df = pd.concat([df, df_shap], axis=1)
-                plt.figure(figsize=figsize)
-                plt.title('Dependence plot: {} → {}'.format(name1, name2))
-                name2_old = name2 #get_old_feature_name(name2)
-                if name2_old in fg_values.columns and color:
-                    sc = plt.scatter(x=df[name1_old]/scale_x, y=df['shapley-flow'], s=5, c=fg_values[name2_old]/scale_color, cmap='viridis')
-                    colorbar = plt.colorbar(sc)
-                    if color_label == '':
-                        colorbar.set_label(name2)
-                    else: 
-                        colorbar.set_label(color_label)
-                else:
-                    plt.scatter(x=df[name1_old]/scale_x, y=df['shapley-flow'], s=5, color=get_color(target))
-
-                if x_label == '':
-                    plt.xlabel(name1)
-                else: 
-                    plt.xlabel(x_label)
-                if y_label == '':
-                    if target == 'price':
-                        y_unit = 'EUR/MWh'
-                    elif target == 'export':
-                        y_unit = 'MW'
-                    plt.ylabel('Shapley flow value (' + y_unit + ')')
-                else:
-                    plt.ylabel(y_label)
-                
-                plt.tight_layout()
-                if save:
-                    plt.savefig("./plots/dependency_plots/{}_dependency_{}_{}.pdf".format(file_name, name1, name2))
-                plt.show()
-                return
-    raise Exception("Feature not found in graph!")
+    credit = get_edge_credit_index(cf, fg_values.index).credit(name1, name2)
+    name1_old = name1
+    df = fg_values[name1_old].copy()
+    df_shap = pd.DataFrame(credit, index=df.index, columns=['shapley-flow'])
+    df = pd.concat([df, df_shap], axis=1)
+    plt.figure(figsize=figsize)
+    plt.title('Dependence plot: {} → {}'.format(name1, name2))
+    name2_old = name2 #get_old_feature_name(name2)
+    if name2_old in fg_values.columns and color:
+        sc = plt.scatter(x=df[name1_old]/scale_x, y=df['shapley-flow'], s=5, c=fg_values[name2_old]/scale_color, cmap='viridis')
+        colorbar = plt.colorbar(sc)
+        if color_label == '':
+            colorbar.set_label(name2)
+        else: 
+            colorbar.set_label(color_label)
+    else:
+        plt.scatter(x=df[name1_old]/scale_x, y=df['shapley-flow'], s=5, color=get_color(target))
+
+    if x_label == '':
+        plt.xlabel(name1)
+    else: 
+        plt.xlabel(x_label)
+    if y_label == '':
+        if target == 'price':
+            y_unit = 'EUR/MWh'
+        elif target == 'export':
+            y_unit = 'MW'
+        plt.ylabel('Shapley flow value (' + y_unit + ')')
+    else:
+        plt.ylabel(y_label)
+    
+    plt.tight_layout()
+    if save:
+        plt.savefig("./plots/dependency_plots/{}_dependency_{}_{}.pdf".format(file_name, name1, name2))
+    plt.show()
 
 # returns a dataframe containing the mean direct credit attribution (same as the SHAP attribution, i.e. edges in causal graph from input features to target features).
 def get_mean_shap_attr(cf, target):
-    dict = {}
-    for node1, d in cf.edge_credit.items():
-        for node2, val in d.items():
-            if node2.name == target:
-                dict[node1.name] = abs(val.flatten()).mean()
-    return pd.DataFrame.from_dict(dict, orient='index', columns=['credit'])
+    return get_edge_credit_index(cf).mean_abs(target).to_frame('credit')
               
 def plot_beeswarm(cf, name1, name2, fg_values, color=False, save=False, file_name='', figsize=(8, 7)):
-    for node1, d in cf.edge_credit.items():
-        for node2, val in d.items():
-            if node1.name == name1 and node2.name == name2:
-                if color:
-                    df = fg_values[name1].copy()
-                    df_shap = pd.DataFrame(val.flatten(), index=df.index, columns=['shapley-flow'])
-                    df = pd.concat([df, df_shap], axis=1)
-                else:
-                    df = pd.DataFrame(val.flatten(), index=fg_values.index, columns=['shapley-flow'])
-                plt.figure(figsize=figsize)
-                plt.title('Beeswarm plot: {} -> {}'.format(name1, name2))
-                if name2 in fg_values.columns and color:
-                    sc = plt.scatter(x=df[name1], y=df['shapley-flow'], s=5, c=fg_values[name2], cmap='viridis')
-                    colorbar = plt.colorbar(sc)
-                    colorbar.set_label(name2, fontsize=12)
-                else:
-                    sns.swarmplot(x=df['shapley-flow'])
-                plt.xlabel(name1, fontsize=14)
-                plt.ylabel('shapley-flow', fontsize=14)
-                if save:
-                    plt.savefig("./img/dependency_plots/{}_dependency_{}_{}.pdf".format(file_name, name1, name2))
-                plt.show()
-                return   
+    ec_index = get_edge_credit_index(cf, fg_values.index)
+    if (name1, name2) not in ec_index:
+        return
+    credit = ec_index.credit(name1, name2)
+    if color:
+        df = fg_values[name1].copy()
+        df_shap = pd.DataFrame(credit, index=df.index, columns=['shapley-flow'])
+        df = pd.concat([df, df_shap], axis=1)
+    else:
+        df = pd.DataFrame(credit, index=fg_values.index, columns=['shapley-flow'])
+    plt.figure(figsize=figsize)
+    plt.title('Beeswarm plot: {} -> {}'.format(name1, name2))
+    if name2 in fg_values.columns and color:
+        sc = plt.scatter(x=df[name1], y=df['shapley-flow'], s=5, c=fg_values[name2], cmap='viridis')
+        colorbar = plt.colorbar(sc)
+        colorbar.set_label(name2, fontsize=12)
+    else:
+        sns.swarmplot(x=df['shapley-flow'])
+    plt.xlabel(name1, fontsize=14)
+    plt.ylabel('shapley-flow', fontsize=14)
+    if save:
+        plt.savefig("./img/dependency_plots/{}_dependency_{}_{}.pdf".format(file_name, name1, name2))
+    plt.show()
 
 # replaces the edge colors and edge label colors in a dot string
 def replace_dot_colors(dot_string: str, edge_color: str = None, font_color: str = None) -> str:
@@ -144,30 +839,49 @@ def add_or_replace_fontname(dot_string: str, font_name: str) -> str:
 
     return re.sub(r'\[.*?\]', replace_font_block, dot_string)
 
+# dot string of a graph with replaced colors and font
+def graph_color_font_dot(graph, edge_color=None, font_color=None, font='Helvetica'):
+    string = graph.string()
+    string_color = replace_dot_colors(string, edge_color=edge_color, font_color=font_color)
+    return add_or_replace_fontname(string_color, font_name=font)
+
+# dot string of a graph in the colors of the paper, can be rendered in batch mode (rendering.render_figures)
+def graph_paper_dot(graph, target=None, font='Helvetica'):
+    color = get_color(target)
+    return graph_color_font_dot(graph, edge_color=color, font_color=color, font=font)
+
 # save graph using this method to avoid overlapping edges (happens when using the save_graph method from shapley-flow)        
 def save_graph_color_font(graph, path_file_name, format='pdf', view=False, edge_color=None, font_color=None, font='Helvetica'):
     # file name needs to be provided without file extension
-    string = graph.string()
-    string_color = replace_dot_colors(string, edge_color=edge_color, font_color=font_color)
-    string_color_font = add_or_replace_fontname(string_color, font_name=font)
-    G = graphviz.Source(string_color_font)
+    G = graphviz.Source(graph_color_font_dot(graph, edge_color=edge_color, font_color=font_color, font=font))
     G.render(path_file_name, format=format, view=view)
 
 # rename a node in a shapley flow graph
 def rename_node(g, old_name, new_name):
-    node_names = []
-    for x in g.nodes: node_names.append(x.name)
-    index = node_names.index(old_name)
-    g.nodes[index].name = new_name
+    node = next((x for x in g.nodes if x.name == old_name), None)
+    if node is None:
+        raise ValueError('{} is not in list'.format(old_name))
+    node.name = new_name
 
 # rename all nodes in shapley flow graph according to dictionary
 def rename_all_nodes(g, dict):
+    name2node = {}
+    for x in g.nodes:
+        name2node.setdefault(x.name, x)
     for old_name, new_name in dict.items():
-        rename_node(g, old_name, new_name)
+        if old_name not in name2node:
+            raise ValueError('{} is not in list'.format(old_name))
+        name2node[old_name].name = new_name
 
 # rename nodes in creditflow object according to dict
 def rename_nodes_in_graph(cf, dict):
+    if isinstance(cf, StoredCreditFlow):
+        cf.rename(dict)
+        return
     rename_all_nodes(cf.graph, dict)
+    cached = getattr(cf, '_edge_credit_index', None)
+    if cached is not None:
+        cached[1].rename(dict)
 
 paper_rename_dict = {
     'nuclear_avail': 'Nuclear availability',